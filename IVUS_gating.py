@@ -1,20 +1,29 @@
 import numpy as np
-from PyQt5.QtWidgets import QProgressDialog
-from PyQt5.QtCore import Qt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def IVUS_gating(images, speed, frame_rate, show_progress=True):
-    """Performs gating of IVUS images"""
+def IVUS_gating(images, speed, frame_rate, show_progress=True, chunk_size=16, num_workers=0):
+    """Performs gating of IVUS images
 
-    if len(images.shape) == 4:
-        images = images[:, :, :, 0]
+    Args:
+        images: array or DICOM frame reader, pullback of shape (frames, rows, columns[, channels])
+        speed: float, pullback speed (mm/s)
+        frame_rate: float, acquisition frame rate (frames/s)
+        show_progress: bool, display a Qt progress dialog while the signals are computed
+        chunk_size: int, number of frame pairs processed in each vectorized batch
+        num_workers: int, number of worker processes, 0 or 1 computes the signals in this process
+    Returns:
+        p: list, indices of the end diastolic frames or None if cancelled
+    """
 
     num_images = images.shape[0]
-    pullback = speed*(num_images-1)/frame_rate # first image is recorded instantly so no time delay
-
-    s0 = np.zeros((num_images-1, 1))
-    s1 = np.zeros((num_images-1, 1))
 
+    callback = None
     if show_progress:
+        # imported here so that headless callers do not require PyQt
+        from PyQt5.QtWidgets import QProgressDialog
+        from PyQt5.QtCore import Qt
+
         progress = QProgressDialog()
         progress.setWindowFlags(Qt.Dialog)
         progress.setModal(True)
@@ -27,21 +36,123 @@ def IVUS_gating(images, speed, frame_rate, show_progress=True):
         progress.setWindowTitle("Computing end diastolic images")
         progress.show()
 
-    for i in range(num_images-1):
-        C = normxcorr(images[i, :, :], images[i+1, :, :])
-        s0[i] = 1 - np.max(C)
-        gradx, grady = np.gradient(images[i, :, :])
-        gradmag = abs(np.sqrt(gradx**2 + grady**2))
-        s1[i] = -np.sum(gradmag)
-        if show_progress:
-            progress.setValue(i)
-            if progress.wasCanceled():
-                break
+        def callback(done, total):
+            progress.setValue(done)
+            return not progress.wasCanceled()
+
+    signals = gating_signals(images, chunk_size, num_workers, callback)
 
     if show_progress:
         if progress.wasCanceled():
             return None
         progress.close()
+    if signals is None:
+        return None
+
+    s0, s1 = signals
+    return end_diastolic_frames(s0, s1, speed, frame_rate)
+
+def gating_signals(images, chunk_size=16, num_workers=0, callback=None):
+    """Computes the gating signals for all consecutive frame pairs.
+
+    Frames are processed in chunks so that memory is bounded by chunk_size
+    rather than pullback length. Each chunk overlaps the next by one frame.
+
+    Args:
+        images: array or DICOM frame reader, pullback of shape (frames, rows, columns[, channels])
+        chunk_size: int, number of frame pairs in each chunk
+        num_workers: int, number of worker processes, 0 or 1 computes the chunks in this process
+        callback: function, called as callback(done, total) after each chunk, returning False cancels
+    Returns:
+        (s0, s1): tuple, 1 - normalized cross correlation and negative gradient magnitude 
+            sums, each of shape (frames - 1, 1), or None if cancelled
+    """
+
+    num_images = images.shape[0]
+    num_pairs = num_images - 1
+
+    s0 = np.zeros((num_pairs, 1))
+    s1 = np.zeros((num_pairs, 1))
+    bounds = [(start, min(start + chunk_size, num_pairs)) for start in range(0, num_pairs, chunk_size)]
+
+    if num_workers > 1:
+        # keep a limited number of chunks in flight so memory stays bounded
+        with ProcessPoolExecutor(num_workers) as executor:
+            pending = deque()
+            for start, stop in bounds:
+                pending.append((start, stop, executor.submit(chunk_signals, read_chunk(images, start, stop))))
+                if len(pending) >= 2*num_workers and not _collect(pending, s0, s1, callback, num_pairs):
+                    return None
+            while pending:
+                if not _collect(pending, s0, s1, callback, num_pairs):
+                    return None
+    else:
+        for start, stop in bounds:
+            s0[start:stop, 0], s1[start:stop, 0] = chunk_signals(read_chunk(images, start, stop))
+            if callback is not None and not callback(stop, num_pairs):
+                return None
+
+    return s0, s1
+
+def _collect(pending, s0, s1, callback, num_pairs):
+    """Stores the oldest pending chunk result, returns False if cancelled"""
+
+    start, stop, future = pending.popleft()
+    s0[start:stop, 0], s1[start:stop, 0] = future.result()
+    if callback is not None and not callback(stop, num_pairs):
+        for _, _, future in pending:
+            future.cancel()
+        return False
+    return True
+
+def read_chunk(images, start, stop):
+    """Reads frames start to stop (inclusive) as a single channel array"""
+
+    chunk = np.asarray(images[start:stop + 1])
+    if chunk.ndim == 4:
+        chunk = chunk[:, :, :, 0]
+    return chunk
+
+def chunk_signals(chunk):
+    """Computes s0 and s1 for each consecutive frame pair in a chunk.
+
+    Vectorized equivalent of calling normxcorr and np.gradient per frame,
+    the per frame reductions are performed over flattened rows so that the
+    results match the per frame computation exactly.
+    """
+
+    num_pairs = chunk.shape[0] - 1
+    num_pixels = chunk.shape[1]*chunk.shape[2]
+    frames = chunk.reshape(chunk.shape[0], num_pixels)
+
+    frames_mean = np.mean(frames, axis=1, keepdims=True)
+    frames_std = np.std(frames, axis=1, keepdims=True)
+    centered = frames - frames_mean
+    C = np.sum(centered[:-1]*centered[1:], axis=1)/(frames_std[:-1, 0]*frames_std[1:, 0])
+    C = C/num_pixels
+    s0 = 1 - C
+
+    gradx, grady = np.gradient(chunk[:num_pairs], axis=(1, 2))
+    gradmag = abs(np.sqrt(gradx**2 + grady**2))
+    s1 = -np.sum(gradmag.reshape(num_pairs, num_pixels), axis=1)
+
+    return s0, s1
+
+def end_diastolic_frames(s0, s1, speed, frame_rate):
+    """Identifies end diastolic frames from the gating signals
+
+    Args:
+        s0: np.array, 1 - normalized cross correlation of consecutive frames, shape (frames - 1, 1)
+        s1: np.array, negative gradient magnitude sum of each frame, shape (frames - 1, 1)
+        speed: float, pullback speed (mm/s)
+        frame_rate: float, acquisition frame rate (frames/s)
+    Returns:
+        p: list, indices of the end diastolic frames
+    """
+
+    num_images = s0.shape[0] + 1
+    pullback = speed*(num_images-1)/frame_rate # first image is recorded instantly so no time delay
+
     # normalize data
     s0_plus = s0 - np.min(s0)
     s1_plus = s1 - np.min(s1)
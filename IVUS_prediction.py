@@ -1,7 +1,7 @@
-from PyQt5.QtWidgets import QProgressDialog, QMessageBox 
-from PyQt5.QtCore import Qt
 import numpy as np
 import os
+import threading
+import time
 import tensorflow as tf
 
 IMG_MEAN = tf.constant([60.3486, 60.3486, 60.3486], dtype=tf.float32)
@@ -10,12 +10,28 @@ num_classes = 4
 num_phenotypes = 5
 model_path = 'model/' # change this to relative filepath
 model_path =  os.path.join(os.path.dirname(os.path.realpath(__file__)), 'model')
+tflite_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'model.tflite')
 
-try:
-    model = tf.saved_model.load(model_path)
-except:
-    warning = ("Warning:  No saved weights have been found, segmentation will be unsuccessful, check that weights are saved in {}".format(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'model')))
-    print(warning)
+model = None
+model_lock = threading.Lock()
+backends = {}
+
+def get_model():
+    """Returns the SavedModel, loading it on first use.
+
+    Loading is guarded by a lock so concurrent callers share a single model.
+    """
+    global model
+    if model is None:
+        with model_lock:
+            if model is None:
+                try:
+                    model = tf.saved_model.load(model_path)
+                except:
+                    warning = ("Warning:  No saved weights have been found, segmentation will be unsuccessful, check that weights are saved in {}".format(model_path))
+                    print(warning)
+                    raise
+    return model
    
 def cast_and_center(image):
     image = tf.cast(image, dtype=tf.float32)
@@ -30,43 +46,255 @@ def set_input_channels(images, channels=3):
         images = tf.tile(images, [1, 1, 1, channels])
     return images
         
-def predict(images):
-    """Runs Convolutional Neural Network to predict image pixel class"""
-    batch_size = 64
-    dataset = tf.data.Dataset.from_tensor_slices((images))
-    dataset = dataset.map(cast_and_center)
-    dataset = dataset.batch(batch_size)
-    num_batches = int(np.ceil(images.shape[0]/batch_size))
-    
+def preprocess(image, channels=3):
+    """Casts, centers and tiles a single image to the number of network input channels"""
+    image = cast_and_center(image)
+    if len(image.get_shape()) < 3:
+        image = tf.expand_dims(image, axis=2)
+    if image.get_shape()[-1] != channels:
+        image = tf.tile(image, [1, 1, channels])
+    return image
+
+@tf.function(input_signature=[tf.TensorSpec(shape=[None, None, None, 3], dtype=tf.float32)])
+def infer(batch):
+    """Runs the network, resizes logits to the input size and returns the class of each pixel"""
+    logits = get_model()(batch, training=False)
+    logits = tf.image.resize(logits, (tf.shape(batch)[1], tf.shape(batch)[2]))
+    return tf.cast(tf.argmax(logits, axis=-1), tf.uint8)
+
+class SavedModelBackend():
+    """Runs the float32 SavedModel, frames of any size are segmented at their own size"""
+
+    image_size = None
+
+    def __call__(self, batch):
+        return infer(batch).numpy()
+
+class TFLiteBackend():
+    """Runs a TensorFlow Lite export of the model written by export_tflite.
+
+    Models exported with a dynamic input size are resized to the shape of 
+    each batch. Models with a fixed input size segment batches resized to 
+    that size and the labels are resized back by nearest neighbour. Calls 
+    are serialized as an interpreter is not thread safe.
+
+    Attributes:
+        image_size: tuple, rows and columns of a fixed size model, None if the input size is dynamic
     """
-    progress = QProgressDialog()
-    progress.setWindowFlags(Qt.Dialog)
-    progress.setModal(True)
-    progress.setMinimum(0)  
-    progress.setMaximum(num_batches - 1)
-    progress.resize(500,100)
-    progress.setValue(0)
-    progress.setValue(1)
-    progress.setValue(0) # trick to make progress bar appear
-    progress.setWindowTitle("Segmenting images")
-    progress.show()
+
+    def __init__(self, path=tflite_path):
+        if not os.path.isfile(path):
+            raise FileNotFoundError("No TFLite model found at {}, create one with deepivus export".format(path))
+        self.interpreter = tf.lite.Interpreter(model_path=path)
+        details = self.interpreter.get_input_details()[0]
+        self.input = details['index']
+        self.output = self.interpreter.get_output_details()[0]['index']
+        shape = [int(size) for size in details['shape']]
+        signature = [int(size) for size in details.get('shape_signature', details['shape'])]
+        if len(signature) != 4 or signature[3] != 3 or (signature[0] != -1 and signature[0] != 1):
+            raise ValueError("TFLite model at {} has input shape {}, expected (batch, rows, columns, 3), "
+                "export it again with deepivus export".format(path, signature))
+        # a batch dimension fixed at 1 is run one frame at a time
+        self.dynamic_batch = signature[0] == -1
+        self.image_size = None if self.resizable(signature, shape) else tuple(shape[1:3])
+        if self.image_size is not None and min(self.image_size) < 2:
+            raise ValueError("TFLite model at {} accepts neither other input sizes nor a fixed frame size, "
+                "export it again with deepivus export".format(path))
+        self.shape = None
+        self.lock = threading.Lock()
+
+    def resizable(self, signature, shape):
+        """Checks whether the input size is dynamic and the interpreter can allocate another size"""
+        if signature[1] != -1 or signature[2] != -1:
+            return False
+        try:
+            self.interpreter.resize_tensor_input(self.input, [1, shape[1] + 32, shape[2] + 32, 3])
+            self.interpreter.allocate_tensors()
+        except (RuntimeError, ValueError):
+            self.interpreter.resize_tensor_input(self.input, shape)
+            return False
+        return True
+
+    def invoke(self, batch):
+        if self.shape != batch.shape:
+            self.interpreter.resize_tensor_input(self.input, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.shape = batch.shape
+        self.interpreter.set_tensor(self.input, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output)
+
+    def __call__(self, batch):
+        frame_shape = tuple(batch.shape[1:3])
+        if self.image_size is not None and frame_shape != self.image_size:
+            batch = tf.image.resize(batch, self.image_size)
+        batch = batch.numpy()
+        with self.lock:
+            if self.dynamic_batch:
+                labels = self.invoke(batch)
+            else:
+                labels = np.concatenate([self.invoke(batch[i:i + 1]) for i in range(batch.shape[0])])
+        if self.image_size is not None and frame_shape != self.image_size:
+            labels = labels[:, nearest_indices(frame_shape[0], self.image_size[0])][:, :, nearest_indices(frame_shape[1], self.image_size[1])]
+        return labels
+
+BACKENDS = {'savedmodel': SavedModelBackend, 'tflite': TFLiteBackend}
+
+def get_backend(name='savedmodel'):
+    """Returns the inference backend, creating it on first use.
+
+    A backend is called with a batch of preprocessed images of shape
+    (batch, rows, columns, 3) and returns the class of each pixel as a
+    uint8 array of shape (batch, rows, columns). Its image_size is the 
+    input size of a fixed size model, None if frames of any size are accepted.
     """
-    pred = []
-    pheno_pred_list = []
-    for i, batch in enumerate(dataset):
-        batch = set_input_channels(batch)
-        logits = model(batch, training=False)
-        logits = tf.image.resize(logits, (tf.shape(batch)[1], tf.shape(batch)[2]))
-        pred.append(tf.argmax(logits, axis=-1, output_type=tf.dtypes.int32))
-        print('Batch {} of {} completed'.format(i+1, num_batches))
-        #progress.setValue(i)
-        #if progress.wasCanceled():
-        #    break
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend {}, choose from {}".format(name, ', '.join(BACKENDS)))
+    if name not in backends:
+        with model_lock:
+            if name not in backends:
+                backends[name] = BACKENDS[name]()
+    return backends[name]
 
-    #if progress.wasCanceled():
-    #    return None
+def export_tflite(path=tflite_path, quantization='dynamic', image_size=(512, 512), calibration=None):
+    """Converts the SavedModel, including resizing and argmax of the logits, to TensorFlow Lite
 
-    #progress.close()
-    pred = np.concatenate(pred)
-    return pred
+    The model is exported with a dynamic batch and input size so the logits are 
+    resized to the size of each batch. If the network cannot be converted with 
+    a dynamic input size it is exported at image_size and TFLiteBackend resizes 
+    frames of other sizes to it.
 
+    Args:
+        path: str, output .tflite file
+        quantization: str, 'none' keeps float32, 'dynamic' quantizes weights to int8,
+            'float16' stores weights as float16, 'int8' quantizes weights and activations
+        image_size: tuple, rows and columns of the calibration images and of the input of a fixed size export
+        calibration: array, images of shape (frames, rows, columns) used to calibrate int8 activations
+    Returns:
+        size: int, size of the exported model in bytes
+    """
+    try:
+        tflite_model = convert_tflite([None, None, None, 3], quantization, image_size, calibration)
+    except Exception as error:
+        print("Dynamic input size could not be exported ({}), exporting a {}x{} input".format(error, *image_size))
+        tflite_model = convert_tflite([None, image_size[0], image_size[1], 3], quantization, image_size, calibration)
+    with open(path, 'wb') as f:
+        f.write(tflite_model)
+    return len(tflite_model)
+
+def convert_tflite(input_shape, quantization, image_size, calibration):
+    """Traces infer with an input of input_shape and returns the converted TensorFlow Lite model"""
+    concrete = tf.function(infer.python_function).get_concrete_function(
+        tf.TensorSpec(shape=input_shape, dtype=tf.float32))
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete])
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration is None:
+            raise ValueError("int8 quantization requires calibration images")
+
+        def representative_dataset():
+            for image in calibration:
+                image = tf.image.resize(preprocess(image)[tf.newaxis], image_size)
+                yield [image]
+        converter.representative_dataset = representative_dataset
+
+    return converter.convert()
+
+def roi_box(image_shape, roi=None):
+    """Returns the row and column slices of a square field of view of roi pixels centred on the catheter
+
+    The catheter is at the image centre, the field of view is limited to the image size.
+    """
+    if not roi:
+        return slice(0, image_shape[0]), slice(0, image_shape[1])
+    rows, cols = min(roi, image_shape[0]), min(roi, image_shape[1])
+    top, left = (image_shape[0] - rows)//2, (image_shape[1] - cols)//2
+    return slice(top, top + rows), slice(left, left + cols)
+
+def nearest_indices(size, input_size):
+    """Indices of the input pixels nearest to each of size output pixels, used to upsample labels"""
+    return np.minimum(((np.arange(size) + 0.5)*input_size/size).astype(int), input_size - 1)
+
+def predict(images, batch_size=64, prefetch=2, num_parallel_calls=tf.data.experimental.AUTOTUNE, timings=None, backend='savedmodel', roi=None, scale=1.0, callback=None):
+    """Runs Convolutional Neural Network to predict image pixel class
+
+    Frames are cast, centered and tiled in a parallel tf.data pipeline which
+    prefetches the next batches while the current batch is on the network.
+
+    Args:
+        images: array or DICOM frame reader, images of shape (frames, rows, columns[, channels])
+        batch_size: int, number of images in each batch
+        prefetch: int, number of batches prepared ahead of the network
+        num_parallel_calls: int, number of images preprocessed in parallel
+        timings: dict, if given it is filled with the seconds spent in each stage
+        backend: str, inference backend, 'savedmodel' or 'tflite'
+        roi: int, size of the square field of view around the catheter that is segmented, 
+            pixels outside are labelled 0, None segments the whole frame
+        scale: float, scale of the network input relative to the frames, labels are upsampled 
+            to the frame resolution by nearest neighbour
+        callback: function, called as callback(done, total, masks) after each batch with the masks 
+            of the frames done - len(masks) to done, returning False cancels
+    Returns:
+        pred: np.array, predicted class of each pixel with shape (frames, rows, columns) or None if cancelled
+    """
+    if type(images) is np.ndarray:
+        dataset = tf.data.Dataset.from_tensor_slices((images))
+    else:
+        # stream frames from memory mapped or lazily decoded pullbacks rather than copying them into a tensor
+        dataset = tf.data.Dataset.from_generator(lambda: iter(images), output_types=tf.as_dtype(images.dtype), output_shapes=images.shape[1:])
+    rows, cols = roi_box(images.shape[1:3], roi)
+    crop_shape = (rows.stop - rows.start, cols.stop - cols.start)
+    input_shape = (max(int(round(crop_shape[0]*scale)), 1), max(int(round(crop_shape[1]*scale)), 1))
+
+    def prepare(image):
+        image = preprocess(image[rows, cols])
+        if input_shape != crop_shape:
+            image = tf.image.resize(image, input_shape)
+        return image
+
+    if input_shape != tuple(images.shape[1:3]):
+        # network input and logits are float32, logits have num_classes channels
+        batch_megabytes = batch_size*input_shape[0]*input_shape[1]*(3 + num_classes)*4/1e6
+        full_megabytes = batch_size*images.shape[1]*images.shape[2]*(3 + num_classes)*4/1e6
+        print('Segmenting a {}x{} field of view at {}x{}, network input and logits {:.1f} MB per batch instead of {:.1f} MB'.format(
+            crop_shape[0], crop_shape[1], input_shape[0], input_shape[1], batch_megabytes, full_megabytes))
+
+    dataset = dataset.map(prepare, num_parallel_calls=num_parallel_calls)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.prefetch(prefetch)
+    num_batches = int(np.ceil(images.shape[0]/batch_size))
+    run = get_backend(backend)
+
+    pred = np.zeros(images.shape[:3], dtype=np.uint8)
+    stage_times = {'input': 0.0, 'inference': 0.0, 'output': 0.0}
+    start_time = time.perf_counter()
+    batches = iter(dataset)
+    idx = 0
+    for i in range(num_batches):
+        t0 = time.perf_counter()
+        batch = next(batches)
+        t1 = time.perf_counter()
+        labels = run(batch)
+        t2 = time.perf_counter()
+        if input_shape != crop_shape:
+            labels = labels[:, nearest_indices(crop_shape[0], input_shape[0])][:, :, nearest_indices(crop_shape[1], input_shape[1])]
+        pred[idx:idx + labels.shape[0], rows, cols] = labels
+        idx += labels.shape[0]
+        t3 = time.perf_counter()
+        stage_times['input'] += t1 - t0
+        stage_times['inference'] += t2 - t1
+        stage_times['output'] += t3 - t2
+        print('Batch {} of {} completed'.format(i+1, num_batches))
+        if callback is not None and not callback(idx, images.shape[0], pred[idx - labels.shape[0]:idx]):
+            return None
+
+    stage_times['total'] = time.perf_counter() - start_time
+    stage_times['frames_per_second'] = images.shape[0]/stage_times['total'] if stage_times['total'] > 0 else 0.0
+    stage_times['inference_per_batch'] = stage_times['inference']/num_batches if num_batches else 0.0
+    print('Input {input:.2f}s, inference {inference:.2f}s ({inference_per_batch:.3f}s per batch), output {output:.2f}s, total {total:.2f}s ({frames_per_second:.1f} frames/s)'.format(**stage_times))
+    if timings is not None:
+        timings.update(stage_times)
+    return pred
@@ -0,0 +1,59 @@
+"""Compares the accuracy and CPU throughput of the inference backends.
+
+Frames sampled evenly along a pullback are segmented with each backend on
+the CPU. The frames/s of each backend is reported with the mean Dice of the
+lumen and vessel against the float32 SavedModel. Export the TFLite model
+first with deepivus export. If a field of view or input scale is given each
+backend is also run on the cropped and scaled frames.
+
+    python benchmarks/compare_backends.py path/to/file.dcm [--frames 64] [--batch-size 8] [--backends savedmodel tflite] [--roi 384] [--scale 0.5]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# compare on the CPU even when a GPU is available
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from read_dicom import DicomFrames
+from keyframes import REGIONS, dice
+
+def time_backend(predict, images, batch_size, backend, roi=None, scale=1.0):
+    """Returns the masks and frames/s, the first batch is run beforehand to exclude start-up"""
+    predict(images[:batch_size], batch_size, backend=backend, roi=roi, scale=scale)
+    start = time.perf_counter()
+    masks = predict(images, batch_size, backend=backend, roi=roi, scale=scale)
+    return masks, images.shape[0]/(time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare Dice and frames/s of the inference backends on the CPU')
+    parser.add_argument('dicom', type=str, help="Enter the path to a DICOM pullback")
+    parser.add_argument('--frames', default=64, type=int, help="Enter the number of frames segmented")
+    parser.add_argument('--batch-size', default=8, type=int, help="Enter the number of images in each batch")
+    parser.add_argument('--backends', default=['savedmodel', 'tflite'], nargs='+', type=str, help="Enter the backends to compare, the first is the reference")
+    parser.add_argument('--roi', default=None, type=int, help="Enter the size of the field of view around the catheter")
+    parser.add_argument('--scale', default=1.0, type=float, help="Enter the scale of the network input")
+    args = parser.parse_args()
+
+    from IVUS_prediction import predict
+
+    pullback = DicomFrames(args.dicom)
+    frames = np.linspace(0, pullback.shape[0] - 1, min(args.frames, pullback.shape[0])).astype(int)
+    images = pullback[frames]
+
+    configurations = [(backend, None, 1.0) for backend in args.backends]
+    if args.roi or args.scale != 1:
+        configurations += [(backend, args.roi, args.scale) for backend in args.backends]
+
+    reference = None
+    print('{:<28}{:>12}{:>12}{:>12}{:>12}'.format('Backend', 'Frames/s', 'Speed-up', 'Lumen Dice', 'Vessel Dice'))
+    for backend, roi, scale in configurations:
+        masks, frames_per_second = time_backend(predict, images, args.batch_size, backend, roi, scale)
+        if reference is None:
+            reference = masks
+            reference_speed = frames_per_second
+        agreement = [np.mean([dice(mask, reference_mask, labels) for mask, reference_mask in zip(masks, reference)]) for labels in REGIONS.values()]
+        name = backend if roi is None and scale == 1 else '{} roi {} scale {}'.format(backend, roi or 'full', scale)
+        print('{:<28}{:>12.1f}{:>12.2f}{:>12.4f}{:>12.4f}'.format(name, frames_per_second, frames_per_second/reference_speed, *agreement))
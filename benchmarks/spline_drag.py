@@ -0,0 +1,61 @@
+"""Measures the cost of a knot drag event against the number of knots.
+
+For each knot count a closed contour is dragged by moving one knot through a
+sequence of positions and the spline is fitted exactly on every event, as in
+the display. The latency of a fit is reported with the latency of a cached
+evaluation, which is the cost of revisiting a frame whose knots are unchanged.
+
+    python benchmarks/spline_drag.py [--knots 10 20 40 80] [--events 200]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from spline import SplineEngine
+
+def contour(num_knots, seed=0):
+    """Returns the knots of a noisy closed contour, the last knot is a copy of the first"""
+    rng = np.random.RandomState(seed)
+    theta = np.linspace(0, 2*np.pi, num_knots)
+    radius = 150 + 20*rng.rand(num_knots)
+    radius[-1] = radius[0]
+    return [list(400 + radius*np.cos(theta)), list(400 + radius*np.sin(theta))]
+
+def drag_path(knotPoints, idx, num_events):
+    """Positions of a knot dragged 30 pixels outwards"""
+    offset = 30*np.sin(np.linspace(0, np.pi/2, num_events))
+    return knotPoints[0][idx] + offset, knotPoints[1][idx] + offset/2
+
+def time_drag(engine, knotPoints, idx, path):
+    knots = [list(knotPoints[0]), list(knotPoints[1])]
+    start = time.perf_counter()
+    for x, y in zip(*path):
+        knots[0][idx] = x
+        knots[1][idx] = y
+        engine.fit(knots)
+    return (time.perf_counter() - start)/len(path[0])
+
+def time_cached(engine, knotPoints, num_events):
+    engine.evaluate(knotPoints, 'frame')
+    start = time.perf_counter()
+    for i in range(num_events):
+        engine.evaluate(knotPoints, 'frame')
+    return (time.perf_counter() - start)/num_events
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure spline drag event latency against knot count')
+    parser.add_argument('--knots', default=[10, 20, 40, 80, 160], nargs='+', type=int, help="Enter the knot counts to measure")
+    parser.add_argument('--events', default=200, type=int, help="Enter the number of drag events for each knot count")
+    args = parser.parse_args()
+
+    engine = SplineEngine()
+    print('{:>8}{:>16}{:>16}'.format('Knots', 'Fit (ms)', 'Cached (ms)'))
+    for num_knots in args.knots:
+        knotPoints = contour(num_knots)
+        path = drag_path(knotPoints, num_knots//3, args.events)
+        fit = time_drag(engine, knotPoints, num_knots//3, path)
+        cached = time_cached(engine, knotPoints, args.events)
+        print('{:>8}{:>16.3f}{:>16.4f}'.format(num_knots, 1000*fit, 1000*cached))
@@ -0,0 +1,84 @@
+"""Measures CLI start-up time and which heavy packages each command imports.
+
+Each command is run in a fresh interpreter, the wall time is reported along
+with whether tensorflow, PyQt5 and skimage were imported. If no DICOM file is
+given a small synthetic pullback is written to a temporary folder.
+
+    python benchmarks/startup.py [--dicom path/to/file.dcm] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PACKAGES = ['tensorflow', 'PyQt5', 'skimage']
+
+RUNNER = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+sys.argv = ['deepivus'] + {argv!r}
+import DeepIVUS
+try:
+    DeepIVUS.cli(standalone_mode=False)
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'imported': [name for name in {packages!r} if name in sys.modules]}}))
+"""
+
+def write_pullback(path, num_frames=120, size=128, frame_rate=30):
+    """Writes a synthetic multi-frame DICOM with a periodic intensity change"""
+    from pydicom.dataset import Dataset, FileDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    rng = np.random.RandomState(0)
+    t = np.arange(num_frames)
+    images = rng.randint(0, 255, (num_frames, size, size))*0.3 + (60*np.sin(2*np.pi*t/frame_rate) + 100)[:, None, None]
+    images = np.clip(images, 0, 255).astype(np.uint8)
+
+    meta = Dataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.3.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0'*128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.Rows, ds.Columns, ds.NumberOfFrames = size, size, num_frames
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 8, 8, 7, 0
+    ds.CineRate = frame_rate
+    ds.PixelSpacing = [0.02, 0.02]
+    ds.IVUSPullbackRate = 0.5
+    ds.PixelData = images.tobytes()
+    ds.save_as(path)
+
+def run(argv, cwd):
+    code = RUNNER.format(root=ROOT, argv=argv, packages=PACKAGES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure DeepIVUS CLI start-up time and heavy imports')
+    parser.add_argument('--dicom', default='', type=str, help="Enter the path to a DICOM pullback used for the gate command")
+    parser.add_argument('--repeat', default=3, type=int, help="Enter the number of runs of each command")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        dicom_path = args.dicom
+        if not dicom_path:
+            dicom_path = os.path.join(folder, 'pullback.dcm')
+            write_pullback(dicom_path)
+
+        commands = [['--help'], ['gate', '--help'], ['gate', os.path.abspath(dicom_path)], ['segment', '--help'], ['gui', '--help']]
+        print('{:<40}{:>10}  {}'.format('Command', 'Time (s)', 'Heavy imports'))
+        for argv in commands:
+            results = [run(argv, folder) for i in range(args.repeat)]
+            seconds = min(result['seconds'] for result in results)
+            imported = ', '.join(results[-1]['imported']) or 'none'
+            print('{:<40}{:>10.3f}  {}'.format('deepivus ' + ' '.join(argv[:1] + ['DICOM' if os.path.isfile(arg) else arg for arg in argv[1:]]), seconds, imported))
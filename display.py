@@ -1,11 +1,59 @@
 from geometry import Point, Spline, Line, Marker, Arrowbody, Arrowhead
+from spline import SplineEngine
+from picking import PointIndex
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsPathItem, QGraphicsLineItem, QHBoxLayout, QWidget, QFrame
 from PyQt5.QtCore import Qt, QPointF, pyqtSignal, QPoint, QLineF
 from PyQt5.QtGui import QPixmap, QImage, QPen, QColor, QFont, QPainter, QPainterPath
 import math
+from bisect import bisect_left
+from collections import OrderedDict
 import numpy as np
 from PIL import ImageDraw, Image
 
+def frame_image(images, frame, display_size):
+    """Returns a frame as a QImage scaled to the display size, the image owns its data"""
+
+    if len(images.shape) == 3:
+        current_image = np.ascontiguousarray(images[frame, :, :], dtype=np.uint8)
+        image = QImage(current_image.data, images.shape[2], images.shape[1], images.shape[2], QImage.Format_Grayscale8)
+    else:
+        current_image = images[frame, :, :, :].astype(np.uint8, order='C', casting='unsafe')
+        image = QImage(current_image.data, images.shape[2], images.shape[1], 3*images.shape[2], QImage.Format_RGB888)
+    if image.width() == display_size and image.height() == display_size:
+        # scaling to the same size would share the array buffer
+        return image.copy()
+    return image.scaled(display_size, display_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+class PixmapCache():
+    """Least recently used cache of frame pixmaps scaled to the display size.
+
+    Attributes:
+        capacity: int, maximum number of pixmaps held
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.pixmaps = OrderedDict()
+
+    def __contains__(self, frame):
+        return frame in self.pixmaps
+
+    def get(self, frame):
+        """Returns the pixmap of a frame or None if it is not cached"""
+        pixmap = self.pixmaps.get(frame)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(frame)
+        return pixmap
+
+    def put(self, frame, pixmap):
+        self.pixmaps[frame] = pixmap
+        self.pixmaps.move_to_end(frame)
+        while len(self.pixmaps) > self.capacity:
+            self.pixmaps.popitem(last=False)
+
+    def clear(self):
+        self.pixmaps.clear()
+
 class LesionView(QGraphicsView):
     """Displays graphical lesion analysis in the longitudinal view.
 
@@ -33,21 +81,23 @@ class LesionView(QGraphicsView):
         
     def createPolygon(self, lview_lumenY, lview_plaqueY, lview_lumen, lview_plaque):
         """Updates the lview"""
-        print('poly', len(lview_lumenY), len(lview_lumen))
         lview_lumen1, lview_lumen2 = [], []
         lview_plaque1, lview_plaque2 = [], []
         lview_lumenY1, lview_plaqueY1 = [], []
+        self.lumenFrames, self.plaqueFrames = [], []
         for i in range(len(lview_lumen)):
             if lview_lumen[i] is not None:
                 lview_lumen1.append(self.lview_height//2 - lview_lumen[i]*(self.lview_height//2))
                 lview_lumen2.append(self.lview_height//2 + lview_lumen[i]*(self.lview_height//2))
                 lview_lumenY1.append(lview_lumenY[i])
+                self.lumenFrames.append(i)
                 
         for i in range(len(lview_plaque)):
             if lview_plaque[i] is not None:
                 lview_plaque1.append(self.lview_height//2 - lview_plaque[i]*(self.lview_height//2))
                 lview_plaque2.append(self.lview_height//2 + lview_plaque[i]*(self.lview_height//2))
                 lview_plaqueY1.append(lview_plaqueY[i])
+                self.plaqueFrames.append(i)
 
         lumen_polygon = []
         plaque_polygon = []
@@ -71,8 +121,6 @@ class LesionView(QGraphicsView):
     def createImage(self, lview_lumenY, lview_plaqueY, lview_lumen, lview_plaque):
         """creates a cartoon image of lumen area"""
         lumen_polygon, plaque_polygon = self.createPolygon(lview_lumenY, lview_plaqueY, lview_lumen, lview_plaque)
-        print(lumen_polygon)
-        print(plaque_polygon)
         
         # L is grayscale
         image = Image.new('RGB', (self.lview_height, self.lview_length), (128, 128, 128)) #gray
@@ -100,6 +148,84 @@ class LesionView(QGraphicsView):
         image = QImage(lesion.data, lesion.shape[1], lesion.shape[0], bytesPerLine, QImage.Format_RGBA8888).scaled(self.lview_length, self.lview_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) 
         pixmap = QPixmap.fromImage(image)
         self.pixmap = self.scene.addPixmap(pixmap)           
+
+    def lesionPositions(self, lesion):
+        """Returns the scene positions of the MLA and MPB markers, start, end and middle of a lesion"""
+        lesion_mla = lesion['MLA idx']/self.numberOfFrames * self.lview_length
+        lesion_mpb = lesion['MPB idx']/self.numberOfFrames * self.lview_length
+        lesion_start = lesion['idx'][0]/self.numberOfFrames * self.lview_length
+        lesion_end = lesion['idx'][-1]/self.numberOfFrames * self.lview_length
+        lesion_mid = lesion_start + (lesion_end - lesion_start)/2
+
+        if lesion_mla < 40:
+            lesion_mla = lesion_mla + 40
+        elif lesion_mla > self.lview_length - 90:
+            lesion_mla = lesion_mla - 90
+        
+        if lesion_mpb < 40:
+            lesion_mpb = lesion_mpb + 40
+        elif lesion_mpb > self.lview_length - 90:
+            lesion_mpb = lesion_mpb - 90
+
+        return lesion_mla, lesion_mpb, lesion_start, lesion_end, lesion_mid
+
+    def updateLesion(self, i, lesion):
+        """Moves the MLA and MPB markers of lesion i, the lesion frames must be unchanged"""
+        lesion_mla, lesion_mpb, _, _, _ = self.lesionPositions(lesion)
+        items = self.lesionItems[i]
+        items['mla'].update(lesion_mla)
+        items['mla_text'].setPos(lesion_mla, self.lview_height//2)
+        items['mpb'].update(lesion_mpb)
+        items['mpb_text'].setPos(lesion_mpb, self.lview_height//2)
+
+    def updateFrame(self, frame, lview_lumen, lview_plaque):
+        """Redraws the rows of the vessel cartoon affected by an edit of a single frame.
+
+        The rows from the contour frames either side of the edited frame are 
+        drawn again from the polygon segments crossing them, the frames with 
+        contours must be unchanged since the scene was created.
+        """
+        lo, hi = None, None
+        for frames, lviewY in ((self.lumenFrames, self.lview_lumenY), (self.plaqueFrames, self.lview_plaqueY)):
+            idx = bisect_left(frames, frame)
+            if idx == len(frames) or frames[idx] != frame:
+                continue
+            # outlines of edges spanning few rows also cover pixels in the rows of the neighbouring frames
+            start = int(lviewY[frames[max(idx - 1, 0)]])
+            stop = int(lviewY[frames[min(idx + 1, len(frames) - 1)]])
+            lo = start if lo is None else min(lo, start)
+            hi = stop if hi is None else max(hi, stop)
+        if lo is None:
+            return
+
+        # polygons of the frames within the rows and the next frame beyond them on either side
+        polygons = []
+        for frames, lviewY, lview in ((self.lumenFrames, self.lview_lumenY, lview_lumen), (self.plaqueFrames, self.lview_plaqueY, lview_plaque)):
+            first = last = bisect_left(frames, frame)
+            while first > 0 and int(lviewY[frames[first - 1]]) >= lo:
+                first -= 1
+            while last < len(frames) and int(lviewY[frames[last]]) <= hi:
+                last += 1
+            segment = frames[max(first - 1, 0):last + 1]
+            polygon = [(int(self.lview_height//2 - lview[i]*(self.lview_height//2)), int(lviewY[i]) - lo) for i in segment]
+            polygon += [(int(self.lview_height//2 + lview[i]*(self.lview_height//2)), int(lviewY[i]) - lo) for i in reversed(segment)]
+            polygons.append(polygon)
+        lumen_polygon, plaque_polygon = polygons
+
+        image = Image.new('RGB', (self.lview_height, hi - lo + 1), (128, 128, 128)) #gray
+        if plaque_polygon:
+            ImageDraw.Draw(image).polygon(plaque_polygon, outline=1, fill=255)
+        if lumen_polygon:
+            ImageDraw.Draw(image).polygon(lumen_polygon, outline=1, fill=1)
+        strip = np.transpose(np.array(image), [1, 0, 2]).copy()
+        self.cartoon[:, lo:hi + 1] = strip
+
+        stripImage = QImage(strip.data, strip.shape[1], strip.shape[0], 3*strip.shape[1], QImage.Format_RGB888)
+        pixmap = self.cartoonItem.pixmap()
+        painter = QPainter(pixmap)
+        painter.drawImage(lo, 0, stripImage)
+        painter.end()
+        self.cartoonItem.setPixmap(pixmap)
        
     def createArrow(self, lesion_start, lesion_end, lesion_mid, direction="left"):
         
@@ -129,34 +255,24 @@ class LesionView(QGraphicsView):
         
         image = self.createImage(lview_lumenY, lview_plaqueY, lview_lumen, lview_plaque)
         self.imsize = image.shape
+        # the cartoon is drawn at the scene size so single frame edits can redraw part of it
+        self.cartoon = image
         
         bytesPerLine = 3*self.imsize[1]
 
         image = QImage(image.data, image.shape[1], image.shape[0], bytesPerLine, QImage.Format_RGB888).scaled(self.lview_length, self.lview_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) 
         pixmap = QPixmap.fromImage(image)
         self.pixmap = self.scene.addPixmap(pixmap)        
+        self.cartoonItem = self.pixmap
 
         self.marker = Marker(self.pos, self.lview_height, self.lview_length)
         self.scene.addItem(self.marker)
 
         num_lesions = len(lesion_info)
+        self.lesionItems = []
 
         for i in range(num_lesions):
-            lesion_mla = lesion_info[i]['MLA idx']/self.numberOfFrames * self.lview_length
-            lesion_mpb = lesion_info[i]['MPB idx']/self.numberOfFrames * self.lview_length
-            lesion_start = lesion_info[i]['idx'][0]/self.numberOfFrames * self.lview_length
-            lesion_end = lesion_info[i]['idx'][-1]/self.numberOfFrames * self.lview_length
-            lesion_mid = lesion_start + (lesion_end - lesion_start)/2
-
-            if lesion_mla < 40:
-                lesion_mla = lesion_mla + 40
-            elif lesion_mla > self.lview_length - 90:
-                lesion_mla = lesion_mla - 90
-            
-            if lesion_mpb < 40:
-                lesion_mpb = lesion_mpb + 40
-            elif lesion_mpb > self.lview_length - 90:
-                lesion_mpb = lesion_mpb - 90
+            lesion_mla, lesion_mpb, lesion_start, lesion_end, lesion_mid = self.lesionPositions(lesion_info[i])
                 
             self.mla_marker = Marker(lesion_mla, self.lview_height, self.lview_length, [255,255,0], dashed=True)
             self.scene.addItem(self.mla_marker)
@@ -166,6 +282,7 @@ class LesionView(QGraphicsView):
             textArea.setPos(lesion_mla, self.lview_height//2)
             textArea.setDefaultTextColor(QColor(255, 255, 0))
             textArea.setFont(QFont('Roboto'))
+            mla_text = textArea
   
             self.mpb_marker = Marker(lesion_mpb, self.lview_height, self.lview_length, [255,255,0], dashed=True)
             self.scene.addItem(self.mpb_marker)
@@ -174,6 +291,7 @@ class LesionView(QGraphicsView):
             textArea.setPos(lesion_mpb, self.lview_height//2)
             textArea.setDefaultTextColor(QColor(255, 255, 0))
             textArea.setFont(QFont('Roboto'))
+            self.lesionItems.append({'mla': self.mla_marker, 'mla_text': mla_text, 'mpb': self.mpb_marker, 'mpb_text': textArea})
             
             self.createArrow(lesion_start, lesion_end, lesion_mid, direction="left")
             self.createArrow(lesion_start, lesion_end, lesion_mid, direction="right")
@@ -249,9 +367,7 @@ class LView(QGraphicsView):
         # create marker for display current cross section in lview mode
         self.scene.clear()
         
-        bytesPerLine = lview_array.shape[1]*1
-        image = QImage(lview_array.data, lview_array.shape[1], lview_array.shape[0], bytesPerLine, QImage.Format_Grayscale8).scaled(self.lview_length, self.lview_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) 
-        pixmap = QPixmap.fromImage(image)
+        pixmap = QPixmap.fromImage(self.lviewImage(lview_array))
         lview_image = QGraphicsPixmapItem(pixmap)
         self.pixmap = self.scene.addPixmap(pixmap) 
 
@@ -302,6 +418,7 @@ class LView(QGraphicsView):
         self.pathLumenItem2.setPen(QPen(Qt.red, 2))
 
         contour_frames = [i for i in range(len(self.lview_lumen1)) if self.lview_lumen1[i] is not None]
+        self.lumenFrames = contour_frames
         if contour_frames:
             first_idx = min(contour_frames)
             l1 = QPointF(self.lview_lumenY[first_idx], self.lview_lumen1[first_idx])
@@ -326,6 +443,7 @@ class LView(QGraphicsView):
         self.pathVesselItem2.setPen(QPen(Qt.yellow, 2))
 
         contour_frames = [i for i in range(len(self.lview_plaque1)) if self.lview_plaque1[i] is not None]
+        self.vesselFrames = contour_frames
         if contour_frames:
             first_idx = min(contour_frames)
             v1 = QPointF(self.lview_plaqueY[first_idx], self.lview_plaque1[first_idx])
@@ -344,15 +462,31 @@ class LView(QGraphicsView):
             self.scene.addItem(self.pathVesselItem2)               
             
     def updateImage(self, lview_array):
-        bytesPerLine = lview_array.shape[1]*1
-        image = QImage(lview_array.data, lview_array.shape[1], lview_array.shape[0], bytesPerLine, QImage.Format_Grayscale8).scaled(self.lview_length, self.lview_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) 
-        pixmap = QPixmap.fromImage(image)
+        pixmap = QPixmap.fromImage(self.lviewImage(lview_array))
         self.pixmap.setPixmap(pixmap)
         
+    def lviewImage(self, lview_array):
+        """Converts the lview array to an image at the view size, arrays resampled to the view size are not scaled again"""
+        bytesPerLine = lview_array.shape[1]*1
+        image = QImage(lview_array.data, lview_array.shape[1], lview_array.shape[0], bytesPerLine, QImage.Format_Grayscale8)
+        if lview_array.shape[:2] == (self.lview_height, self.lview_length):
+            return image
+        return image.scaled(self.lview_length, self.lview_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
     def updateMarker(self, pos):
         self.marker.setLine(pos, 0, pos, self.lview_height)
         
     def updateLViewContours(self, lview_lumenY, lview_plaqueY, lview_lumen1, lview_lumen2, lview_plaque1, lview_plaque2):
+        """Moves the path elements to new lview positions, the paths are created again if frames gained or lost a contour"""
+
+        lumenFrames = [i for i in range(len(lview_lumen1)) if lview_lumen1[i] is not None]
+        vesselFrames = [i for i in range(len(lview_plaque1)) if lview_plaque1[i] is not None]
+        if lumenFrames != self.lumenFrames or vesselFrames != self.vesselFrames:
+            for item in (self.pathLumenItem1, self.pathLumenItem2, self.pathVesselItem1, self.pathVesselItem2):
+                if item.scene() is not None:
+                    self.scene.removeItem(item)
+            self.createLViewContours(lview_lumenY, lview_plaqueY, lview_lumen1, lview_lumen2, lview_plaque1, lview_plaque2)
+            return
 
         self.lview_lumenY = lview_lumenY
         self.lview_plaqueY = lview_plaqueY
@@ -362,39 +496,52 @@ class LView(QGraphicsView):
         self.lview_plaque1 = lview_plaque1
         self.lview_plaque2 = lview_plaque2
 
-        #pathLumen1 = self.scene.pathLumenItem1.path()
-        #pathLumen2 = self.pathLumenItem2.path()
         pathLumen1 = self.pathLumenItem1.path()
         pathLumen2 = self.pathLumenItem2.path()
         
         pathVessel1 = self.pathVesselItem1.path()
         pathVessel2 = self.pathVesselItem2.path()
 
-        idx = 0
-        print(len(self.lview_lumenY), len(self.lview_lumen1), pathLumen1.elementCount())
-        for i in range(len(self.lview_lumen1)):
-            if self.lview_lumen1[i] is None:
-                continue
-            print(i, idx, 'l', pathLumen1.elementAt(idx).x, 'l',pathLumen1.elementAt(idx).y)
-            pathLumen1.setElementPositionAt(idx, self.lview_lumenY[i], self.lview_lumen1[i])
-            pathLumen2.setElementPositionAt(idx, self.lview_lumenY[i], self.lview_lumen2[i])
-            print(i, idx, 'l', lview_lumenY[i], pathLumen1.elementAt(idx).x, 'l',pathLumen1.elementAt(idx).y)
-            idx += 1
+        # element 0 moves to the first frame and is followed by a line to every frame with a contour
+        for idx, i in enumerate(self.lumenFrames):
+            if idx == 0:
+                pathLumen1.setElementPositionAt(0, self.lview_lumenY[i], self.lview_lumen1[i])
+                pathLumen2.setElementPositionAt(0, self.lview_lumenY[i], self.lview_lumen2[i])
+            pathLumen1.setElementPositionAt(idx + 1, self.lview_lumenY[i], self.lview_lumen1[i])
+            pathLumen2.setElementPositionAt(idx + 1, self.lview_lumenY[i], self.lview_lumen2[i])
         self.pathLumenItem1.setPath(pathLumen1)        
         self.pathLumenItem2.setPath(pathLumen2)  
 
-        idx = 0
-        print(len(self.lview_plaqueY), len(self.lview_plaque1), pathVessel1.elementCount())
-        for i in range(len(self.lview_plaque1)):
-            if self.lview_plaque1[i] is None:
-                continue
-            print(i, idx ,'p',pathVessel1.elementAt(idx).x, 'p',pathVessel1.elementAt(idx).y)
-            pathVessel1.setElementPositionAt(idx, self.lview_plaqueY[i], self.lview_plaque1[i])
-            pathVessel2.setElementPositionAt(idx, self.lview_plaqueY[i], self.lview_plaque2[i])
-            idx += 1
+        for idx, i in enumerate(self.vesselFrames):
+            if idx == 0:
+                pathVessel1.setElementPositionAt(0, self.lview_plaqueY[i], self.lview_plaque1[i])
+                pathVessel2.setElementPositionAt(0, self.lview_plaqueY[i], self.lview_plaque2[i])
+            pathVessel1.setElementPositionAt(idx + 1, self.lview_plaqueY[i], self.lview_plaque1[i])
+            pathVessel2.setElementPositionAt(idx + 1, self.lview_plaqueY[i], self.lview_plaque2[i])
         self.pathVesselItem1.setPath(pathVessel1)        
         self.pathVesselItem2.setPath(pathVessel2)  
 
+    def updateFrame(self, frame):
+        """Moves the path elements of a single frame to the current lview positions.
+
+        The frames with contours must be unchanged since the paths were created, 
+        returns False if the frame has no element in either path.
+        """
+        updated = False
+        for frames, lviewY, items, values in ((self.lumenFrames, self.lview_lumenY, (self.pathLumenItem1, self.pathLumenItem2), (self.lview_lumen1, self.lview_lumen2)),
+            (self.vesselFrames, self.lview_plaqueY, (self.pathVesselItem1, self.pathVesselItem2), (self.lview_plaque1, self.lview_plaque2))):
+            idx = bisect_left(frames, frame)
+            if idx == len(frames) or frames[idx] != frame:
+                continue
+            for item, value in zip(items, values):
+                path = item.path()
+                if idx == 0:
+                    path.setElementPositionAt(0, lviewY[frame], value[frame])
+                path.setElementPositionAt(idx + 1, lviewY[frame], value[frame])
+                item.setPath(path)
+            updated = True
+        return updated
+
                     
 class Display(QGraphicsView):
     """Displays images and contours.
@@ -411,11 +558,16 @@ class Display(QGraphicsView):
         activePoint: Point, active point in spline
         innerPoint: list, spline points for inner (lumen) contours
         outerPoint: list, spline points for outer (plaque) contours
+        pixmapCache: PixmapCache, scaled pixmaps of recently displayed and prefetched frames
+        showEcho: bool, indicates whether the echogenicity overlay is displayed
+        allocations: int, number of scene items created since the display was created
+        frameAllocations: int, number of scene items created by the last frame change
     """
     lviewChangedSignal = pyqtSignal(int, int, int, int)
     frameChangedKeySignal = pyqtSignal(object)
     contourUpdatedSignal = pyqtSignal(bool)
-    def __init__(self):
+    frameContourUpdatedSignal = pyqtSignal(int)
+    def __init__(self, cache_size=32, read_ahead=12):
         super(Display, self).__init__()
         print("View Height: {}, View Width: {}".format(self.width(), self.height()))
 
@@ -440,34 +592,62 @@ class Display(QGraphicsView):
         self.outerPoint = []
         self.display_size = 800
         self.allow_update = False
+        self.images = None
+        self.pixmapCache = PixmapCache(cache_size)
+        self.readAhead = read_ahead
+        self.direction = 1
+        self.prefetcher = None
+        self.showEcho = False
+        self.allocations = 0
+        self.frameAllocations = 0
 
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
 
+        # items are created once and updated in place when the frame changes
         self.crossCoords = [0, 400, 800, 400] 
-        self.cross = Line(self.crossCoords, self.display_size)
-        self.scene.addItem(self.cross)
+        self.cross = self.addSceneItem(Line(self.crossCoords, self.display_size))
 
-        self.image = QGraphicsPixmapItem(QPixmap(self.display_size, self.display_size))
-        self.scene.addItem(self.image)
+        self.image = self.addSceneItem(QGraphicsPixmapItem(QPixmap(self.display_size, self.display_size)))
+        self.image.setZValue(1)
+        self.echoMap = None
+        self.innerSpline = None
+        self.outerSpline = None
+        self.innerPool = []
+        self.outerPool = []
+        self.manualItems = []
+        self.splineEngine = SplineEngine()
+        self.pickIndex = PointIndex([], [])
         self.setScene(self.scene)
 
-    def findItem(self, item, eventPos):
-        """Sets the active point for interaction"""
+    def addSceneItem(self, item):
+        """Adds a new item to the scene and counts the allocation"""
+        self.allocations += 1
+        self.scene.addItem(item)
+        return item
 
-        min_dist = 10
- 
-        pos = item.mapFromScene(self.mapToScene(eventPos))
+    def updatePickIndex(self):
+        """Indexes the displayed knot points and crossbar ends for hit-testing
 
-        dist = item.select_point(pos)
+        Labels are (1, knot) for lumen points, (2, knot) for vessel points and 
+        (3, end) for the crossbar ends, matching activeContour.
+        """
 
-        if dist < min_dist:
-            item.updateColor()
-            self.enable_drag = True
-            self.activePoint = item
-        else:
-            self.activePoint = None
-            print("No active point")
+        x = [self.crossCoords[0], self.crossCoords[2]]
+        y = [self.crossCoords[1], self.crossCoords[3]]
+        labels = [(3, 0), (3, 1)]
+        for contour, points in ((1, self.innerPoint), (2, self.outerPoint)):
+            for idx, point in enumerate(points):
+                pos = point.getPoint()
+                x.append(pos[0])
+                y.append(pos[1])
+                labels.append((contour, idx))
+        self.pickIndex = PointIndex(x, y, labels)
+
+    def pick(self, pos, max_distance=10):
+        """Returns the label of the knot point or crossbar end within max_distance of a scene position, None if there is none"""
+        label, _ = self.pickIndex.nearest(pos.x(), pos.y(), max_distance)
+        return label
 
     def keyPressEvent(self, event):
         """Key events."""
@@ -480,33 +660,20 @@ class Display(QGraphicsView):
             pos = self.mapToScene(event.pos())
             self.addManualSpline(pos)
         else:
-            # identify which point has been clicked
-            items = self.items(event.pos())
-            for item in items:
-                if item in self.innerPoint:
-                    # Convert mouse position to item position https://stackoverflow.com/questions/53627056/how-to-get-cursor-click-position-in-qgraphicsitem-coordinate-system
-                    self.pointIdx = [i for i, checkItem in enumerate(self.innerPoint) if item == checkItem][0]
-                    #print(self.pointIdx, 'Item found')
-                    self.activeContour = 1
-                    self.findItem(item, event.pos())
-                elif item in self.outerPoint:
-                    self.pointIdx = [i for i, checkItem in enumerate(self.outerPoint) if item == checkItem][0]
-                    self.activeContour = 2
-                    self.findItem(item, event.pos())
-                elif item == self.cross:
-                    clickedPoint = self.mapToScene(event.pos())
-                    dist = [np.sqrt((clickedPoint.x() - self.crossCoords[0])**2 +
-                            (clickedPoint.y() - self.crossCoords[1])**2),
-                            np.sqrt((clickedPoint.x() - self.crossCoords[2])**2 +
-                            (clickedPoint.y() - self.crossCoords[3])**2)]
-
-                    if min(dist) < 10:
-                        self.allow_update = True
-                    else:
-                        self.allow_update = False
-
-                    self.activeContour = 3
-                    self.activePoint = item
+            # identify which point or crossbar end has been clicked
+            label = self.pick(self.mapToScene(event.pos()))
+            if label is None:
+                return
+            contour, idx = label
+            self.activeContour = contour
+            if contour == 3:
+                self.allow_update = True
+                self.activePoint = self.cross
+            else:
+                self.pointIdx = idx
+                self.activePoint = self.innerPoint[idx] if contour == 1 else self.outerPoint[idx]
+                self.activePoint.updateColor()
+                self.enable_drag = True
                     
     def mouseReleaseEvent(self, event):
         print(f"Active item is {self.activeContour}")
@@ -516,14 +683,19 @@ class Display(QGraphicsView):
             item.resetColor()
 
             if self.activeContour == 1:
+                self.innerSpline.endDrag()
                 self.lumen[0][self.frame] = [val/contour_scaling_factor for val in self.innerSpline.knotPoints[0]]
                 self.lumen[1][self.frame] = [val/contour_scaling_factor for val in self.innerSpline.knotPoints[1]]
             elif self.activeContour == 2:
+                self.outerSpline.endDrag()
                 self.plaque[0][self.frame] = [val/contour_scaling_factor for val in self.outerSpline.knotPoints[0]]  
                 self.plaque[1][self.frame] = [val/contour_scaling_factor for val in self.outerSpline.knotPoints[1]]
             self.pointIdx = None
-            self.contourUpdatedSignal.emit(True)
+            self.updatePickIndex()
+            # dragging a point only changes the contour of the current frame
+            self.frameContourUpdatedSignal.emit(self.frame)
         if self.activeContour == 3:
+            self.updatePickIndex()
             self.lviewChangedSignal.emit(self.crossCoords[0], self.crossCoords[1], self.crossCoords[2], self.crossCoords[3])
             self.activeContour = 0
             
@@ -555,10 +727,26 @@ class Display(QGraphicsView):
         self.lumen = self.downsample(lumen)
         self.plaque = self.downsample(plaque)
         self.stent = self.downsample(stent)
+        if images is not self.images:
+            self.pixmapCache.clear()
+            self.startPrefetcher(images)
         self.images = images
         self.imsize = self.images.shape
         self.displayImage()
-		
+
+    def setFrameData(self, frames, lumen, plaque):
+        """Replaces the contours of some frames, lumen and plaque have x and y lists with an entry for each frame.
+
+        The current frame is only redrawn if it is one of the frames and no knot is being dragged.
+        """
+        lumen = self.downsample(lumen)
+        plaque = self.downsample(plaque)
+        for i, frame in enumerate(frames):
+            self.lumen[0][frame], self.lumen[1][frame] = lumen[0][i], lumen[1][i]
+            self.plaque[0][frame], self.plaque[1][frame] = plaque[0][i], plaque[1][i]
+        if self.frame in frames and self.pointIdx is None and not self.draw:
+            self.displayImage()
+
     def resizeContours(self, lumen, plaque, scale):
         """If image is not 500x500 resize the contours for appropriate display"""
         print('Scaling images by {} for display'.format(scale))
@@ -587,23 +775,35 @@ class Display(QGraphicsView):
         plaqueContour = [[], []]
 
         for frame in range(self.numberOfFrames):
-            if self.lumen[0][frame]:
-                lumen = Spline([self.lumen[0][frame], self.lumen[1][frame]], 'r')
-                lumenContour[0].append(list(lumen.points[0]))
-                lumenContour[1].append(list(lumen.points[1]))
-            else:
-                lumenContour[0].append([])
-                lumenContour[1].append([])
-            if self.plaque[0][frame]:
-                plaque = Spline([self.plaque[0][frame], self.plaque[1][frame]], 'y')
-                plaqueContour[0].append(list(plaque.points[0]))
-                plaqueContour[1].append(list(plaque.points[1]))
-            else:
-                plaqueContour[0].append([])
-                plaqueContour[1].append([]) 
+            lumen, plaque = self.getFrameData(frame)
+            lumenContour[0].append(lumen[0])
+            lumenContour[1].append(lumen[1])
+            plaqueContour[0].append(plaque[0])
+            plaqueContour[1].append(plaque[1])
                 
         return lumenContour, plaqueContour
 
+    def getFrameData(self, frame):
+        """Gets the interpolated contours of a single frame
+
+        Returns:
+            lumen: list, x and y points, empty lists if the frame has no lumen contour
+            plaque: list, x and y points, empty lists if the frame has no plaque contour
+        """
+
+        if self.lumen[0][frame]:
+            points = self.splineEngine.evaluate([self.lumen[0][frame], self.lumen[1][frame]], (frame, 'lumen'))
+            lumen = [list(points[0]), list(points[1])]
+        else:
+            lumen = [[], []]
+        if self.plaque[0][frame]:
+            points = self.splineEngine.evaluate([self.plaque[0][frame], self.plaque[1][frame]], (frame, 'plaque'))
+            plaque = [list(points[0]), list(points[1])]
+        else:
+            plaque = [[], []]
+
+        return lumen, plaque
+
 
     def downsample(self, contours, num_points=20):
         """Downsamples input contour data by selecting n points from original contour"""
@@ -614,39 +814,51 @@ class Display(QGraphicsView):
 
         for i in range(numberOfFrames):
             if contours[0][i]:
-                idx = len(contours[0][i])//num_points
+                idx = max(len(contours[0][i])//num_points, 1)
                 downsampled[0][i] = [pnt for j, pnt in enumerate(contours[0][i]) if j % idx == 0]
                 downsampled[1][i] = [pnt for j, pnt in enumerate(contours[1][i]) if j % idx == 0]
 
         return downsampled
 
-    def displayImage(self):
-        """Clears scene and displays current image and splines"""
-
-        self.scene.clear()
-        self.viewport().update()
-
-        [self.removeItem(item) for item in self.scene.items()]
-
-        self.activePoint = None
-        self.pointIdx = None
+    def startPrefetcher(self, images):
+        """Starts scaling frames ahead of the current frame in a background thread"""
+        from workers import FramePrefetcher
+
+        self.stopPrefetcher()
+        if self.readAhead > 0:
+            self.prefetcher = FramePrefetcher(images, self.display_size)
+            self.prefetcher.prefetched.connect(self.cachePrefetched)
+            self.prefetcher.start()
+
+    def stopPrefetcher(self):
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+
+    def cachePrefetched(self, frame, image):
+        # frames of a previous pullback may arrive after the prefetcher was replaced
+        if self.sender() is self.prefetcher:
+            self.pixmapCache.put(frame, QPixmap.fromImage(image))
+
+    def prefetch(self):
+        """Requests the frames following the current frame in the direction of scrubbing"""
+        if self.prefetcher is None:
+            return
+        frames = [self.frame + self.direction*i for i in range(1, self.readAhead + 1)]
+        self.prefetcher.request([frame for frame in frames if 0 <= frame < self.numberOfFrames and frame not in self.pixmapCache])
 
-        if len(self.images.shape) == 3:
-            current_image = self.images[self.frame, : ,:]
-            self.image=QImage(current_image, self.imsize[1], self.imsize[2], QImage.Format_Grayscale8).scaled(self.display_size, self.display_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-        else:
-            bytesPerLine = 3*self.imsize[2]
-            current_image = self.images[self.frame, : ,:, :].astype(np.uint8, order='C', casting='unsafe')
-            self.image=QImage(current_image.data, self.imsize[1], self.imsize[2], bytesPerLine, QImage.Format_RGB888).scaled(self.display_size, self.display_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) 
+    def framePixmap(self, frame):
+        """Returns the pixmap of a frame at the display size from the cache or scales it"""
+        pixmap = self.pixmapCache.get(frame)
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(frame_image(self.images, frame, self.display_size))
+            self.pixmapCache.put(frame, pixmap)
+        return pixmap
 
-        image = QPixmap.fromImage(self.image)
-        self.image = QGraphicsPixmapItem(image)
-        self.image.setZValue(1)
-        self.scene.addItem(self.image)
-        
-        self.cross = Line(self.crossCoords, self.display_size)
-        self.scene.addItem(self.cross)
+    def echoOverlay(self):
+        """Shows the echogenicity overlay of the current frame"""
 
+        current_image = self.images[self.frame]
         # create transparent image (opacity set in 4th channel)
         # calcium - white, hypoechogenic - red, hyperechogenic - greeen, other - gray
         mask = (current_image > 200).astype(int)
@@ -664,35 +876,104 @@ class Display(QGraphicsView):
 
         self.echo_image = QImage(plaque.data, self.imsize[1], self.imsize[2], 4*self.imsize[2], QImage.Format_RGBA8888).scaled(self.display_size, self.display_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) 
         pixmap = QPixmap.fromImage(self.echo_image)
-        self.echoMap = QGraphicsPixmapItem(pixmap)
-        self.echoMap.setZValue(2)
-        #self.scene.addItem(self.echoMap)
+        if self.echoMap is None:
+            self.echoMap = self.addSceneItem(QGraphicsPixmapItem(pixmap))
+            self.echoMap.setZValue(2)
+        else:
+            self.echoMap.setPixmap(pixmap)
+        self.echoMap.setVisible(True)
 
-        if not self.hide:
-            if self.lumen[0] or self.plaque[0] or self.stent[0]:
-                self.addInteractiveSplines(self.lumen, self.plaque, self.stent)
+    def displayImage(self):
+        """Displays current image and splines, scene items are updated in place"""
 
-        self.setScene(self.scene)
+        allocations = self.allocations
+        self.activePoint = None
+        self.pointIdx = None
+
+        # points and splines of a manual contour are not kept after a frame change
+        for item in self.manualItems:
+            self.scene.removeItem(item)
+        self.manualItems = []
+
+        self.image.setPixmap(self.framePixmap(self.frame))
+
+        # the overlay is only computed when it is displayed
+        if self.showEcho:
+            self.echoOverlay()
+        elif self.echoMap is not None:
+            self.echoMap.setVisible(False)
+
+        self.innerPoint = []
+        self.outerPoint = []
+        if not self.hide and (self.lumen[0] or self.plaque[0] or self.stent[0]):
+            self.addInteractiveSplines(self.lumen, self.plaque, self.stent)
+        else:
+            self.hideSplines()
+        self.updatePickIndex()
+
+        self.frameAllocations = self.allocations - allocations
+        self.prefetch()
+
+    def showFrame(self):
+        """Displays the current frame during playback, only the image is replaced when contours are hidden"""
+
+        if not self.hide or self.showEcho:
+            self.displayImage()
+            return
+        self.image.setPixmap(self.framePixmap(self.frame))
+        self.prefetch()
         
+    def hideSplines(self):
+        for item in [self.innerSpline, self.outerSpline] + self.innerPool + self.outerPool:
+            if item is not None:
+                item.setVisible(False)
+
+    def splinePoints(self, pool, knotPoints, color):
+        """Moves pooled points to the knot points, the pool grows only if there are more knot points than before
+
+        The last knot point is a copy of the first due to periodicity and has no point.
+        """
+        num_points = len(knotPoints[0]) - 1
+        while len(pool) < num_points:
+            pool.append(self.addSceneItem(Point((0, 0), color)))
+        for idx, point in enumerate(pool):
+            if idx < num_points:
+                point.setRect(knotPoints[0][idx], knotPoints[1][idx], 3, 3)
+                point.resetColor()
+            point.setVisible(idx < num_points)
+        return pool[:num_points]
+
     def addInteractiveSplines(self, lumen, plaque, stent):
-        """Adds inner and outer splines to scene"""
+        """Shows inner and outer splines and their points for the current frame"""
 
         contour_scaling_factor = self.display_size/self.imsize[1]
         if lumen[0][self.frame]:
             lumen_x = [val*contour_scaling_factor for val in lumen[0][self.frame]]
             lumen_y = [val*contour_scaling_factor for val in lumen[1][self.frame]]
-            self.innerSpline = Spline([lumen_x, lumen_y], 'r')
-            self.innerPoint = [Point((self.innerSpline.knotPoints[0][idx], self.innerSpline.knotPoints[1][idx]), 'r') for idx in range(len(self.innerSpline.knotPoints[0])-1)]
-            [self.scene.addItem(point) for point in self.innerPoint]        
-            self.scene.addItem(self.innerSpline)
+            if self.innerSpline is None:
+                self.innerSpline = self.addSceneItem(Spline([lumen_x, lumen_y], 'r', self.splineEngine, (self.frame, 'lumen', self.display_size)))
+            else:
+                self.innerSpline.setKnotPoints([lumen_x, lumen_y], (self.frame, 'lumen', self.display_size))
+            self.innerSpline.setVisible(True)
+            self.innerPoint = self.splinePoints(self.innerPool, self.innerSpline.knotPoints, 'r')
+        else:
+            for item in [self.innerSpline] + self.innerPool:
+                if item is not None:
+                    item.setVisible(False)
 
         if plaque[0][self.frame]:
             plaque_x = [val*contour_scaling_factor for val in plaque[0][self.frame]]
             plaque_y = [val*contour_scaling_factor for val in plaque[1][self.frame]]
-            self.outerSpline = Spline([plaque_x, plaque_y], 'y')
-            self.outerPoint = [Point((self.outerSpline.knotPoints[0][idx], self.outerSpline.knotPoints[1][idx]), 'y') for idx in range(len(self.outerSpline.knotPoints[0])-1)] # IMPORTANT TO NOT INCLUDE LAST COPIED KNOT POINT DUE TO PERIODICITY
-            [self.scene.addItem(point) for point in self.outerPoint] 
-            self.scene.addItem(self.outerSpline)
+            if self.outerSpline is None:
+                self.outerSpline = self.addSceneItem(Spline([plaque_x, plaque_y], 'y', self.splineEngine, (self.frame, 'plaque', self.display_size)))
+            else:
+                self.outerSpline.setKnotPoints([plaque_x, plaque_y], (self.frame, 'plaque', self.display_size))
+            self.outerSpline.setVisible(True)
+            self.outerPoint = self.splinePoints(self.outerPool, self.outerSpline.knotPoints, 'y')
+        else:
+            for item in [self.outerSpline] + self.outerPool:
+                if item is not None:
+                    item.setVisible(False)
 
     def addManualSpline(self, point):
         """Creates an interactive spline manually point by point"""
@@ -700,13 +981,13 @@ class Display(QGraphicsView):
         if not self.drawPoints:
             self.splineDrawn = False
 
-        self.drawPoints.append(Point((point.x(), point.y()), 'b'))
-        self.scene.addItem(self.drawPoints[-1])
+        self.drawPoints.append(self.addSceneItem(Point((point.x(), point.y()), 'b')))
+        self.manualItems.append(self.drawPoints[-1])
 
         if len(self.drawPoints) > 3:
             if not self.splineDrawn:
-                self.newSpline = Spline([[point.getPoint()[0] for point in self.drawPoints], [point.getPoint()[1] for point in self.drawPoints]], 'c')
-                self.scene.addItem(self.newSpline)
+                self.newSpline = self.addSceneItem(Spline([[point.getPoint()[0] for point in self.drawPoints], [point.getPoint()[1] for point in self.drawPoints]], 'c'))
+                self.manualItems.append(self.newSpline)
                 self.splineDrawn = True
             else:
                 self.newSpline.update(point, len(self.drawPoints))
@@ -753,7 +1034,12 @@ class Display(QGraphicsView):
         self.displayImage()     
 		
     def setFrame(self, value):
+        if value != self.frame:
+            self.direction = 1 if value > self.frame else -1
         self.frame = value
 
+    def setEchoOverlay(self, show):
+        self.showEcho = show
+
     def setDisplay(self, hide):
         self.hide = hide
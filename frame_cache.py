@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+class FrameCache():
+    """Persistent on-disk cache of decoded pullback frames.
+
+    Decoded frames are stored as .npy files which are memory mapped when a
+    pullback is reopened, so compressed pullbacks are only decoded once.
+    Entries are keyed by the SHA-1 of the file contents and the transfer
+    syntax. When the cache grows beyond max_size the least recently used
+    entries are removed.
+
+    Attributes:
+        folder: str, directory holding the cached arrays and index
+        max_size: int, maximum total size of the cached arrays in bytes
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.index_path = os.path.join(folder, 'index.json')
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.index = self.readIndex()
+
+    def readIndex(self):
+        """Reads the cache index, returns an empty index if missing or unreadable"""
+
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        index.setdefault('files', {})
+        return index
+
+    def writeIndex(self):
+        """Writes the cache index, replacing the previous file atomically"""
+
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+
+    def fileHash(self, path):
+        """Returns the SHA-1 of the file contents, reusing the stored hash if the file is unchanged"""
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        record = self.index['files'].get(path)
+        if record and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime:
+            return record['hash']
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        file_hash = sha1.hexdigest()
+        self.index['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': file_hash}
+        return file_hash
+
+    def key(self, path, transfer_syntax):
+        """Returns the cache key for a DICOM file and its transfer syntax"""
+
+        return '{}_{}'.format(self.fileHash(path), str(transfer_syntax).replace('.', '-'))
+
+    def arrayPath(self, key):
+        return os.path.join(self.folder, key + '.npy')
+
+    def load(self, key):
+        """Memory maps the cached frames for key, returns None if not cached"""
+
+        entry = self.index['entries'].get(key)
+        if entry is None or not os.path.isfile(self.arrayPath(key)):
+            return None
+        entry['used'] = time.time()
+        self.writeIndex()
+        return np.load(self.arrayPath(key), mmap_mode='r')
+
+    def store(self, key, reader):
+        """Decodes every frame from reader into the cache and returns the memory mapped array
+
+        Args:
+            key: str, cache key
+            reader: DicomFrames, reader used to decode the frames
+        Returns:
+            frames: np.memmap, cached frames
+        """
+
+        temp_path = self.arrayPath(key) + '.tmp'
+        frames = np.lib.format.open_memmap(temp_path, mode='w+', dtype=reader.dtype, shape=reader.shape)
+        for start in range(0, reader.shape[0], reader.window):
+            stop = min(start + reader.window, reader.shape[0])
+            frames[start:stop] = reader.frames(range(start, stop))
+        frames.flush()
+        del frames
+        os.replace(temp_path, self.arrayPath(key))
+
+        self.index['entries'][key] = {'size': os.path.getsize(self.arrayPath(key)), 'used': time.time()}
+        self.evict(keep=key)
+        self.writeIndex()
+        return np.load(self.arrayPath(key), mmap_mode='r')
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache is within max_size"""
+
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['used']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.arrayPath(key))
+            except OSError:
+                pass
+            total -= entries.pop(key)['size']
@@ -2,7 +2,26 @@ from PyQt5.QtWidgets import QGraphicsEllipseItem, QGraphicsPathItem, QGraphicsLi
 from PyQt5.QtCore import Qt, QPointF
 from PyQt5.QtGui import QPen, QPainter, QPainterPath, QColor, QPolygonF
 import numpy as np
-from scipy.interpolate import splprep, splev
+from spline import SplineEngine
+from picking import PointIndex
+
+def polygon_path(x, y):
+    """Returns a closed path through the points.
+
+    The points are written into the buffer of a QPolygonF with numpy rather
+    than adding each point to the path in a Python loop.
+    """
+    polygon = QPolygonF(len(x))
+    buffer = polygon.data()
+    buffer.setsize(2*len(x)*np.dtype(np.float64).itemsize)
+    points = np.frombuffer(buffer, dtype=np.float64).reshape(len(x), 2)
+    points[:, 0] = x
+    points[:, 1] = y
+
+    path = QPainterPath()
+    path.addPolygon(polygon)
+    path.closeSubpath()
+    return path
 
 class Marker(QGraphicsLineItem):
     """Class that describes a line in the longitudinal view"""
@@ -151,15 +170,15 @@ class Line(QGraphicsLineItem):
         self.setPen(self.defaultColor)
         theta = np.linspace(0, 2*np.pi, 180)
         self.points = [[image_radius*np.cos(val) + image_radius, image_radius*np.sin(val) + image_radius] for val in theta]
+        self.index = PointIndex([pt[0] for pt in self.points], [pt[1] for pt in self.points])
 
     def update(self, pos):
         """Updates the Point position"""
         
-        dist = [np.sqrt((pt[0] - pos.x())**2 + (pt[1] - pos.y())**2) for pt in self.points]
-        idx = [i for i, val in enumerate(dist) if val == min(dist)]
+        idx, _ = self.index.nearest(pos.x(), pos.y())
         # point must be constrained to circular path
-        new_x = self.points[idx[0]][0]
-        new_y = self.points[idx[0]][1]
+        new_x = self.points[idx][0]
+        new_y = self.points[idx][1]
         if new_x > self.display_size//2:
             new_x1 = self.display_size - new_x
         else:
@@ -214,9 +233,16 @@ class Point(QGraphicsEllipseItem):
         return self.rect()
 		
 class Spline(QGraphicsPathItem):
-    """Class that describes a spline"""
-    def __init__(self, points, color):
-        self.setKnotPoints(points)
+    """Class that describes a spline
+
+    Points are evaluated by a SplineEngine, splines sharing an engine share its
+    cache of fitted splines. While a knot is dragged the spline is fitted 
+    without caching and the final fit is cached when the drag ends.
+    """
+    def __init__(self, points, color, engine=None, key=None):
+        super(Spline, self).__init__()
+        self.engine = engine if engine is not None else SplineEngine()
+        self.setKnotPoints(points, key)
         self.setZValue(3)
 
         if color =='y':
@@ -226,29 +252,30 @@ class Spline(QGraphicsPathItem):
         else:
             self.setPen(QPen(Qt.blue, 2))
 			
-    def setKnotPoints(self, knotPoints):
-        """KnotPoints is a list of points"""
+    def setKnotPoints(self, knotPoints, key=None):
+        """KnotPoints is a list of points, an existing spline can be moved to new knot points
 
-        p1 = QPointF(knotPoints[0][0], knotPoints[1][0])
-        self.path = QPainterPath(p1)
-        super(Spline, self).__init__(self.path)
-
-        self.points = self.interpolate(knotPoints)
-        for i in range(0, len(self.points[0])):
-            self.path.lineTo(self.points[0][i], self.points[1][i])
+        Args:
+            knotPoints: list, x and y knot coordinates
+            key: hashable, identifies the contour in the engine cache, None fits without caching
+        """
 
-        self.setPath(self.path)
-        self.path.closeSubpath()
+        self.key = key
+        self.points = self.engine.evaluate(knotPoints, key)
         self.knotPoints = knotPoints
+        self.updatePath()
 
     def interpolate(self, pts):
         """Interpolates the spline points at 500 points along spline"""
-        pts = np.array(pts)
-        tck, u = splprep(pts, u=None, s=0.0, per=1)
-        u_new = np.linspace(u.min(), u.max(), 500)
-        x_new, y_new = splev(u_new, tck, der=0)
+        return self.engine.fit(pts)
 
-        return (x_new, y_new)
+    def endDrag(self):
+        """Caches the spline fitted to the moved knots"""
+        self.points = self.engine.evaluate(self.knotPoints, self.key)
+
+    def updatePath(self):
+        self.path = polygon_path(self.points[0], self.points[1])
+        self.setPath(self.path)
         
     def update(self, pos, idx):
         """Updates the stored spline everytime it is moved
@@ -264,6 +291,4 @@ class Spline(QGraphicsPathItem):
             self.knotPoints[0][idx] = pos.x()
             self.knotPoints[1][idx] = pos.y()
         self.points = self.interpolate(self.knotPoints)
-        for i in range(0, len(self.points[0])):
-            self.path.setElementPositionAt(i, self.points[0][i], self.points[1][i])
-        self.setPath(self.path)
+        self.updatePath()
@@ -0,0 +1,110 @@
+import numpy as np
+from IVUS_gating import gating_signals
+
+# labels of each region in the predicted masks
+REGIONS = {'lumen': (1, ), 'vessel': (1, 2)}
+
+def select_keyframes(s0, threshold=0.9, max_gap=30):
+    """Chooses the frames segmented by the network from the inter-frame correlation.
+
+    The dissimilarity 1 - normxcorr of consecutive frames is accumulated from
+    the last keyframe, a frame becomes a keyframe once the accumulated
+    dissimilarity exceeds 1 - threshold or max_gap frames have passed. The
+    first and last frames are always keyframes.
+
+    Args:
+        s0: np.array, 1 - normalized cross correlation of consecutive frames of shape (frames - 1, 1)
+        threshold: float, similarity below which a new keyframe is segmented, 1 segments every frame
+        max_gap: int, maximum number of frames between keyframes
+    Returns:
+        keyframes: list, frame numbers of the keyframes in increasing order
+    """
+
+    dissimilarity = np.ravel(s0)
+    keyframes = [0]
+    drift = 0.0
+    for frame in range(1, len(dissimilarity) + 1):
+        drift += dissimilarity[frame - 1]
+        if drift > 1 - threshold or frame - keyframes[-1] >= max_gap:
+            keyframes.append(frame)
+            drift = 0.0
+    if keyframes[-1] != len(dissimilarity):
+        keyframes.append(len(dissimilarity))
+    return keyframes
+
+def keyframe_sources(s0, keyframes):
+    """Returns the keyframe whose mask is propagated to each frame.
+
+    Each frame takes the mask of the neighbouring keyframe it is more similar
+    to, measured by the dissimilarity accumulated between them.
+    """
+
+    drift = np.concatenate([[0], np.cumsum(np.ravel(s0))])
+    sources = np.zeros(len(drift), dtype=int)
+    for previous, following in zip(keyframes[:-1], keyframes[1:]):
+        frames = np.arange(previous, following + 1)
+        sources[frames] = np.where(drift[frames] - drift[previous] <= drift[following] - drift[frames], previous, following)
+    sources[keyframes] = keyframes
+    return sources
+
+def dice(mask1, mask2, labels):
+    """Dice coefficient of the region made up of labels in two masks, 1 if both regions are empty"""
+
+    region1 = np.isin(mask1, labels)
+    region2 = np.isin(mask2, labels)
+    total = region1.sum() + region2.sum()
+    if total == 0:
+        return 1.0
+    return 2*np.logical_and(region1, region2).sum()/total
+
+def predict_keyframes(images, predict, batch_size=64, threshold=0.9, max_gap=30, chunk_size=16, num_workers=0):
+    """Segments keyframes and finds the keyframe whose mask each frame takes
+
+    Args:
+        images: array or DICOM frame reader, pullback of shape (frames, rows, columns[, channels])
+        predict: function, segments a batch of images
+        batch_size: int, number of images segmented in each batch
+        threshold: float, similarity below which a new keyframe is segmented
+        max_gap: int, maximum number of frames between keyframes
+        chunk_size, num_workers: passed to gating_signals
+    Returns:
+        masks: dict, keyframe number to mask
+        sources: np.array, keyframe propagated to each frame
+    """
+
+    if not images.shape[0]:
+        return {}, np.zeros((0, ), dtype=int)
+    s0, _ = gating_signals(images, chunk_size, num_workers)
+    keyframes = select_keyframes(s0, threshold, max_gap)
+    masks = dict(zip(keyframes, predict(images[keyframes], batch_size)))
+    return masks, keyframe_sources(s0, keyframes)
+
+def propagate_contours(contours, sources):
+    """Copies the contours of each keyframe to the frames propagated from it
+
+    Args:
+        contours: list, x and y points of the contour in each frame, only keyframes have contours
+        sources: np.array, keyframe propagated to each frame
+    """
+
+    return ([list(contours[0][source]) for source in sources], [list(contours[1][source]) for source in sources])
+
+def keyframe_agreement(images, masks, sources, predict, batch_size=64, sample_size=16, seed=0):
+    """Compares propagated masks with the network prediction on a random sample of skipped frames
+
+    Returns:
+        agreement: dict, mean Dice coefficient of each region in REGIONS, empty if no frame was skipped
+        sample: list, frame numbers of the checked frames
+    """
+
+    skipped = np.setdiff1d(np.arange(images.shape[0]), list(masks))
+    if not len(skipped) or sample_size <= 0:
+        return {}, []
+    rng = np.random.RandomState(seed)
+    sample = sorted(rng.choice(skipped, min(sample_size, len(skipped)), replace=False).tolist())
+    predicted = predict(images[sample], batch_size)
+
+    agreement = {}
+    for region, labels in REGIONS.items():
+        agreement[region] = float(np.mean([dice(masks[sources[frame]], mask, labels) for frame, mask in zip(sample, predicted)]))
+    return agreement, sample
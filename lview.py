@@ -0,0 +1,289 @@
+import numpy as np
+from scipy import sparse
+from metrics import PackedContours
+
+# longitudinal cuts are tabulated for every integer angle in [0, 360]
+NUM_ANGLES = 361
+
+# sampling tables are shared by pullbacks with the same image geometry
+_tables = {}
+
+class LViewData():
+    """Creates an lview and returns the image
+
+    The pixels sampled by the longitudinal cut at every integer angle are
+    computed once per image geometry and stored as int16 row and column
+    tables, with the flip of the lower half of the angles folded in, so an
+    update is a single gather from the pullback.
+    """
+    def __init__(self, image_dim):
+
+        self.current_angle = 0
+        spacing = np.linspace(0, image_dim[1], image_dim[2])
+        x, y = np.meshgrid(spacing, spacing)
+        half_dim = image_dim[1]//2
+        x = x - half_dim
+        y = y - half_dim
+        self.rho = np.sqrt(x**2 + y**2)
+        phi = np.arctan2(y, x)
+        phi += np.pi
+        phi = phi*180/np.pi
+        self.phi1 = phi[:, :half_dim]
+        self.phi2 = phi[:, half_dim:]
+        self.phi3 = phi[:half_dim, :]
+        self.phi4 = phi[half_dim:, :]
+        self.phi = phi
+        self.idx1_1 = np.linspace(0, half_dim - 1, half_dim, dtype=np.uint16)
+        self.idx2_1 = np.linspace(half_dim, image_dim[1] - 1, half_dim, dtype=np.uint16)
+
+        self.frame_matrices = {}
+
+        key = (image_dim[1], image_dim[2])
+        if key not in _tables:
+            _tables[key] = self.samplingTables()
+        self.rows, self.columns = _tables[key]
+
+    def samplingTables(self):
+        """Returns the row and column indices sampled at every integer angle, shape (NUM_ANGLES, cut length)"""
+
+        length = len(self.idx1_1) + len(self.idx2_1)
+        rows = np.zeros((NUM_ANGLES, length), dtype=np.int16)
+        columns = np.zeros((NUM_ANGLES, length), dtype=np.int16)
+        for angle in range(NUM_ANGLES):
+            idx1, idx2 = self.indices(angle)
+            # odd image sizes give one more angular sample than radial samples
+            rows[angle], columns[angle] = idx1[:length], idx2[:length]
+            if 135 <= angle <= 315:
+                rows[angle], columns[angle] = rows[angle, ::-1], columns[angle, ::-1]
+        return rows, columns
+
+    def indices(self, angle):
+        """Finds the rows and columns of the pixels closest to the cut through the image centre at angle"""
+
+        if 45 < angle <= 135:
+            idx1_2 = np.abs((self.phi3 - angle)).argmin(axis=1)
+            idx2_2 = np.abs((self.phi4 - (180 + angle)%360)).argmin(axis=1)
+            idx1 = np.concatenate([self.idx1_1, self.idx2_1])
+            idx2 = np.concatenate([idx1_2, idx2_2])
+        elif 225 < angle <= 315:
+            idx1_2 = np.abs((self.phi3 - (180 + angle)%360)).argmin(axis=1)
+            idx2_2 = np.abs((self.phi4 - angle)).argmin(axis=1)
+            idx1 = np.concatenate([self.idx1_1, self.idx2_1])
+            idx2 = np.concatenate([idx1_2, idx2_2])
+        elif 135 < angle <= 225:
+            idx1_2 = np.abs((self.phi1 - (180 + angle)%360)).argmin(axis=0)
+            idx2_2 = np.abs((self.phi2 - angle)).argmin(axis=0)
+            idx2 = np.concatenate([self.idx1_1, self.idx2_1])
+            idx1 = np.concatenate([idx1_2, idx2_2])
+        else:
+            idx1_2 = np.abs((self.phi1 - angle)).argmin(axis=0)
+            idx2_2 = np.abs((self.phi2 - (180 + angle)%360)).argmin(axis=0)
+            idx2 = np.concatenate([self.idx1_1, self.idx2_1])
+            idx1 = np.concatenate([idx1_2, idx2_2])
+
+        return idx1, idx2
+
+    def normalizingRadius(self, angle):
+        """Returns the distance from the image centre to the image edge along the cut at angle"""
+
+        if 45 <= angle < 135:
+            return self.rho[0, np.abs(np.round(self.phi[0,:]) - angle).argmin()]
+        elif 135 <= angle < 225:
+            return self.rho[np.abs(np.round(self.phi[:, -1]) - angle).argmin(), -1]
+        elif 225 <= angle < 315:
+            return self.rho[-1, np.abs(np.round(self.phi[-1, :]) - angle).argmin()]
+        else:
+            return self.rho[np.abs(np.round(self.phi[:, 0]) - angle).argmin(), 0]
+
+    def update(self, images, current_angle):
+        self.current_angle = current_angle
+        angle = int(round(current_angle))%NUM_ANGLES
+
+        # one gather of shape (frames, cut length), transposed and cast in a single copy
+        lview_array = images[:, self.rows[angle], self.columns[angle]]
+        return np.ascontiguousarray(lview_array.T, dtype=np.uint8)
+
+    def resample(self, images, angle, length, height, chunk_size=256, cancelled=None):
+        """Extracts the lview at angle with bilinear interpolation at the output size.
+
+        Pixels along the cut are sampled bilinearly at spacing of at most one pixel 
+        and both the cut and the frames are then resampled to the output size with a 
+        triangle filter whose support grows with the reduction, so the image is 
+        anti-aliased without further scaling. Rows and orientation match update.
+
+        Args:
+            images: array or DicomFrames, pullback of shape (frames, rows, columns)
+            angle: float, angle of the cut (degrees)
+            length: int, output width (frames axis)
+            height: int, output height (cut axis)
+            chunk_size: int, number of frames gathered at a time
+            cancelled: function, returning True stops the resampling
+        Returns:
+            lview_array: np.ndarray, uint8 image of shape (height, length) or None if cancelled
+        """
+
+        num_frames, rows, columns = images.shape[:3]
+        half_dim = rows//2
+        # direction of the angle end of the cut, angle 0 points to the left of the image
+        theta = np.deg2rad(angle)
+        dx, dy = -np.cos(theta), -np.sin(theta)
+        radius = half_dim/max(abs(dx), abs(dy))
+        num_samples = int(np.ceil(2*radius)) + 1
+        distance = np.linspace(radius, -radius, num_samples)
+        x = np.clip(half_dim + distance*dx, 0, columns - 1)
+        y = np.clip(half_dim + distance*dy, 0, rows - 1)
+
+        x0, y0 = np.floor(x).astype(np.intp), np.floor(y).astype(np.intp)
+        x1, y1 = np.minimum(x0 + 1, columns - 1), np.minimum(y0 + 1, rows - 1)
+        wx, wy = (x - x0).astype(np.float32), (y - y0).astype(np.float32)
+        sample_rows = np.concatenate([y0, y0, y1, y1])
+        sample_columns = np.concatenate([x0, x1, x0, x1])
+        weights = np.stack([(1 - wx)*(1 - wy), wx*(1 - wy), (1 - wx)*wy, wx*wy])
+
+        cut_matrix = resample_matrix(num_samples, height)
+        if (num_frames, length) not in self.frame_matrices:
+            self.frame_matrices[(num_frames, length)] = resample_matrix(num_frames, length)
+        frame_matrix = self.frame_matrices[(num_frames, length)]
+
+        # resample the cut of each chunk of frames, then resample along the frames
+        cut = np.zeros((num_frames, height), dtype=np.float32)
+        for start in range(0, num_frames, chunk_size):
+            if cancelled is not None and cancelled():
+                return None
+            stop = min(start + chunk_size, num_frames)
+            values = np.asarray(images[start:stop, sample_rows, sample_columns], dtype=np.float32)
+            values = np.sum(values.reshape(stop - start, 4, num_samples)*weights, axis=1)
+            cut[start:stop] = (cut_matrix @ values.T).T
+        lview_array = (frame_matrix @ cut).T
+
+        return np.clip(np.rint(lview_array), 0, 255).astype(np.uint8)
+
+def resample_matrix(num_input, num_output):
+    """Returns the sparse (num_output, num_input) matrix of triangle filter weights resampling a signal.
+
+    The filter support is widened by the reduction factor when downsampling so 
+    that each output sample averages all of the inputs it covers.
+    """
+
+    scale = num_input/num_output
+    support = max(scale, 1.0)
+    centres = (np.arange(num_output) + 0.5)*scale - 0.5
+    weights = np.maximum(0, 1 - np.abs(np.arange(num_input)[np.newaxis, :] - centres[:, np.newaxis])/support)
+    # outputs beyond the first or last input take the nearest input
+    empty = weights.sum(axis=1) == 0
+    weights[empty, np.clip(np.rint(centres[empty]).astype(np.intp), 0, num_input - 1)] = 1
+    return sparse.csr_matrix((weights/weights.sum(axis=1, keepdims=True)).astype(np.float32))
+
+class PolarContours():
+    """Polar form of the contours of every frame about the image centre.
+
+    Angles and radii of all contour points are computed once and held in
+    padded (frames with a contour, points) arrays, so finding where the lview
+    cut crosses every contour at a new angle is a single vectorized search.
+
+    Attributes:
+        contours: list, x and y lists of points for each frame that the polar form was computed from
+        frames: np.ndarray, frames that have a contour
+        centre: float, row and column of the image centre
+    """
+
+    def __init__(self, contours, centre, cache_size=32):
+        self.contours = contours
+        self.centre = centre
+        self.cache_size = cache_size
+        self.cache = {}
+        packed = PackedContours.fromLists(contours)
+        counts = packed.counts()
+        self.numberOfFrames = len(packed)
+        self.frames = np.flatnonzero(counts > 0)
+
+        # points beyond the end of a contour have an infinite angle so they are never closest
+        width = counts.max() if len(self.frames) else 0
+        self.theta = np.full((len(self.frames), width), np.inf)
+        self.rho = np.zeros((len(self.frames), width))
+        rows = np.repeat(np.arange(len(self.frames)), counts[self.frames])
+        columns = np.arange(packed.offsets[-1]) - np.repeat(packed.offsets[:-1], counts)
+        x = packed.x - centre
+        y = packed.y - centre
+        self.theta[rows, columns] = np.rad2deg(np.arctan2(y, x)) + 180
+        self.rho[rows, columns] = np.sqrt(x**2 + y**2)
+
+    def coordinates(self, angle, radius_normalizing_value, lview_height):
+        """Returns the normalized mean radius and the lview positions where the cut at angle crosses each contour
+
+        Returns:
+            (lviewX, lviewX1, lviewX2): tuple, lists with an entry for every frame, None for frames without a contour
+        """
+
+        key = (angle, radius_normalizing_value, lview_height)
+        if key not in self.cache:
+            rows = np.arange(len(self.frames))
+            rho1 = self.rho[rows, np.abs(self.theta - angle).argmin(axis=1)]
+            rho2 = self.rho[rows, np.abs(self.theta - (180 + angle)%360).argmin(axis=1)]
+
+            lviewX = [None]*self.numberOfFrames
+            lviewX1 = [None]*self.numberOfFrames
+            lviewX2 = [None]*self.numberOfFrames
+            for frame, value, value1, value2 in zip(self.frames.tolist(), (((rho1 + rho2)/2)/(radius_normalizing_value)).tolist(), 
+                (lview_height//2 - rho1/(radius_normalizing_value)*(lview_height//2)).tolist(), 
+                (lview_height//2 + rho2/(radius_normalizing_value)*(lview_height//2)).tolist()):
+                lviewX[frame], lviewX1[frame], lviewX2[frame] = value, value1, value2
+
+            if len(self.cache) >= self.cache_size:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[key] = (lviewX, lviewX1, lviewX2)
+
+        # callers may modify the lists so the cached lists are copied
+        return tuple(list(values) for values in self.cache[key])
+
+    def updateFrame(self, frame, x, y):
+        """Replaces the polar form of one frame after its contour was edited or segmented
+
+        A frame without a contour gains a row and a frame whose new contour is empty loses its row.
+
+        Args:
+            frame: int, frame number
+            x: list, x points of the new contour
+            y: list, y points of the new contour
+        """
+
+        row = np.searchsorted(self.frames, frame)
+        present = row < len(self.frames) and self.frames[row] == frame
+        self.cache.clear()
+        if not len(x):
+            if present:
+                self.frames = np.delete(self.frames, row)
+                self.theta = np.delete(self.theta, row, axis=0)
+                self.rho = np.delete(self.rho, row, axis=0)
+            return
+        if not present:
+            self.frames = np.insert(self.frames, row, frame)
+            self.theta = np.insert(self.theta, row, np.inf, axis=0)
+            self.rho = np.insert(self.rho, row, 0, axis=0)
+
+        if len(x) > self.theta.shape[1]:
+            padding = len(x) - self.theta.shape[1]
+            self.theta = np.pad(self.theta, ((0, 0), (0, padding)), constant_values=np.inf)
+            self.rho = np.pad(self.rho, ((0, 0), (0, padding)))
+        x = np.asarray(x, dtype=np.float64) - self.centre
+        y = np.asarray(y, dtype=np.float64) - self.centre
+        self.theta[row] = np.inf
+        self.rho[row] = 0
+        self.theta[row, :len(x)] = np.rad2deg(np.arctan2(y, x)) + 180
+        self.rho[row, :len(x)] = np.sqrt(x**2 + y**2)
+
+    def frameCoordinates(self, frame, angle, radius_normalizing_value, lview_height):
+        """Returns the normalized mean radius and lview positions where the cut at angle crosses the contour of one frame
+
+        Returns:
+            (value, value1, value2): tuple, floats, None if the frame has no contour
+        """
+
+        row = np.searchsorted(self.frames, frame)
+        if row == len(self.frames) or self.frames[row] != frame:
+            return None, None, None
+        rho1 = self.rho[row, np.abs(self.theta[row] - angle).argmin()]
+        rho2 = self.rho[row, np.abs(self.theta[row] - (180 + angle)%360).argmin()]
+        return (float(((rho1 + rho2)/2)/(radius_normalizing_value)), 
+            float(lview_height//2 - rho1/(radius_normalizing_value)*(lview_height//2)), 
+            float(lview_height//2 + rho2/(radius_normalizing_value)*(lview_height//2)))
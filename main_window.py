@@ -0,0 +1,1320 @@
+from PyQt5.QtWidgets import (QMainWindow, QWidget, QSlider, QApplication, QHeaderView, QStyle, QFrame, QGraphicsView, QGraphicsScene, QGraphicsLineItem, QGraphicsPixmapItem, QGraphicsEllipseItem, QGraphicsPathItem, QHBoxLayout, QVBoxLayout, QPushButton, QCheckBox,  QLabel, QSizePolicy, QInputDialog, QErrorMessage, QMessageBox, QLineEdit, QFileDialog, QTableWidget, QTableWidgetItem, QProgressDialog)
+from PyQt5.QtCore import QObject, Qt, pyqtSignal, QSize, QTimer, QPointF
+from PyQt5.QtGui import QIcon, QFont, QPixmap, QImage, QPen, QColor, QPainterPath
+from write_xml import write_xml, write_project
+from display import Display, LView, LesionView
+from read_project import FileDialog
+from read_dicom import DicomFrames
+from frame_cache import FrameCache
+from pipeline import mask_contours
+from metrics import contour_metrics, trapezoid_volume
+from lview import LViewData, PolarContours
+from workers import LViewWorker, GatingWorker, SegmentationWorker
+from settings import Settings
+from PIL import Image
+from itertools import groupby
+from operator import itemgetter
+import os, sys, time, read_xml
+import numpy as np
+import subprocess
+
+
+
+class Communicate(QObject):
+    updateBW = pyqtSignal(int)
+    updateBool = pyqtSignal(bool)
+
+class Slider(QSlider):
+    """Slider for changing the currently displayed image."""
+    def __init__(self, orientation):
+        super().__init__()
+        self.setOrientation(orientation)
+        self.setRange(0, 0)
+        self.setValue(0)
+        self.setFocusPolicy(Qt.StrongFocus)
+        sizePolicy = QSizePolicy()
+        sizePolicy.setHorizontalPolicy(QSizePolicy.Fixed)
+        sizePolicy.setVerticalPolicy(QSizePolicy.Fixed)
+        self.setSizePolicy(sizePolicy)
+        self.setMinimumSize(QSize(800, 25))
+        self.setMaximumSize(QSize(800, 25))
+        self.gatedFrames = []
+
+    def keyPressEvent(self, event):
+        """Key events."""
+
+        key = event.key()
+        if key == Qt.Key_Right:
+            self.setValue(self.value() + 1)
+        elif key == Qt.Key_Left:
+            self.setValue(self.value() - 1)
+        elif key == Qt.Key_Up:
+            if self.gatedFrames:
+                currentGatedFrame = self.findFrame(self.value())
+                currentGatedFrame = currentGatedFrame + 1
+                if currentGatedFrame > self.maxFrame:
+                    currentGatedFrame = self.maxFrame
+                self.setValue(self.gatedFrames[currentGatedFrame])
+            else:
+                self.setValue(self.value() + 1)
+        elif key == Qt.Key_Down:
+            if self.gatedFrames:
+                currentGatedFrame = self.findFrame(self.value())
+                currentGatedFrame = currentGatedFrame - 1
+                if currentGatedFrame < 0:
+                    currentGatedFrame = 0
+                self.setValue(self.gatedFrames[currentGatedFrame])                
+            else:
+                self.setValue(self.value() - 1)
+        elif key == Qt.Key_J:
+            self.setValue(self.value() - 1)
+            QApplication.processEvents()
+            time.sleep(0.1)
+            self.setValue(self.value() + 1)
+            QApplication.processEvents()
+            time.sleep(0.1)
+            self.setValue(self.value() + 1)
+            QApplication.processEvents()
+            time.sleep(0.1)
+            self.setValue(self.value() - 1)
+            QApplication.processEvents()
+
+    def findFrame(self, currentFrame):
+        """Find the closest gated frame.
+
+        Args:
+            currentFrame: int, current displayed frame
+        Returns:
+            currentGatedFrame: int, gated frame closeset to current displayed frame
+        """
+
+        frameDiff = [abs(val - currentFrame) for val in self.gatedFrames]
+        currentGatedFrame = [idx for idx in range(len(frameDiff)) 
+            if frameDiff[idx] == min(frameDiff)][0]
+
+        return currentGatedFrame
+
+    def addGatedFrames(self, gatedFrames):
+        """Stores the gated frames."""
+
+        self.gatedFrames = gatedFrames
+        self.maxFrame = len(self.gatedFrames) - 1
+
+class Master(QMainWindow):
+    """Main Window Class
+
+    Attributes:
+        image: bool, indicates whether images have been loaded (true) or not
+        contours: bool, indicates whether contours have been loaded (true) or not
+        segmentation: bool, indicates whether segmentation has been performed (true) or not
+        lumen: tuple, contours for lumen border
+        plaque: tuple, contours for plaque border
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.image = False
+        self.contours = False
+        self.segmentation = False
+        self.displayTopSize = 800
+        self.current_angle = 0
+        self.gatedFrames = []
+        self.metrics = ([], [], [])
+        self.lesion_info = []
+        self.lviewWorker = None
+        self.gatingWorker = None
+        self.segmentationWorker = None
+        self.segmentedBatch = False
+        self.progress = None
+        self.polarContours = {}
+        self.lumen = ()
+        self.plaque = ()
+        self.settings = Settings()
+        if not os.path.isdir(self.settings.projects_folder):
+            os.makedirs(self.settings.projects_folder)
+        self.frameCache = FrameCache(self.settings.frame_cache_folder, self.settings.frame_cache_size) if self.settings.frame_cache else None
+        self.initUI()
+
+    def initUI(self):
+        self.setGeometry(100, 100, 1200, 1200)
+        self.addToolBar("MY Window")
+        self.showMaximized()
+
+        layout = QHBoxLayout()
+        vbox1 = QVBoxLayout()
+        vbox2 = QVBoxLayout()
+        vbox1hbox1 = QHBoxLayout()
+        vbox1hbox2 = QVBoxLayout()
+
+        vbox1.setContentsMargins(0, 0, 100, 100)
+        vbox2.setContentsMargins(100, 0, 0, 0)
+        layout.addLayout(vbox1)
+        layout.addLayout(vbox2)
+
+        self.projectButton = QPushButton('Read Project')
+        self.dicomButton = QPushButton('Read DICOM')
+        self.contoursButton = QPushButton('Read Contours')
+        self.gatingButton = QPushButton('Extract Diastolic Frames')
+        self.segmentButton = QPushButton('Segment')
+        self.splineButton = QPushButton('Manual Contour')
+        self.writeButton = QPushButton('Write Project')
+        self.reportButton = QPushButton('Write Report') 
+        self.contoursButton.setEnabled(False)        
+        self.gatingButton.setEnabled(False)        
+        self.segmentButton.setEnabled(False)        
+        self.splineButton.setEnabled(False)        
+        self.writeButton.setEnabled(False)        
+        self.reportButton.setEnabled(False)        
+
+        self.projectButton.setToolTip("Reads both images and contours")
+        self.dicomButton.setToolTip("Load images in .dcm format")
+        self.contoursButton.setToolTip("Load saved contours in .xml format")
+        self.gatingButton.setToolTip("Extract end diastolic images from pullback")
+        self.segmentButton.setToolTip("Run deep learning based segmentation of lumen and plaque")
+        self.splineButton.setToolTip("Manually draw new contour for lumen, plaque or stent")
+        self.writeButton.setToolTip("Save project")
+        self.reportButton.setToolTip("Write report containing, lumen, plaque and vessel areas and plaque burden")
+
+        self.info_lumen = QLabel()
+        self.info_vessel = QLabel()
+        self.info_plaque = QLabel()
+        self.info_burden = QLabel()
+        self.info_lumen.setText("Lumen area:     mm<sup>2</sup>")
+        self.info_vessel.setText("Vessel area:     mm<sup>2</sup>")
+        self.info_plaque.setText("Plaque area:     mm<sup>2</sup>")
+        self.info_burden.setText("Plaque burden:     %")
+        self.info_lumen.setAlignment(Qt.AlignLeft)
+        self.info_vessel.setAlignment(Qt.AlignLeft)
+        self.info_plaque.setAlignment(Qt.AlignLeft)
+        self.info_burden.setAlignment(Qt.AlignLeft)
+        self.info_lumen.setFont(QFont('Arial', 11))
+        self.info_vessel.setFont(QFont('Arial', 11))
+        self.info_plaque.setFont(QFont('Arial', 11))
+        self.info_burden.setFont(QFont('Arial', 11))
+        
+        hideHeader1 = QHeaderView(Qt.Vertical)
+        hideHeader1.hide()
+        hideHeader2 = QHeaderView(Qt.Horizontal)
+        hideHeader2.hide()
+        vbox2hbox1 = QHBoxLayout()
+        self.infoTable = QTableWidget()
+        self.infoTable.setRowCount(8)
+        self.infoTable.setColumnCount(2)
+        self.infoTable.setItem(0, 0, QTableWidgetItem('Patient Name'))
+        self.infoTable.setItem(1, 0, QTableWidgetItem('Patient DOB'))
+        self.infoTable.setItem(2, 0, QTableWidgetItem('Patient Sex'))
+        self.infoTable.setItem(3, 0, QTableWidgetItem('Pullback Speed'))
+        self.infoTable.setItem(4, 0, QTableWidgetItem('Resolution (mm)'))
+        self.infoTable.setItem(5, 0, QTableWidgetItem('Dimensions'))
+        self.infoTable.setItem(6, 0, QTableWidgetItem('Manufacturer'))
+        self.infoTable.setItem(7, 0, QTableWidgetItem('Model'))
+        self.infoTable.setVerticalHeader(hideHeader1)
+        self.infoTable.setHorizontalHeader(hideHeader2)
+        self.infoTable.resizeRowsToContents()
+        self.infoTable.resizeColumnsToContents()
+        #self.infoTable.verticalHeader().setStretchLastSection(True)
+        #self.infoTable.setSizePolicy(QSizePolicy.Policy.Minimum,QSizePolicy.Policy.Minimum)
+        self.infoTable.horizontalHeader().setStretchLastSection(True)
+        iHeight = 0
+        for i in range(self.infoTable.rowCount()):
+            iHeight += self.infoTable.verticalHeader().sectionSize(i)
+
+        self.infoTable.setMaximumHeight(iHeight)
+        self.infoTable.verticalScrollBar().setDisabled(True)
+        self.infoTable.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        vbox2.addLayout(vbox2hbox1)
+        
+        vbox2hbox2 = QHBoxLayout()
+        vbox2hbox3 = QHBoxLayout()
+        vbox2hbox4 = QHBoxLayout()
+        vbox2hbox5 = QHBoxLayout()
+        vbox2.addLayout(vbox2hbox2)
+        vbox2.addLayout(vbox2hbox3)
+        vbox2.addLayout(vbox2hbox4)
+        vbox2.addLayout(vbox2hbox5)
+
+        self.projectButton.clicked.connect(self.readProject)
+        self.dicomButton.clicked.connect(self.readDICOM)
+        self.contoursButton.clicked.connect(self.readContours)
+        self.segmentButton.clicked.connect(self.segment)
+        self.splineButton.clicked.connect(self.newSpline)
+        self.gatingButton.clicked.connect(self.gate)
+        self.reportButton.clicked.connect(self.report)
+        self.writeButton.clicked.connect(lambda: self.writeProject())
+
+        self.playButton = QPushButton()
+        pixmapi1 = getattr(QStyle, 'SP_MediaPlay')
+        pixmapi2 = getattr(QStyle, 'SP_MediaPause')
+        self.playIcon = self.style().standardIcon(pixmapi1)
+        self.pauseIcon = self.style().standardIcon(pixmapi2)
+        self.playButton.setIcon(self.playIcon)
+        self.playButton.clicked.connect(self.play)
+        self.paused = True
+        self.playTimer = QTimer(self)
+        self.playTimer.timeout.connect(self.playNextFrame)
+
+        self.slider = Slider(Qt.Horizontal)     
+        self.slider.valueChanged[int].connect(self.changeValue)
+
+        self.hideBox = QCheckBox('Hide Contours')
+        self.hideBox.setChecked(True)
+        self.hideBox.stateChanged[int].connect(self.changeState)
+        self.useGatedBox = QCheckBox('Gated Frames')
+        self.useGatedBox.stateChanged[int].connect(self.useGated)
+        self.useGatedBox.setToolTip("When this is checked only gated frames will be segmented and only gated frames statistics will be written to the report")
+        self.useGatedBox.setToolTipDuration(200)
+           
+        self.wid = Display(self.settings.pixmap_cache_size, self.settings.prefetch_frames)
+        self.c = Communicate()        
+        self.c.updateBW[int].connect(self.wid.setFrame)
+        self.c.updateBool[bool].connect(self.wid.setDisplay)
+        self.wid.lviewChangedSignal.connect(self.updateLview)
+        self.wid.contourUpdatedSignal.connect(self.changeContour)
+        self.wid.frameContourUpdatedSignal.connect(self.changeFrameContour)
+        self.wid.frameChangedKeySignal.connect(self.keyPressDisplay)
+        
+        self.text = QLabel()
+        self.text.setAlignment(Qt.AlignCenter)
+        self.text.setText("Frame {}".format(self.slider.value())) 
+        self.text.setFont(QFont('Arial', 11))
+
+        vbox1.addWidget(self.wid)
+        vbox1hbox1.addWidget(self.playButton)
+        vbox1hbox1.addWidget(self.slider)
+        vbox1.addLayout(vbox1hbox1)
+        vbox1.addWidget(self.text)
+
+        vbox2.addWidget(self.hideBox)
+        vbox2.addWidget(self.useGatedBox)
+        #vbox2.addWidget(self.dicomButton)
+        #vbox2.addWidget(self.contoursButton)
+        #vbox2.addWidget(self.gatingButton)
+        #vbox2.addWidget(self.segmentButton)
+        #vbox2.addWidget(self.splineButton)
+        #vbox2.addWidget(self.writeButton)
+        #vbox2.addWidget(self.reportButton)
+        vbox2hbox2.addWidget(self.projectButton)
+        vbox2hbox2.addWidget(self.dicomButton)
+        vbox2hbox3.addWidget(self.contoursButton)
+        vbox2hbox3.addWidget(self.splineButton)
+        vbox2hbox4.addWidget(self.gatingButton)
+        vbox2hbox4.addWidget(self.segmentButton)
+        vbox2hbox5.addWidget(self.writeButton)
+        vbox2hbox5.addWidget(self.reportButton)
+
+        vbox2hbox1.addWidget(self.infoTable)
+        vbox1.addLayout(vbox1hbox2)
+        vbox1hbox2.addWidget(self.info_lumen)
+        vbox1hbox2.addWidget(self.info_vessel)
+        vbox1hbox2.addWidget(self.info_plaque)
+        vbox1hbox2.addWidget(self.info_burden)
+        
+        # layouts dont provide fixed size functionality so make a widget with a layout instead
+        self.lview_length = 1600
+        self.lview_height = 400
+        displayBottom = QWidget()
+        displayBottom.setFixedHeight(self.lview_height)
+        lay = QHBoxLayout(displayBottom)
+        
+        self.lview = LView(self.displayTopSize)
+        self.lview.markerChangedSignal.connect(self.changeValue2)
+        self.lview.markerChangedKeySignal.connect(self.keyPressDisplay)
+
+        lay.addWidget(self.lview)
+        vbox2.addWidget(displayBottom)
+        vbox2.addLayout(lay)
+        
+        displayBottom1 = QWidget()
+        displayBottom1.setFixedHeight(self.lview_height//2)
+        lay1 = QHBoxLayout(displayBottom1)
+        
+        self.lesionView = LesionView()
+        #self.lview.markerChangedSignal.connect(self.lesionView.updateMarker)
+        #self.lview.markerChangedKeySignal.connect(self.lesionView.updateMarkerFromKey)
+        self.slider.valueChanged[int].connect(self.lesionView.updateMarker)
+        self.lesionView.updateFrameFromLesionViewSignal.connect(self.changeValue)
+
+        lay1.addWidget(self.lesionView)
+        vbox2.addWidget(displayBottom1)
+        vbox2.addLayout(lay1)
+
+        self.lview.horizontalScrollBar().valueChanged.connect(self.lesionView.horizontalScrollBar().setValue)
+        self.lesionView.horizontalScrollBar().valueChanged.connect(self.lview.horizontalScrollBar().setValue)
+        
+        centralWidget = QWidget()
+        centralWidget.setLayout(layout)
+        self.setWindowIcon(QIcon('Media/thumbnail.png'))
+        self.setWindowTitle('DeepIVUS')
+        self.setCentralWidget(centralWidget)
+        self.show()
+        disclaimer = QMessageBox.about(self, 'DeepIVUS', 'DeepIVUS is not FDA approved and should not be used for medical decisions.')
+
+        #pipe = subprocess.Popen(["rm","-r","some.file"])
+        #pipe.communicate() # block until process completes.
+        timer = QTimer(self)
+        timer.timeout.connect(self.autoSave) 
+        timer.start(180000) # autosaves every 3 minutes
+    
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key == Qt.Key_Q:
+            self.close()
+        elif key == Qt.Key_H:
+            if not self.hideBox.isChecked():
+                self.hideBox.setChecked(True)
+            elif self.hideBox.isChecked():
+                self.hideBox.setChecked(False)
+            self.hideBox.setChecked(self.hideBox.isChecked())
+        elif key == Qt.Key_J:
+            currentFrame = self.slider.value()
+            self.slider.setValue(currentFrame+1)
+            QApplication.processEvents()
+            time.sleep(0.1)
+            self.slider.setValue(currentFrame)
+            QApplication.processEvents()
+            time.sleep(0.1)
+            self.slider.setValue(currentFrame-1)
+            QApplication.processEvents()
+            time.sleep(0.1)
+            self.slider.setValue(currentFrame)
+            QApplication.processEvents()
+            
+    def keyPressDisplay(self, event):
+        key = event.key()
+        if key == Qt.Key_Q:
+            self.close()
+        elif key == Qt.Key_H:
+            if not self.hideBox.isChecked():
+                self.hideBox.setChecked(True)
+            elif self.hideBox.isChecked():
+                self.hideBox.setChecked(False)
+            self.hideBox.setChecked(self.hideBox.isChecked())
+        self.slider.keyPressEvent(event)
+        
+    def parseDICOM(self):
+        """Parses DICOM metadata"""
+
+        if self.dicom.get('PatientName'):
+            self.patientName = self.dicom.PatientName.original_string.decode('utf-8').replace("^", " ").strip()
+            print(self.patientName)
+        else:
+            self.patientName = 'Unknown'
+
+        if self.dicom.get('PatientBirthDate'):
+            self.patientBirthDate = self.dicom.PatientBirthDate
+        else:
+            self.patientBirthDate = 'Unknown'
+
+        if self.dicom.get('PatientSex'):
+            self.patientSex = self.dicom.PatientSex
+        else:
+            self.patientSex = 'Unknown'
+
+        if self.dicom.get('IVUSPullbackRate'):
+            self.ivusPullbackRate = float(self.dicom.IVUSPullbackRate)
+        # check Boston private tag
+        elif self.dicom.get(0x000b1001):
+            self.ivusPullbackRate = float(self.dicom[0x000b1001].value)
+        else:
+            self.ivusPullbackRate, _ = QInputDialog.getText(self, "Pullback Speed", "No pullback speed found, please enter pullback speeed (mm/s)", QLineEdit.Normal, "0.5")
+            self.ivusPullbackRate = float(self.ivusPullbackRate)
+
+        if self.dicom.get('FrameTimeVector'):
+            frameTimeVector = self.dicom.get('FrameTimeVector')
+            frameTimeVector = [float(frame) for frame in frameTimeVector]
+            pullbackTime = np.cumsum(frameTimeVector)/1000 # assume in ms
+            self.pullbackLength = pullbackTime*float(self.ivusPullbackRate)
+        else:
+            self.pullbackLength = np.zeros((self.images.shape[0], ))
+
+        if self.dicom.get('SequenceOfUltrasoundRegions'):
+            if self.dicom.SequenceOfUltrasoundRegions[0].PhysicalUnitsXDirection == 3:
+                # pixels are in cm, convert to mm 
+                self.resolution = self.dicom.SequenceOfUltrasoundRegions[0].PhysicalDeltaX*10
+            else:
+                # assume mm
+                self.resolution = self.dicom.SequenceOfUltrasoundRegions[0].PhysicalDeltaX
+        elif self.dicom.get('PixelSpacing'):
+            self.resolution = float(self.dicom.PixelSpacing[0])
+        else:
+            resolution, done = QInputDialog.getText(self, "Pixel Spacing", "No pixel spacing info found, please enter pixel spacing (mm)", QLineEdit.Normal, "")
+            self.resolution = float(resolution)
+        
+        if self.dicom.get('Rows'):
+            self.rows = self.dicom.Rows
+        else:
+            self.rows = self.images.shape[1]
+
+        if self.dicom.get('Manufacturer'):
+            self.manufacturer = self.dicom.Manufacturer
+        else:
+            self.manufacturer = 'Unknown'
+
+        if self.dicom.get('ManufacturerModelName'):
+            self.model = self.dicom.ManufacturerModelName
+        else:
+            self.model = 'Unknown'
+
+        # if pixel data is described by luminance (Y) and chominance (B & R)
+        # only occurs when SamplesPerPixel==3
+        #if self.dicom.get('PhotometricInterpretation') == 'YBR_FULL_422':
+        #    #self.images = np.mean(self.images, 3, dtype=np.uint8)
+        #    self.images = np.ascontiguousarray(self.images)[:, :, :, 0]
+        
+
+    def readProject(self):
+        """Reads project file.
+
+        Adds images and contours to the scene
+        """
+        dialog = FileDialog()
+        if dialog.exec():
+            fileName = dialog.getFileSelected()
+            if not any(fileName):
+                error = QMessageBox()
+                error.setIcon(QMessageBox.Critical)
+                error.setWindowTitle("Error")
+                error.setModal(True)
+                error.setWindowModality(Qt.WindowModal)
+                error.setText("File is not a valid project file and could not be loaded")
+                error.exec_()
+                return
+            dicomPath = fileName['dicom']
+            contoursPath = fileName['contours']
+            self.dicomPath = dicomPath
+            self.processDICOM(dicomPath)
+            self.processContours(contoursPath)
+             
+        
+    def readDICOM(self):  
+        """Opens file dialog to select dicom file"""
+
+        options=QFileDialog.Options()
+        options = QFileDialog.DontUseNativeDialog
+        fileName, _ = QFileDialog.getOpenFileName(self, "QFileDialog.getOpenFileName()", "", "DICOM files (*.dcm);;All files (*)", options=options)
+        self.dicomPath = fileName
+        
+        self.processDICOM(fileName)
+        
+    def processDICOM(self, fileName=None):
+        """Reads DICOM images.
+
+        Reads the dicom images and metadata. Places metatdata in a table.
+        Images are displayed in the graphics scene.
+        """
+
+        if fileName:
+            # results of jobs on the previous pullback must not reach the new one
+            self.cancelJobs()
+            try :
+                self.images = DicomFrames(fileName, self.settings.frame_window, self.frameCache)
+                self.dicom = self.images.dicom
+            except:
+                error = QMessageBox()
+                error.setIcon(QMessageBox.Critical)
+                error.setWindowTitle("Error")
+                error.setModal(True)
+                error.setWindowModality(Qt.WindowModal)
+                error.setText("File is not a valid IVUS file and could not be loaded")
+                error.exec_()
+                return None
+                
+            self.slider.setMaximum(self.dicom.NumberOfFrames-1)
+            self.image = True
+            self.parseDICOM()
+            self.numberOfFrames = int(self.dicom.NumberOfFrames)
+            self.infoTable.setItem(0, 1, QTableWidgetItem(self.patientName))
+            self.infoTable.setItem(1, 1, QTableWidgetItem(self.patientBirthDate))
+            self.infoTable.setItem(2, 1, QTableWidgetItem(self.patientSex))
+            self.infoTable.setItem(3, 1, QTableWidgetItem(str(self.ivusPullbackRate)))
+            self.infoTable.setItem(4, 1, QTableWidgetItem(str(self.resolution)))
+            self.infoTable.setItem(5, 1, QTableWidgetItem(str(self.rows)))
+            self.infoTable.setItem(6, 1, QTableWidgetItem(self.manufacturer))        
+            self.infoTable.setItem(7, 1, QTableWidgetItem((self.model)))
+            
+            if len(self.lumen) != 0:
+                reinitializeContours = len(self.lumen) != self.numberOfFrames
+            else:
+                reinitializeContours = False
+
+            if not self.lumen or reinitializeContours:
+                self.lumen = ([[] for idx in range(self.numberOfFrames)], [[] for idx in range(self.numberOfFrames)])
+                self.plaque = ([[] for idx in range(self.numberOfFrames)], [[] for idx in range(self.numberOfFrames)])
+                self.stent = ([[] for idx in range(self.numberOfFrames)], [[] for idx in range(self.numberOfFrames)])
+
+            self.wid.setData(self.lumen, self.plaque, self.stent, self.images)
+
+            # create lview data
+            self.lview_data = LViewData(self.images.shape)
+            lview_array = self.lview_data.update(self.images, self.current_angle)
+
+            # lview
+            self.lview.createScene(lview_array)
+            self.startLviewWorker()
+            
+            self.slider.setValue(self.numberOfFrames-1)
+
+            self.contoursButton.setEnabled(True)        
+            self.gatingButton.setEnabled(True)        
+            self.segmentButton.setEnabled(True)        
+            self.splineButton.setEnabled(True)        
+
+    def readContours(self):
+        """Reads contours.
+
+        Reads contours  saved in xml format (Echoplaque compatible) and 
+        displays the contours in the graphics scene
+        """
+
+        if not self.image:
+            warning = QErrorMessage()
+            warning.setWindowModality(Qt.WindowModal)
+            warning.showMessage('Reading of contours failed. Images must be loaded prior to loading contours')
+            warning.exec_()
+        else:
+            options=QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+            fileName, _ = QFileDialog.getOpenFileName(self, "QFileDialog.getOpenFileName()", "", "XML file (*.xml)", options=options)
+            if fileName:
+                self.processContours(fileName)
+
+    def processContours(self, fileName):
+        self.lumen, self.plaque, self.stent, self.resolution, frames = read_xml.read(fileName)
+        if len(self.lumen[0]) != self.dicom.NumberOfFrames:
+            warning = QErrorMessage()
+            warning.setWindowModality(Qt.WindowModal)
+            warning.showMessage('Reading of contours failed. File must contain the same number of frames as loaded dicom')
+            warning.exec_()
+        else:
+            self.resolution = float(self.resolution[0])
+            self.contours=True
+            self.wid.setData(self.lumen, self.plaque, self.stent, self.images)
+            self.hideBox.setChecked(False)
+
+            gatedFrames = [frame for frame in range(len(self.lumen[0])) if self.lumen[0][frame] or self.plaque[0][frame]]
+            self.gatedFrames = gatedFrames
+            self.useGatedBox.setChecked(True)
+            self.slider.addGatedFrames(self.gatedFrames)
+
+            self.metrics = self.computeContourMetrics(self.lumen, self.plaque)
+            lumen_area, plaque_area, plaque_burden = self.metrics
+            self.updateAreaDisplay(lumen_area, plaque_area, plaque_burden, self.slider.value())
+    
+            # recreate lview scene
+            lview_array = self.lview_data.update(self.images, self.current_angle)
+            self.lview.createScene(lview_array)
+            self.requestLview()
+
+            self.lview_lumenY = [self.lview_length*(frame/self.numberOfFrames) for frame in range(self.numberOfFrames)]
+            self.lview_plaqueY = [self.lview_length*(frame/self.numberOfFrames) for frame in range(self.numberOfFrames)]
+            self.lview_lumen, self.lview_lumen1, self.lview_lumen2 = self.getLviewCoordinates(self.lumen)
+            self.lview_plaque, self.lview_plaque1, self.lview_plaque2 = self.getLviewCoordinates(self.plaque)
+            self.lview.createLViewContours(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen1, self.lview_lumen2, self.lview_plaque1, self.lview_plaque2)
+                   
+            self.lesion_info = self.lesion_analysis(lumen_area, plaque_area, plaque_burden)
+            self.lesionView.setNumberOfFrames(self.numberOfFrames)
+            self.lesionView.createScene(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen, self.lview_plaque, self.lesion_info, self.lview_length)
+            self.reportButton.setEnabled(True) 
+            self.writeButton.setEnabled(True)
+    
+    def lesion_analysis(self, lumen_area, plaque_area, plaque_burden):
+        """identifies which frames are part of a lesion where lesion is defined 
+        as >=3 frames wiht plaque burden >40%
+        """
+
+        lumen_area = lumen_area[self.gatedFrames]
+        plaque_area = plaque_area[self.gatedFrames]
+        plaque_burden = plaque_burden[self.gatedFrames]
+        
+        # result is a dictionary contaning tuples of the value and the indices containing the value
+        # if lesions are within 5mm of each other they are considered a single lesion
+        lesion_idx = (plaque_burden > 40).astype(int)
+        num_frames = 3
+        result = []
+        for k, g in groupby(enumerate(lesion_idx), key=itemgetter(1)):
+            group = list(g)
+            if len(group) >= num_frames:
+                if k != 0:
+                    result.append((k, list(map(itemgetter(0), group))))
+                    
+        num_lesions = len(result)
+        print(f"Detected {num_lesions} number of initial lesions")
+        lesion_info = []
+        for i in range(num_lesions):
+            lesion = {}
+            lesion['MLA'] = lumen_area[result[i][1]].min()
+            lesion['idx' ] = [self.gatedFrames[idx] for idx in result[i][1]]
+            lesion['MLA idx'] = self.gatedFrames[result[i][1][0] + lumen_area[result[i][1]].argmin()]
+            lesion['MPB idx'] = self.gatedFrames[result[i][1][0] + plaque_burden[result[i][1]].argmax()]
+            lesion_length = self.pullbackLength[self.gatedFrames[result[i][1][-1]]] - self.pullbackLength[self.gatedFrames[result[i][1][0]]]
+            lesion['length'] = lesion_length
+            
+            # merge lesions that are within n mm of each other
+            if i == 0:
+                lesion_info.append(lesion)
+            else:
+                lesion_distance = (lesion['idx'][0] - lesion_info[-1]['idx'][-1])*self.pullbackLength[1]
+                if lesion_distance <= self.settings.lesion_merge_length:
+                    frame_idx = [idx for idx, frame in enumerate(self.gatedFrames) if frame in lesion_info[-1]['idx']]
+                    missing_idx = list(range(frame_idx[-1] + 1, result[i][1][0]))
+                    frame_idx.extend(missing_idx)
+                    frame_idx.extend(result[i][1])
+                    lesion['MLA'] = lumen_area[frame_idx].min()
+                    lesion['idx' ] = [self.gatedFrames[idx] for idx in frame_idx]
+                    lesion['MLA idx'] = self.gatedFrames[frame_idx[0] + lumen_area[frame_idx].argmin()]
+                    lesion['MPB idx'] = self.gatedFrames[frame_idx[0] + plaque_burden[frame_idx].argmax()]
+                    lesion_length = self.pullbackLength[self.gatedFrames[frame_idx[-1]]] - self.pullbackLength[self.gatedFrames[frame_idx[0]]]
+                    lesion['length'] = lesion_length    
+                    lesion_info[-1] = lesion
+                else:
+                    lesion_info.append(lesion)
+
+        print(f"Detected {len(lesion_info)} number of merged lesions")
+
+        final_lesion_info = []
+        # remove any lesions that are less than minimum lesion length
+        for i in range(len(lesion_info)):
+            if lesion_info[i]['length'] >= self.settings.lesion_length:
+                final_lesion_info.append(lesion_info[i])
+            else:
+                print(f"Removed lesion {i} of {lesion_info[i]['length']} mm length")
+
+        return final_lesion_info        
+            
+    def play(self):
+        "Plays all frames until end of pullback starting from currently selected frame at the acquisition frame rate"""
+        if not self.image:
+            return
+
+        if self.paused:
+            self.paused = False
+            self.playButton.setIcon(self.pauseIcon)        
+            frame_rate = float(self.dicom.get('CineRate') or 30)
+            self.playTimer.start(max(int(round(1000/frame_rate)), 1))
+        else:
+            self.stopPlayback()
+
+    def playNextFrame(self):
+        frame = self.slider.value() + 1
+        if frame >= self.numberOfFrames:
+            self.stopPlayback()
+            return
+        self.slider.setValue(frame)
+
+    def stopPlayback(self):
+        self.playTimer.stop()
+        self.paused = True
+        self.playButton.setIcon(self.playIcon)        
+
+    def writeProject(self, fname=None):
+        """Writes project file as an xml file"""
+        patientName = self.infoTable.item(0, 1).text()
+        saveName = patientName if fname is None else fname
+        lviewPath = os.path.join(self.settings.projects_folder, saveName + '.png')
+        contourPath = os.path.join(self.settings.projects_folder, saveName + '_contours.xml')
+        projectPath = os.path.join(self.settings.projects_folder, saveName + '.proj')
+        
+        lumen_area, plaque_area, plaque_burden = self.metrics
+        lumen_volume = self.computeVolume(lumen_area)
+        plaque_volume = self.computeVolume(plaque_area)
+        
+        project_info = {}
+        project_info['name'] = patientName
+        project_info['lumenvolume'] = str(round(lumen_volume))
+        project_info['plaquevolume'] = str(round(plaque_volume))
+        project_info['minimumlumenarea'] = str(round(np.min(lumen_area[np.nonzero(lumen_area)]), 2))
+        project_info['dicompath'] = self.dicomPath
+        project_info['contourpath'] = contourPath
+        project_info['previewpath'] = lviewPath
+
+        self.writeContours(os.path.join(self.settings.projects_folder, saveName))
+        
+        midslice = self.images.shape[1]//2
+        lview = np.transpose(self.images[:, midslice, :], [1, 0])
+        image = Image.fromarray(lview)
+        image.save(lviewPath)
+        
+        write_project(project_info, projectPath)
+        self.successMessage('Writing project')
+
+    def writeContours(self, fname=None):
+        """Writes contours to an xml file compatible with Echoplaque"""
+
+        patientName = self.infoTable.item(0, 1).text()
+        saveName = patientName if fname is None else fname
+
+        self.lumen, self.plaque = self.wid.getData()
+
+        # reformat data for compatibility with write_xml function
+        x, y = [], []
+        for i in range(len(self.lumen[0])):
+            x.append(self.lumen[0][i])
+            x.append(self.plaque[0][i])
+            y.append(self.lumen[1][i])
+            y.append(self.plaque[1][i])
+
+        if not self.segmentation and not self.contours:
+            self.errorMessage()
+        else:
+            frames = list(range(self.numberOfFrames))
+
+            write_xml(x, y, self.images.shape, self.resolution, self.ivusPullbackRate, frames, saveName)
+            if fname is None:
+                self.successMessage('Writing contours')
+
+    def autoSave(self):
+        """Automatically saves contours to a temporary file every 180 seconds"""
+
+        if self.contours and self.settings.autoSave:
+            print('Automatically saving current contours')
+            self.writeContours('temp')
+
+    def report(self):
+        """Writes a report file containing lumen area, plaque, area, vessel area, plaque burden, phenotype"""
+
+        if self.segmentation and not self.contours:
+            self.errorMessage()
+        else:
+            self.lumen, self.plaque = self.wid.getData()
+            lumen_area, plaque_area, plaque_burden = self.computeContourMetrics(self.lumen, self.plaque)
+            phenotype = [0]*self.numberOfFrames
+            patientName = self.infoTable.item(0, 1).text()
+            vessel_area = lumen_area + plaque_area
+
+            if self.useGatedBox.isChecked():
+                frames = self.gatedFrames
+            else:
+                frames = list(range(self.numberOfFrames))
+
+            f = open(patientName + '_report.txt', 'w')
+            f.write('Frame\tPosition (mm)\tLumen area (mm\N{SUPERSCRIPT TWO})\tPlaque area (mm\N{SUPERSCRIPT TWO})\tVessel area (mm\N{SUPERSCRIPT TWO})\tPlaque burden (%)\tphenotype\n')
+
+            for i, frame in enumerate(frames):
+                f.write('{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{}\n'.format(frame, self.pullbackLength[frame], lumen_area[frame], plaque_area[frame], vessel_area[frame], plaque_burden[frame], phenotype[frame]))
+            f.close()
+
+            self.successMessage('Write report')
+
+    def computeMetrics(self, masks):
+        """Measures lumen area, plaque area and plaque burden from a map of frame to mask, 
+        frames without a mask have zero area"""
+
+        lumen, plaque = 1, 2  
+        lumen_area = np.zeros((self.numberOfFrames))
+        plaque_area = np.zeros_like(lumen_area)
+        for frame, mask in masks.items():
+            lumen_area[frame] = np.sum(mask == lumen)*self.resolution**2
+            plaque_area[frame] = np.sum(mask == plaque)*self.resolution**2
+        vessel_area = lumen_area + plaque_area
+        plaque_burden = np.divide(plaque_area, vessel_area, out=np.zeros_like(lumen_area), where=vessel_area > 0)*100
+
+        return (lumen_area, plaque_area, plaque_burden)
+
+    def gate(self):
+        """Extracts end diastolic frames in a background thread"""
+
+        self.gatingWorker = GatingWorker(self.images, self.ivusPullbackRate, self.dicom.CineRate, self.settings.gating_workers)
+        self.gatingWorker.progress.connect(self.updateProgress)
+        self.gatingWorker.gated.connect(self.gatingFinished)
+        self.showProgress("Computing end diastolic images", self.gatingWorker)
+        self.gatingWorker.start()
+
+    def gatingFinished(self, gatedFrames):
+        """Shows the end diastolic frames, gatedFrames is None if gating was cancelled"""
+
+        if self.sender() is not self.gatingWorker:
+            return
+        self.closeProgress()
+        self.gatingWorker.wait()
+        self.gatingWorker = None
+        if gatedFrames is None:
+            return
+
+        self.gatedFrames = gatedFrames
+        if self.gatedFrames:
+            self.slider.addGatedFrames(self.gatedFrames)
+            self.useGatedBox.setChecked(True)
+            self.successMessage("Diastolic frame (change with up and down arrows) extraction")
+        else:
+            warning = QErrorMessage()
+            warning.setWindowModality(Qt.WindowModal)
+            warning.showMessage('Diastolic frame extraction was unsuccessful')
+            warning.exec_()            
+
+    def segment(self):
+        """Segmentation and phenotyping of IVUS images.
+
+        Frames are segmented in a background thread, the contours of each batch 
+        are shown as it completes and the lesions are analysed once all batches 
+        are done. Cancelling keeps the frames that have been segmented.
+        """
+
+        save_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'model', 'saved_model.pb')
+        #save_path = os.path.join('/home/microway/Documents/IVUS', 'model_2021', 'saved_model.pb')
+
+        if not os.path.isfile(save_path):
+            message= "No saved weights have been found, segmentation will be unsuccessful, check that weights are saved in {}".format(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'model'))
+            error = QMessageBox()
+            error.setIcon(QMessageBox.Critical)
+            error.setWindowTitle("Error")
+            error.setModal(True)
+            error.setWindowModality(Qt.WindowModal)
+            error.setText(message)
+            error.exec_()
+            return -1
+
+        warning = QErrorMessage()
+        warning.setWindowModality(Qt.WindowModal)
+        warning.showMessage('Warning: IVUS Phenotyping is currently only supported for 20MHz images. Interpret other images with extreme caution')
+        warning.exec_()
+
+        # masks are only computed for the gated frames if gated frames are used
+        frames = self.gatedFrames if self.useGatedBox.isChecked() else None
+        self.segmentationWorker = SegmentationWorker(self.images, frames, self.settings.batch_size, 
+            self.settings.contour_mode, self.settings.contour_angles)
+        self.segmentationWorker.progress.connect(self.updateProgress)
+        self.segmentationWorker.batchSegmented.connect(self.showSegmentedBatch)
+        self.segmentationWorker.failed.connect(self.segmentationFailed)
+        self.segmentationWorker.segmented.connect(self.segmentationFinished)
+        # previous contours are kept until the first batch arrives
+        self.segmentedBatch = False
+        self.showProgress("Segmenting images", self.segmentationWorker)
+        self.segmentationWorker.start()
+
+    def clearSegmentation(self):
+        """Replaces the contours and metrics with empty ones before the first segmented batch is shown"""
+
+        image_dim = self.images.shape
+
+        # frames without a segmented batch have empty contours until their batch completes
+        self.lumen = ([[] for i in range(image_dim[0])], [[] for i in range(image_dim[0])])
+        self.plaque = ([[] for i in range(image_dim[0])], [[] for i in range(image_dim[0])])
+        # stent contours currently unsupported so create empty list
+        self.stent = [[[] for i in range(image_dim[0])], [[] for i in range(image_dim[0])]]
+        self.metrics = (np.zeros((self.numberOfFrames)), np.zeros((self.numberOfFrames)), np.zeros((self.numberOfFrames)))
+        self.contours = False
+        self.wid.setData(self.lumen, self.plaque, self.stent, self.images)
+
+        # recreate lview scene
+        lview_array = self.lview_data.update(self.images, self.current_angle)
+        self.lview.createScene(lview_array)
+        self.requestLview()
+
+        self.lview_lumenY = [self.lview_length*(frame/self.numberOfFrames) for frame in range(self.numberOfFrames)]
+        self.lview_plaqueY = [self.lview_length*(frame/self.numberOfFrames) for frame in range(self.numberOfFrames)]
+        self.lview_lumen, self.lview_lumen1, self.lview_lumen2 = self.getLviewCoordinates(self.lumen)
+        self.lview_plaque, self.lview_plaque1, self.lview_plaque2 = self.getLviewCoordinates(self.plaque)
+        self.lview.createLViewContours(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen1, self.lview_lumen2, self.lview_plaque1, self.lview_plaque2)
+
+    def showSegmentedBatch(self, frames, masks, lumen, plaque):
+        """Shows the contours and metrics of a segmented batch of frames.
+
+        Only the frames of the batch are updated in the display, the polar form 
+        of the contours and the lview positions.
+        """
+
+        if self.sender() is not self.segmentationWorker:
+            return
+        if not self.segmentedBatch:
+            self.clearSegmentation()
+            self.segmentedBatch = True
+
+        # compute metrics such as plaque burden
+        batch_metrics = self.computeMetrics(dict(zip(frames, masks)))
+        for values, batch_values in zip(self.metrics, batch_metrics):
+            values[frames] = batch_values[frames]
+
+        for i, frame in enumerate(frames):
+            self.lumen[0][frame], self.lumen[1][frame] = lumen[0][i], lumen[1][i]
+            self.plaque[0][frame], self.plaque[1][frame] = plaque[0][i], plaque[1][i]
+
+        if not self.contours:
+            self.contours = True
+            self.hideBox.setChecked(False)
+        self.wid.setFrameData(frames, lumen, plaque)
+        lumen_area, plaque_area, plaque_burden = self.metrics
+        self.updateAreaDisplay(lumen_area, plaque_area, plaque_burden, self.slider.value())
+
+        # lview positions of the batch frames only
+        radius_normalizing_value = self.lview_data.normalizingRadius(self.current_angle)
+        for contour, values in ((self.lumen, (self.lview_lumen, self.lview_lumen1, self.lview_lumen2)), 
+            (self.plaque, (self.lview_plaque, self.lview_plaque1, self.lview_plaque2))):
+            polar = self.polarContours.get(id(contour))
+            if polar is None or polar.contours is not contour:
+                # the contour lists were replaced by an edit
+                values[0][:], values[1][:], values[2][:] = self.getLviewCoordinates(contour)
+                continue
+            for frame in frames:
+                polar.updateFrame(frame, contour[0][frame], contour[1][frame])
+                for lview_values, value in zip(values, polar.frameCoordinates(frame, self.current_angle, radius_normalizing_value, self.lview_height)):
+                    lview_values[frame] = value
+        self.lview.updateLViewContours(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen1, self.lview_lumen2, self.lview_plaque1, self.lview_plaque2)
+
+    def segmentationFailed(self, message):
+        if self.sender() is not self.segmentationWorker:
+            return
+        error = QMessageBox()
+        error.setIcon(QMessageBox.Critical)
+        error.setWindowTitle("Error")
+        error.setWindowModality(Qt.WindowModal)
+        error.setText("Segmentation failed: {}".format(message))
+        error.exec_()
+
+    def segmentationFinished(self, completed):
+        """Analyses lesions in the segmented frames, completed is False if segmentation was cancelled.
+
+        The previous contours are unchanged if no batch was segmented.
+        """
+
+        if self.sender() is not self.segmentationWorker:
+            return
+        self.closeProgress()
+        self.segmentationWorker.wait()
+        self.segmentationWorker = None
+        if not self.segmentedBatch:
+            return
+
+        self.segmentation = True
+        self.lesion_info = self.lesion_analysis(*self.metrics)
+        self.lesionView.setNumberOfFrames(self.numberOfFrames)
+        self.lesionView.createScene(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen, self.lview_plaque, self.lesion_info, self.lview_length)
+
+        self.writeButton.setEnabled(True)        
+        self.reportButton.setEnabled(True) 
+        if completed:
+            self.successMessage('Segmentation')
+
+    def showProgress(self, title, worker):
+        """Shows a progress dialog for a background job, cancelling the dialog cancels the job.
+
+        The dialog is not modal so frames can be viewed while the job runs, 
+        loading and jobs that change the contours are disabled until it finishes.
+        """
+
+        self.progress = QProgressDialog(title, "Cancel", 0, 1, self)
+        self.progress.setWindowTitle(title)
+        self.progress.setAutoClose(False)
+        self.progress.setAutoReset(False)
+        self.progress.setMinimumDuration(0)
+        self.progress.resize(500, 100)
+        self.progress.canceled.connect(worker.cancel)
+        self.progress.show()
+        self.setJobButtonsEnabled(False)
+
+    def updateProgress(self, done, total):
+        if self.progress is not None and self.sender() in (self.gatingWorker, self.segmentationWorker):
+            self.progress.setMaximum(total)
+            self.progress.setValue(done)
+
+    def closeProgress(self):
+        if self.progress is not None:
+            # closing the dialog would otherwise emit canceled
+            self.progress.canceled.disconnect()
+            self.progress.close()
+            self.progress = None
+        self.setJobButtonsEnabled(True)
+
+    def setJobButtonsEnabled(self, enabled):
+        for button in (self.projectButton, self.dicomButton, self.contoursButton, self.splineButton, self.gatingButton, self.segmentButton):
+            button.setEnabled(enabled)
+
+    def cancelJobs(self):
+        """Cancels running background jobs and waits for them to stop, their pending results are dropped"""
+
+        running = [worker for worker in (self.gatingWorker, self.segmentationWorker) if worker is not None]
+        for worker in running:
+            worker.cancel()
+            worker.wait()
+        self.gatingWorker = None
+        self.segmentationWorker = None
+        if running:
+            self.closeProgress()
+
+    def newSpline(self):
+        """Create a message box to choose what spline to create"""
+
+        b3 = QPushButton("lumen")
+        b2 = QPushButton("Vessel")
+        b1 = QPushButton("Stent")
+        
+        checkbox = QCheckBox("Include current frame in gated contours?")
+        checkbox.setChecked(True)
+        d = QMessageBox()
+        d.setCheckBox(checkbox)
+        d.setText("Select which contour to draw")
+        d.setInformativeText("Contour must be closed before proceeding by clicking on initial point")
+        d.setWindowModality(Qt.WindowModal)
+        d.addButton(b1, 0)
+        d.addButton(b2, 1)
+        d.addButton(b3, 2)
+         
+        result = d.exec_()
+
+        self.wid.new(result)
+        self.gatedFrames.append(self.slider.value())
+        self.gatedFrames = list(set(self.gatedFrames))
+        self.gatedFrames.sort()
+
+        self.slider.addGatedFrames(self.gatedFrames)
+        self.hideBox.setChecked(False)
+
+        self.writeButton.setEnabled(True)        
+        self.reportButton.setEnabled(True) 
+    
+    def maskToContours(self, masks):
+        """Convert a map of frame to mask to IVUS contours """
+
+        lumen_pred, plaque_pred = mask_contours(masks, self.images.shape, self.settings.contour_workers, 
+            self.settings.contour_mode, self.settings.contour_angles)
+
+        return lumen_pred, plaque_pred
+
+    def computeVolume(self, areas):
+        """Calculate volume of contoured region using trapezoid formula"""
+
+        return trapezoid_volume(areas, self.gatedFrames, self.pullbackLength)
+
+    def computeContourMetrics(self, lumen, plaque):
+        """Computes lumen area, plaque area and plaque burden from contours"""
+
+        return contour_metrics(lumen, plaque, self.resolution)
+
+    def updateAreaDisplay(self, lumen_area, plaque_area, plaque_burden, frame):
+        """Updates the display of lumen, plaque area"""
+        if len(lumen_area) > 0:
+            self.info_lumen.setText(f"Lumen area:  {lumen_area[frame]:.2f} mm<sup>2</sup>")
+        if len(plaque_area) > 0:
+            self.info_plaque.setText(f"Plaque area: {plaque_area[frame]:.2f} mm<sup>2</sup>")
+        if len(lumen_area) > 0 and len(plaque_area) > 0:
+            self.info_vessel.setText(f"Vessel area: {(plaque_area[frame] + lumen_area[frame]):.2f} mm<sup>2</sup>")
+            self.info_burden.setText(f"Plaque burden: {plaque_burden[frame]:.2f} %")  
+
+
+    def angle_to_vector(self, angle):
+        angle = np.deg2rad(angle)
+        x = np.cos(angle)
+        y = np.sin(angle)
+        return (x, y)
+
+    def getLviewCoordinates(self, contour):
+        """Finds where the lview cut crosses the contour of every frame.
+
+        The polar form of the contours is kept while the contour lists are 
+        unchanged so a change of angle only searches the cached arrays.
+        """
+
+        polar = self.polarContours.get(id(contour))
+        if polar is None or polar.contours is not contour:
+            polar = PolarContours(contour, self.images.shape[1]//2)
+            # keep only the polar forms of the current contours
+            self.polarContours = {key: value for key, value in self.polarContours.items() 
+                if value.contours is self.lumen or value.contours is self.plaque}
+            self.polarContours[id(contour)] = polar
+
+        radius_normalizing_value = self.lview_data.normalizingRadius(self.current_angle)
+        return polar.coordinates(self.current_angle, radius_normalizing_value, self.lview_height)
+
+    def startLviewWorker(self):
+        """Starts the background lview resampling thread for the loaded pullback"""
+
+        if self.lviewWorker is not None:
+            self.lviewWorker.stop()
+            self.lviewWorker = None
+        if self.settings.lview_resampling == 'bilinear':
+            self.lviewWorker = LViewWorker(self.lview_data, self.images, self.lview_length, self.lview_height)
+            self.lviewWorker.resampled.connect(self.showResampledLview)
+            self.lviewWorker.start()
+            self.requestLview()
+
+    def requestLview(self):
+        """Requests a resampled lview at the current angle"""
+
+        if self.lviewWorker is not None:
+            self.lviewWorker.request(self.current_angle)
+
+    def showResampledLview(self, angle, lview_array):
+        # results for an angle the crossbar has since left are dropped
+        if angle == self.current_angle:
+            self.lview.updateImage(lview_array)
+
+    def closeEvent(self, event):
+        self.cancelJobs()
+        if self.lviewWorker is not None:
+            self.lviewWorker.stop()
+        self.wid.stopPrefetcher()
+        super().closeEvent(event)
+
+    def angle3pt(self, a, b, c):
+        """Counterclockwise angle in degrees by turning from a to c around b
+        Returns a float between 0.0 and 360.0"""
+        ang = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(a[1] - b[1], a[0] - b[0])
+        ang = np.rad2deg(ang)
+        return ang + 360 if ang < 0 else ang
+    
+    def updateLview(self, x1, y1, x2, y2):
+        """this is triggered if the lview is changed via the crossbar"""
+        if not self.image:
+            return
+        #self.scenelong.clear()
+        #self.lview.viewport().update()
+
+        #[self.removeItem(item) for item in self.scenelong.items()]
+
+        #print(x1,y1, x2, y2)
+        line1 = [[0, self.displayTopSize//2], [self.displayTopSize//2, self.displayTopSize//2]]
+        line2 = [[x1, y1], [x2, y2]]
+        current_angle = round(self.angle3pt(line1[0], line1[1], line2[0]))
+        #print(current_angle)
+        
+        # current_angle is returned where 9pm is 180 degress and angle increase clockwise
+        # need to subtract 180 in order to match image polar coordinates where 9pm is 0 degrees
+        current_angle = current_angle  - 180
+        current_angle = current_angle + 360 if current_angle < 0 else current_angle
+        self.current_angle = current_angle
+        #print(current_angle)
+        
+        if self.lviewWorker is not None:
+            # resampled in the background, the image is updated when the worker finishes
+            self.lviewWorker.request(current_angle)
+        else:
+            lview_array = self.lview_data.update(self.images, current_angle)
+            self.lview.updateImage(lview_array)
+        
+        lumen_frames = [i for i in range(len(self.lumen[0])) if self.lumen[0][i]]
+        plaque_frames = [i for i in range(len(self.plaque[0])) if self.plaque[0][i]]
+
+        if self.contours:
+            self.lview_lumenY = [self.lview_length*(frame/self.numberOfFrames) if frame in lumen_frames else None for frame in range(self.numberOfFrames)]
+            #self.lview_plaqueY = [self.lview_length*(frame/self.numberOfFrames) for frame in plaque_frames]
+            self.lview_plaqueY = [self.lview_length*(frame/self.numberOfFrames) if frame in plaque_frames else None for frame in range(self.numberOfFrames)]
+
+            self.lview_lumen, self.lview_lumen1, self.lview_lumen2 = self.getLviewCoordinates(self.lumen)
+            self.lview_plaque, self.lview_plaque1, self.lview_plaque2 = self.getLviewCoordinates(self.plaque)
+            self.lview.updateLViewContours(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen1, self.lview_lumen2, self.lview_plaque1, self.lview_plaque2)
+                                 
+    def changeContour(self, is_true):
+        if is_true:
+            self.lumen, self.plaque = self.wid.getData()
+            self.metrics = self.computeContourMetrics(self.lumen, self.plaque)
+            lumen_area, plaque_area, plaque_burden = self.metrics
+            self.updateAreaDisplay(lumen_area, plaque_area, plaque_burden, self.slider.value())
+           
+            lumen_frames = [i for i in range(len(self.lumen[0])) if self.lumen[0][i]]
+            plaque_frames = [i for i in range(len(self.plaque[0])) if self.plaque[0][i]]
+            print('lumen_frames', lumen_frames)
+            print('plaque_frames', plaque_frames)
+            # add changing coordinates when lview is changed
+            #self.lview_lumenY = [self.lview_length*(frame/self.numberOfFrames) for frame in lumen_frames]
+            self.lview_lumenY = [self.lview_length*(frame/self.numberOfFrames) if frame in lumen_frames else None for frame in range(self.numberOfFrames)]
+            #self.lview_plaqueY = [self.lview_length*(frame/self.numberOfFrames) for frame in plaque_frames]
+            self.lview_plaqueY = [self.lview_length*(frame/self.numberOfFrames) if frame in plaque_frames else None for frame in range(self.numberOfFrames)]
+            print(self.lview_lumenY)
+            self.lview_lumen, self.lview_lumen1, self.lview_lumen2 = self.getLviewCoordinates(self.lumen)
+            print(self.lview_lumen1)
+            self.lview_plaque, self.lview_plaque1, self.lview_plaque2 = self.getLviewCoordinates(self.plaque)
+            self.lview.updateLViewContours(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen1, self.lview_lumen2, self.lview_plaque1, self.lview_plaque2)
+            
+            self.lesion_info = self.lesion_analysis(*self.metrics)
+            self.lesionView.createScene(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen, self.lview_plaque, self.lesion_info, self.lview_length)
+
+    def changeFrameContour(self, frame):
+        """Updates metrics, lview and lesions after the contour of a single frame was edited.
+
+        Only the edited frame is recomputed, the lesions are found again only if 
+        the frame crossed the plaque burden threshold, otherwise the markers of the 
+        lesion containing the frame are moved and the cartoon rows around it redrawn.
+        Edits that add or remove a contour fall back to the full update.
+        """
+        lumen, plaque = self.wid.getFrameData(frame)
+        polarLumen = self.polarContours.get(id(self.lumen))
+        polarPlaque = self.polarContours.get(id(self.plaque))
+        if (bool(lumen[0]) != bool(self.lumen[0][frame]) or bool(plaque[0]) != bool(self.plaque[0][frame]) 
+            or polarLumen is None or polarLumen.contours is not self.lumen or polarPlaque is None 
+            or polarPlaque.contours is not self.plaque or len(self.metrics[0]) != self.numberOfFrames):
+            self.changeContour(True)
+            return
+
+        self.lumen[0][frame], self.lumen[1][frame] = lumen
+        self.plaque[0][frame], self.plaque[1][frame] = plaque
+        lumen_area, plaque_area, plaque_burden = self.metrics
+        was_lesion = plaque_burden[frame] > 40
+        frame_metrics = self.computeContourMetrics(([lumen[0]], [lumen[1]]), ([plaque[0]], [plaque[1]]))
+        for values, value in zip(self.metrics, frame_metrics):
+            values[frame] = value[0]
+        self.updateAreaDisplay(lumen_area, plaque_area, plaque_burden, self.slider.value())
+
+        # lview positions of the edited frame only
+        radius_normalizing_value = self.lview_data.normalizingRadius(self.current_angle)
+        for polar, contour, values in ((polarLumen, lumen, (self.lview_lumen, self.lview_lumen1, self.lview_lumen2)), 
+            (polarPlaque, plaque, (self.lview_plaque, self.lview_plaque1, self.lview_plaque2))):
+            if contour[0]:
+                polar.updateFrame(frame, *contour)
+            for lview_values, value in zip(values, polar.frameCoordinates(frame, self.current_angle, radius_normalizing_value, self.lview_height)):
+                lview_values[frame] = value
+        self.lview.updateFrame(frame)
+
+        if frame in self.gatedFrames and (plaque_burden[frame] > 40) != was_lesion:
+            # lesion extents changed
+            self.lesion_info = self.lesion_analysis(*self.metrics)
+            self.lesionView.createScene(self.lview_lumenY, self.lview_plaqueY, self.lview_lumen, self.lview_plaque, self.lesion_info, self.lview_length)
+            return
+
+        for i, lesion in enumerate(self.lesion_info):
+            if frame in lesion['idx']:
+                lesion['MLA'] = lumen_area[lesion['idx']].min()
+                lesion['MLA idx'] = lesion['idx'][lumen_area[lesion['idx']].argmin()]
+                lesion['MPB idx'] = lesion['idx'][plaque_burden[lesion['idx']].argmax()]
+                self.lesionView.updateLesion(i, lesion)
+        self.lesionView.updateFrame(frame, self.lview_lumen, self.lview_plaque)
+
+    def changeValue2(self, value):
+        """runs when lview marker is changed"""
+        value = round(value*(self.numberOfFrames - 1))
+        self.c.updateBW.emit(value)
+        self.wid.run()
+        self.text.setText(f"Frame {value}")
+        self.slider.setValue(value)
+
+            
+    def changeValue(self, value):
+        """runs when slider is moved"""
+        self.c.updateBW.emit(value)
+        if self.paused:
+            self.wid.run()
+        else:
+            self.wid.showFrame()
+        self.text.setText(f"Frame {value}")
+        self.slider.setValue(value)
+        lumen_area, plaque_area, plaque_burden = self.metrics
+        self.updateAreaDisplay(lumen_area, plaque_area, plaque_burden, value)       
+
+        lview_length = self.lview.sceneRect().width()
+        lview_height = self.lview.sceneRect().height()
+        
+        xpos = round(self.lview_length*value/self.numberOfFrames)
+        self.lview.updateMarker(xpos)
+        
+    def changeState(self, value):
+        self.c.updateBool.emit(value)
+        self.wid.run()
+
+    def useGated(self, value):
+        self.gated = value
+
+    def errorMessage(self):
+        """Helper function for errors"""
+
+        warning = QMessageBox()
+        warning.setWindowModality(Qt.WindowModal)
+        warning.setWindowTitle('Error')
+        warning.setText('Segmentation must be performed first')
+        warning.exec_()
+
+    def successMessage(self, task):
+        """Helper function for success messages"""
+
+        success = QMessageBox()
+        success.setWindowModality(Qt.WindowModal)
+        success.setWindowTitle('Status')
+        success.setText(task + ' has been successfully completed')
+        success.exec_()
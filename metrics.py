@@ -0,0 +1,117 @@
+from itertools import chain
+import numpy as np
+
+class PackedContours():
+    """Contours of every frame packed into flat coordinate arrays.
+
+    The points of frame i are x[offsets[i]:offsets[i + 1]] and
+    y[offsets[i]:offsets[i + 1]], frames without a contour have no points.
+
+    Attributes:
+        x: np.ndarray, x points of all frames
+        y: np.ndarray, y points of all frames
+        offsets: np.ndarray, index of the first point of each frame followed by the total number of points
+    """
+
+    def __init__(self, x, y, offsets):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+
+    @classmethod
+    def fromLists(cls, contours):
+        """Packs contours given as x and y lists of points for each frame"""
+
+        if isinstance(contours, cls):
+            return contours
+        counts = [len(points) for points in contours[0]]
+        offsets = np.zeros((len(counts) + 1), dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        x = np.fromiter(chain.from_iterable(contours[0]), dtype=np.float64, count=offsets[-1])
+        y = np.fromiter(chain.from_iterable(contours[1]), dtype=np.float64, count=offsets[-1])
+        return cls(x, y, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def counts(self):
+        """Returns the number of points in each frame"""
+        return np.diff(self.offsets)
+
+    def frame(self, idx):
+        """Returns the x and y points of a single frame"""
+        start, stop = self.offsets[idx], self.offsets[idx + 1]
+        return self.x[start:stop], self.y[start:stop]
+
+    def toLists(self):
+        """Returns the contours as x and y lists of points for each frame"""
+        return ([self.x[start:stop].tolist() for start, stop in zip(self.offsets[:-1], self.offsets[1:])],
+            [self.y[start:stop].tolist() for start, stop in zip(self.offsets[:-1], self.offsets[1:])])
+
+def polygon_area(contours):
+    """Calculate the area of the contour in every frame using the Shoelace formula
+
+    Args:
+        contours: PackedContours or list, x and y lists of points for each frame
+    Returns:
+        area: np.ndarray, contour area of each frame in pixels, 0 for frames without a contour
+    """
+
+    packed = PackedContours.fromLists(contours)
+    counts = packed.counts()
+    area = np.zeros((len(packed)))
+    if packed.offsets[-1] == 0:
+        return area
+
+    # index of the previous point, wrapping around within each frame
+    starts = packed.offsets[:-1][counts > 0]
+    stops = packed.offsets[1:][counts > 0]
+    previous = np.arange(packed.offsets[-1]) - 1
+    previous[starts] = stops - 1
+
+    cross = packed.x*packed.y[previous] - packed.y*packed.x[previous]
+    area[counts > 0] = 0.5*np.abs(np.add.reduceat(cross, starts))
+    return area
+
+def contour_metrics(lumen, plaque, resolution):
+    """Computes lumen area, plaque area and plaque burden from contours
+
+    Args:
+        lumen: PackedContours or list, lumen contour of each frame
+        plaque: PackedContours or list, vessel contour of each frame
+        resolution: float, pixel spacing (mm)
+    Returns:
+        (lumen_area, plaque_area, plaque_burden): tuple, arrays with an entry for every
+            frame, 0 for frames without the required contours
+    """
+
+    lumen = PackedContours.fromLists(lumen)
+    plaque = PackedContours.fromLists(plaque)
+    has_lumen = lumen.counts() > 0
+    has_plaque = plaque.counts() > 0
+    both = has_lumen & has_plaque
+
+    lumen_area = polygon_area(lumen)*resolution**2
+    plaque_area = np.where(has_plaque, polygon_area(plaque)*resolution**2 - lumen_area, 0)
+    plaque_burden = np.zeros_like(lumen_area)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plaque_burden[both] = (plaque_area[both]/(lumen_area[both] + plaque_area[both]))*100
+    return (lumen_area, plaque_area, plaque_burden)
+
+def trapezoid_volume(areas, frames, position):
+    """Calculate volume of contoured region using trapezoid formula
+
+    Args:
+        areas: np.ndarray, area of each frame (mm\N{SUPERSCRIPT TWO})
+        frames: list, frames included in the volume in pullback order
+        position: np.ndarray, position of each frame along the pullback (mm)
+    Returns:
+        volume: float, volume (mm\N{SUPERSCRIPT THREE})
+    """
+
+    if len(frames) < 2:
+        return 0
+    frames = np.asarray(frames)
+    areas = np.asarray(areas)[frames]
+    height = np.diff(np.asarray(position)[frames])
+    return float(np.sum((areas[:-1] + areas[1:])/2*height))
@@ -0,0 +1,36 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+class PointIndex():
+    """Nearest point lookup used for mouse hit-testing.
+
+    Points are held in a KD-tree so finding the point under the cursor is
+    logarithmic in the number of points. Each point carries a label which is
+    returned by a query, e.g. the contour and knot index of a spline point.
+
+    Attributes:
+        points: np.ndarray, x and y coordinates of shape (points, 2)
+        labels: list, label of each point
+    """
+
+    def __init__(self, x, y, labels=None):
+        self.points = np.column_stack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)])
+        self.labels = list(range(len(self.points))) if labels is None else list(labels)
+        self.tree = cKDTree(self.points) if len(self.points) else None
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, x, y, max_distance=np.inf):
+        """Returns the label of the point closest to (x, y) and its distance
+
+        Returns:
+            (label, distance): tuple, label is None if no point is within max_distance
+        """
+
+        if self.tree is None:
+            return None, np.inf
+        distance, idx = self.tree.query((x, y), distance_upper_bound=max_distance)
+        if idx == len(self.points):
+            return None, np.inf
+        return self.labels[idx], float(distance)
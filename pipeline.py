@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from IVUS_gating import IVUS_gating
+from metrics import contour_metrics
+from read_dicom import DicomFrames
+
+def pullback_info(dicom, num_frames):
+    """Reads the pullback acquisition parameters from DICOM metadata.
+
+    Args:
+        dicom: pydicom Dataset, pullback metadata
+        num_frames: int, number of frames in the pullback
+    Returns:
+        info: dict, pullback speed (mm/s), resolution (mm), frame rate (frames/s)
+            and position of each frame along the pullback (mm)
+    """
+
+    if dicom.get('IVUSPullbackRate'):
+        speed = float(dicom.IVUSPullbackRate)
+    elif dicom.get(0x000b1001):
+        # check Boston private tag
+        speed = float(dicom[0x000b1001].value)
+    else:
+        speed = 0.5
+
+    if dicom.get('SequenceOfUltrasoundRegions'):
+        if dicom.SequenceOfUltrasoundRegions[0].PhysicalUnitsXDirection == 3:
+            # pixels are in cm, convert to mm
+            resolution = dicom.SequenceOfUltrasoundRegions[0].PhysicalDeltaX*10
+        else:
+            # assume mm
+            resolution = dicom.SequenceOfUltrasoundRegions[0].PhysicalDeltaX
+    else:
+        resolution = float(dicom.PixelSpacing[0])
+
+    if dicom.get('FrameTimeVector'):
+        frameTimeVector = [float(frame) for frame in dicom.get('FrameTimeVector')]
+        position = np.cumsum(frameTimeVector)/1000*speed # assume in ms
+    else:
+        position = np.zeros((num_frames, ))
+
+    return {'speed': speed, 'resolution': float(resolution), 'frame_rate': float(dicom.CineRate), 'position': position}
+
+def find_dicoms(path):
+    """Returns the DICOM files in a directory or listed in a manifest file.
+
+    A manifest is a text file with one DICOM path per line, relative paths
+    are relative to the manifest. Files in a directory are identified by the
+    DICM marker so that files without a .dcm extension are included.
+    """
+
+    if os.path.isdir(path):
+        dicom_paths = []
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path) and is_dicom(file_path):
+                dicom_paths.append(os.path.abspath(file_path))
+        return dicom_paths
+
+    folder = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f]
+    return [os.path.abspath(os.path.join(folder, line)) for line in lines if line and not line.startswith('#')]
+
+def is_dicom(path):
+    """Checks for the DICM marker after the 128 byte preamble"""
+
+    with open(path, 'rb') as f:
+        f.seek(128)
+        return f.read(4) == b'DICM'
+
+def write_report(fname, frames, position, metrics):
+    """Writes a report file containing lumen area, plaque, area, vessel area, plaque burden, phenotype"""
+
+    lumen_area, plaque_area, plaque_burden = metrics
+    vessel_area = lumen_area + plaque_area
+    phenotype = [0]*len(lumen_area)
+
+    f = open(fname + '_report.txt', 'w')
+    f.write('Frame\tPosition (mm)\tLumen area (mm\N{SUPERSCRIPT TWO})\tPlaque area (mm\N{SUPERSCRIPT TWO})\tVessel area (mm\N{SUPERSCRIPT TWO})\tPlaque burden (%)\tphenotype\n')
+    for frame in frames:
+        f.write('{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{}\n'.format(frame, position[frame], lumen_area[frame], plaque_area[frame], vessel_area[frame], plaque_burden[frame], phenotype[frame]))
+    f.close()
+
+def write_contours(lumen, plaque, dims, info, fname):
+    """Writes lumen and plaque contours of every frame to an xml file compatible with Echoplaque"""
+    from write_xml import write_xml
+
+    # reformat data for compatibility with write_xml function
+    x, y = [], []
+    for i in range(len(lumen[0])):
+        x.append(lumen[0][i])
+        x.append(plaque[0][i])
+        y.append(lumen[1][i])
+        y.append(plaque[1][i])
+
+    frames = list(range(dims[0]))
+    write_xml(x, y, dims, info['resolution'], info['speed'], frames, fname)
+
+def predict_masks(images, gatedFrames=None, batch_size=64, predict=None):
+    """Segments the gated frames, or every frame if gatedFrames is None.
+
+    Args:
+        predict: function, segments a batch of images, defaults to the local model
+    Returns:
+        masks: dict, frame number to predicted mask, only segmented frames are included
+    """
+    if predict is None:
+        from IVUS_prediction import predict
+
+    if gatedFrames is None:
+        return dict(enumerate(predict(images, batch_size)))
+    if not len(gatedFrames):
+        return {}
+    return dict(zip(gatedFrames, predict(images[gatedFrames], batch_size)))
+
+def mask_contours(masks, dims, num_workers=0, mode='isocontour', num_angles=64, outside_value=None):
+    """Converts a map of frame to mask into lumen and plaque contours of every frame
+
+    Args:
+        masks: dict, frame number to predicted mask
+        dims: tuple, shape of the pullback
+        num_workers: int, number of worker processes used for isocontour extraction
+        mode: str, 'isocontour' traces the label boundaries, 'polar' casts num_angles rays from the image centre
+        num_angles: int, number of contour points in polar mode
+        outside_value: int, label given to pixels outside the vessel in isocontour mode, 
+            defaults to the largest label of the masks
+    Returns:
+        lumen: list, x and y points of the lumen contour in each frame
+        plaque: list, x and y points of the plaque contour in each frame
+    """
+    from write_xml import get_sparse_contours, get_polar_contours, mask_frames
+
+    if mode == 'polar':
+        return get_polar_contours(masks, dims[1:3], dims[0], num_angles)
+    masks = mask_frames(masks, catheter=0, value=outside_value)
+    return get_sparse_contours(masks, [1.5, 2.5], dims[1:3], dims[0], num_workers)
+
+def prepare_case(dicom_path, gated, window=64):
+    """Reads pullback metadata and extracts end diastolic frames, runs in a worker process"""
+
+    images = DicomFrames(dicom_path, window)
+    info = pullback_info(images.dicom, images.shape[0])
+    gatedFrames = None
+    if gated:
+        gatedFrames = IVUS_gating(images, info['speed'], info['frame_rate'], False)
+    return info, gatedFrames
+
+def finish_case(masks_path, frames, dims, info, fname, contour_mode='isocontour'):
+    """Extracts contours from saved masks and writes the contours and report, runs in a worker process
+
+    Args:
+        masks_path: str, .npy file of the masks of the segmented frames
+        frames: list, frame number of each saved mask
+        dims: tuple, shape of the pullback
+        info: dict, pullback parameters returned by pullback_info
+        fname: str, output filename without extension
+        contour_mode: str, 'isocontour' or 'polar' contour extraction
+    Returns:
+        fname: str, output filename without extension
+    """
+
+    # copy on write so masking does not modify the saved file
+    masks = np.load(masks_path, mmap_mode='c')
+    lumen, plaque = mask_contours(dict(zip(frames, masks)), dims, mode=contour_mode)
+    del masks
+    os.remove(masks_path)
+
+    write_contours(lumen, plaque, dims, info, fname)
+    write_report(fname, frames, info['position'], contour_metrics(lumen, plaque, info['resolution']))
+    return fname
+
+class BatchJournal():
+    """Append only record of finished cases used to resume batch runs.
+
+    Each line is a JSON record with the DICOM path and its status, cases
+    whose last record is done are skipped when the run is restarted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.status = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a partially written line from an interrupted run
+                        continue
+                    self.status[record['dicom']] = record['status']
+
+    def isDone(self, dicom_path):
+        return self.status.get(dicom_path) == 'done'
+
+    def record(self, dicom_path, status, message=''):
+        self.status[dicom_path] = status
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'dicom': dicom_path, 'status': status, 'message': message, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}) + '\n')
+
+def case_names(dicom_paths):
+    """Returns the output name of each case, the file name without extension.
+
+    Cases that share a file name, e.g. IM_0001 in different folders, are
+    suffixed with a hash of their path so their outputs do not overwrite each
+    other. Names depend on the whole list so they are unchanged on a rerun.
+    """
+
+    names = [os.path.splitext(os.path.basename(path))[0] for path in dicom_paths]
+    counts = Counter(names)
+    return {path: name if counts[name] == 1 else '{}_{}'.format(name, hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8])
+        for path, name in zip(dicom_paths, names)}
+
+def run_batch(dicom_paths, output_folder, workers=2, gated=False, batch_size=64, echo=print, contour_mode='isocontour'):
+    """Segments a list of pullbacks and writes contours and reports for each case.
+
+    Gating and contour extraction run in a pool of worker processes while
+    the network runs in this process, so the model is only loaded once and
+    inference on one case overlaps the pre and post processing of others.
+    At most workers cases are gated ahead of the network so that contour
+    extraction of segmented cases is not queued behind the gating of every
+    remaining case.
+    Finished cases are recorded in a journal in output_folder and skipped
+    when the run is restarted.
+
+    Args:
+        dicom_paths: list, paths to the DICOM files
+        output_folder: str, folder for the contours, reports and journal
+        workers: int, number of worker processes
+        gated: bool, segment only end diastolic frames
+        batch_size: int, number of images segmented in each batch
+        echo: function, used to print progress
+        contour_mode: str, 'isocontour' or 'polar' contour extraction
+    Returns:
+        failed: list, DICOM paths that could not be processed
+    """
+    from IVUS_prediction import predict
+
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    journal = BatchJournal(os.path.join(output_folder, 'batch_journal.jsonl'))
+    cases = [path for path in dicom_paths if not journal.isDone(path)]
+    echo('{} cases, {} already finished'.format(len(dicom_paths), len(dicom_paths) - len(cases)))
+
+    names = case_names(dicom_paths)
+
+    failed = []
+    with ProcessPoolExecutor(max(workers, 1)) as executor:
+        prepared = deque((path, executor.submit(prepare_case, path, gated)) for path in cases[:max(workers, 1)])
+        finishing = []
+        for i in range(len(cases)):
+            dicom_path, future = prepared.popleft()
+            fname = os.path.join(output_folder, names[dicom_path])
+            try:
+                info, gatedFrames = future.result()
+                images = DicomFrames(dicom_path)
+                echo('Segmenting case {} of {}: {}'.format(i + 1, len(cases), dicom_path))
+                # only the segmented frames are saved, gated runs never hold a full mask volume
+                frames = list(gatedFrames) if gatedFrames is not None else list(range(images.shape[0]))
+                masks = predict(images[frames], batch_size) if gatedFrames is not None else predict(images, batch_size)
+                masks_path = fname + '_masks.npy'
+                np.save(masks_path, masks)
+                del masks
+                finishing.append((dicom_path, executor.submit(finish_case, masks_path, frames, images.shape, info, fname, contour_mode)))
+            except Exception as e:
+                echo('Case {} failed: {}'.format(dicom_path, e))
+                journal.record(dicom_path, 'failed', str(e))
+                failed.append(dicom_path)
+            # the next case is gated after the contour extraction just submitted
+            if i + len(prepared) + 1 < len(cases):
+                next_path = cases[i + len(prepared) + 1]
+                prepared.append((next_path, executor.submit(prepare_case, next_path, gated)))
+            finishing = collect_finished(finishing, journal, failed, echo)
+
+        for dicom_path, future in finishing:
+            record_result(dicom_path, future, journal, failed, echo)
+
+    return failed
+
+def collect_finished(finishing, journal, failed, echo):
+    """Records cases whose post processing has completed and returns those still running"""
+
+    running = []
+    for dicom_path, future in finishing:
+        if future.done():
+            record_result(dicom_path, future, journal, failed, echo)
+        else:
+            running.append((dicom_path, future))
+    return running
+
+def record_result(dicom_path, future, journal, failed, echo):
+    try:
+        fname = future.result()
+        journal.record(dicom_path, 'done')
+        echo('Finished {}'.format(fname))
+    except Exception as e:
+        echo('Case {} failed: {}'.format(dicom_path, e))
+        journal.record(dicom_path, 'failed', str(e))
+        failed.append(dicom_path)
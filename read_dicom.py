@@ -0,0 +1,203 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pydicom as dcm
+from pydicom.encaps import generate_pixel_data_frame, encapsulate
+
+# elements larger than this are not read when the file is parsed
+DEFER_SIZE = 1024
+
+PIXEL_DATA_TAG = 0x7FE00010
+
+# elements required to decode a single compressed frame
+PIXEL_MODULE = ['SamplesPerPixel', 'PhotometricInterpretation', 'PlanarConfiguration', 'Rows', 'Columns',
+    'BitsAllocated', 'BitsStored', 'HighBit', 'PixelRepresentation']
+
+class DicomFrames():
+    """Frame level reader for multi-frame DICOM pullbacks.
+
+    Uncompressed pixel data is memory mapped directly from the file and
+    compressed pixel data is decoded one frame at a time when requested.
+    Decoded frames are held in a least recently used window so that peak
+    memory is bounded by the window rather than by pullback length.
+
+    Frames are accessed like a numpy array, images[i], images[start:stop],
+    images[frame_list] and images[frames, rows, columns] are supported where
+    the first index selects frames and the remaining indices are applied to
+    every selected frame.
+
+    If a FrameCache is given compressed pullbacks are decoded once into the
+    cache and memory mapped from there when the file is reopened.
+
+    Attributes:
+        path: str, path to the .dcm file
+        dicom: pydicom Dataset, metadata, pixel data is deferred
+        shape: tuple, (frames, rows, columns) or (frames, rows, columns, samples)
+        dtype: np.dtype, pixel data type
+        window: int, maximum number of decoded frames held in memory
+        mapped: bool, indicates whether pixel data is memory mapped (true) or decoded lazily
+    """
+
+    def __init__(self, path, window=64, cache=None):
+        self.path = path
+        self.window = max(int(window), 1)
+        self.dicom = dcm.read_file(path, force=True, defer_size=DEFER_SIZE)
+        self.mapped = False
+        self._decoded = OrderedDict()
+        # frames may be read by the GUI and background threads
+        self._lock = threading.RLock()
+        self._encapsulated = None
+        self._array = None
+
+        num_frames = int(self.dicom.get('NumberOfFrames', 1) or 1)
+        rows, columns = int(self.dicom.Rows), int(self.dicom.Columns)
+        samples = int(self.dicom.get('SamplesPerPixel', 1))
+        self.shape = (num_frames, rows, columns) if samples == 1 else (num_frames, rows, columns, samples)
+
+        transfer_syntax = self.transferSyntax()
+        if transfer_syntax is not None and transfer_syntax.is_compressed:
+            if cache is not None:
+                key = cache.key(path, transfer_syntax)
+                self._array = cache.load(key)
+            if self._array is None:
+                self._encapsulated = list(generate_pixel_data_frame(self.dicom.PixelData))
+                self.dtype = self.frame(0).dtype
+                if cache is not None:
+                    self._array = cache.store(key, self)
+                    self._encapsulated = None
+                    self._decoded.clear()
+            if self._array is not None:
+                self.mapped = True
+                self.dtype = self._array.dtype
+        else:
+            self._array = self.mapPixelData()
+            if self._array is not None:
+                self.mapped = True
+            else:
+                # unsupported layout, fall back to decoding the complete pullback
+                self._array = self.dicom.pixel_array.reshape(self.shape)
+            self.dtype = self._array.dtype
+
+    def transferSyntax(self):
+        """Returns the transfer syntax UID or None if the file has no meta information"""
+
+        file_meta = getattr(self.dicom, 'file_meta', None)
+        if file_meta is None:
+            return None
+        return file_meta.get('TransferSyntaxUID')
+
+    def mapPixelData(self):
+        """Memory maps uncompressed pixel data, returns None if the data cannot be mapped"""
+
+        bits_allocated = int(self.dicom.get('BitsAllocated', 0))
+        if bits_allocated not in (8, 16, 32):
+            return None
+
+        # look up the raw element directly so that the deferred value is not read
+        elements = getattr(self.dicom, '_dict', self.dicom)
+        element = dict.get(elements, PIXEL_DATA_TAG)
+        value_tell = getattr(element, 'value_tell', None)
+        if value_tell is None:
+            return None
+
+        signed = int(self.dicom.get('PixelRepresentation', 0)) == 1
+        dtype = np.dtype('{}{}'.format('i' if signed else 'u', bits_allocated//8))
+        dtype = dtype.newbyteorder('<' if self.dicom.is_little_endian else '>')
+        if element.value is not None or element.length < np.prod(self.shape)*dtype.itemsize:
+            return None
+
+        if len(self.shape) == 4 and int(self.dicom.get('PlanarConfiguration', 0)) == 1:
+            num_frames, rows, columns, samples = self.shape
+            array = np.memmap(self.path, dtype=dtype, mode='r', offset=value_tell, shape=(num_frames, samples, rows, columns))
+            return array.transpose(0, 2, 3, 1)
+
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=value_tell, shape=self.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def frame(self, idx):
+        """Returns a single frame as an array"""
+
+        idx = range(self.shape[0])[idx]
+        if self._array is not None:
+            return self._array[idx]
+
+        with self._lock:
+            return self.decodeFrame(idx)
+
+    def decodeFrame(self, idx):
+        """Decodes a single compressed frame, keeping recently decoded frames in the window"""
+
+        if idx in self._decoded:
+            self._decoded.move_to_end(idx)
+            return self._decoded[idx]
+
+        ds = dcm.Dataset()
+        ds.file_meta = self.dicom.file_meta
+        ds.is_little_endian = self.dicom.is_little_endian
+        ds.is_implicit_VR = self.dicom.is_implicit_VR
+        for keyword in PIXEL_MODULE:
+            if keyword in self.dicom:
+                setattr(ds, keyword, self.dicom.data_element(keyword).value)
+        ds.NumberOfFrames = 1
+        ds.PixelData = encapsulate([self._encapsulated[idx]])
+        image = ds.pixel_array.reshape(self.shape[1:])
+
+        self._decoded[idx] = image
+        if len(self._decoded) > self.window:
+            self._decoded.popitem(last=False)
+        return image
+
+    def frames(self, indices):
+        """Returns the frames at indices stacked into a single array"""
+
+        if self._array is not None:
+            return np.asarray(self._array[indices])
+        images = np.zeros((len(indices),) + self.shape[1:], dtype=self.dtype)
+        for i, idx in enumerate(indices):
+            images[i] = self.frame(idx)
+        return images
+
+    def __getitem__(self, key):
+        if self._array is not None:
+            return self._array[key]
+
+        if not isinstance(key, tuple):
+            key = (key, )
+        frame_key, pixel_key = key[0], key[1:]
+
+        if isinstance(frame_key, (int, np.integer)):
+            return self.frame(int(frame_key))[pixel_key]
+
+        if isinstance(frame_key, slice):
+            indices = range(self.shape[0])[frame_key]
+        else:
+            indices = [int(idx) for idx in np.asarray(frame_key).ravel()]
+
+        # apply the pixel index a window of frames at a time to bound memory
+        blocks = [self.frames(indices[start:start + self.window])[(slice(None), ) + pixel_key] 
+            for start in range(0, len(indices), self.window)]
+        if not blocks:
+            return self.frames(indices)[(slice(None), ) + pixel_key]
+        return np.concatenate(blocks)
+
+    def __iter__(self):
+        for idx in range(self.shape[0]):
+            yield self.frame(idx)
+
+    def iter_chunks(self, chunk_size=None):
+        """Yields (start, frames) tuples of at most chunk_size frames, defaults to the window size"""
+
+        chunk_size = self.window if chunk_size is None else chunk_size
+        for start in range(0, self.shape[0], chunk_size):
+            stop = min(start + chunk_size, self.shape[0])
+            yield start, np.asarray(self[start:stop])
+
+    def __array__(self, dtype=None):
+        images = self.frames(range(self.shape[0]))
+        return images if dtype is None else images.astype(dtype)
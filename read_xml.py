@@ -1,15 +1,101 @@
-import xml.etree.ElementTree as ET
+import re
+import numpy as np
+from metrics import PackedContours
 
-def splitxy(points):
-    """Splits comma separated points into separate x and y lists"""
+CONTOUR_TYPES = (b'L', b'V', b'S')
 
-    pointsX = []
-    pointsY = []
-    for i in range(0, len(points)):
-        pointsX.append(map(lambda x:int(x.split(',')[0]), points[i]))
-        pointsY.append(map(lambda x:int(x.split(',')[1]), points[i]))
+def header_value(header, tag):
+    """Returns the text of the first tag element in the header"""
 
-    return pointsX, pointsY
+    match = re.search(b'<' + tag + b'>([^<]*)</' + tag + b'>', header)
+    return match.group(1).decode().strip() if match else None
+
+def parse_points(pieces):
+    """Parses the text of consecutive <p>x,y</p> elements into x and y arrays"""
+
+    text = b''.join(pieces).replace(b'<p>', b'').replace(b'</p>', b',')
+    values = np.fromstring(text.decode('ascii').rstrip().rstrip(','), dtype=np.int64, sep=',')
+    return values[0::2], values[1::2]
+
+def read_packed(path, frames=None, chunk_size=1 << 22):
+    """Reads an xml contour file into packed arrays.
+
+    The file is read in chunks and each frame record is scanned once as it is
+    completed, so memory and time are linear in the file size. Frames not in
+    the selection are skipped after reading their number and the points of 
+    each contour type are parsed in a single vectorized pass at the end.
+
+    Args:
+        path: str, path to the .xml file (must be in echoplaque format)
+        frames: list, frames that should be included, if empty or None all are included
+        chunk_size: int, number of bytes read at a time
+    Returns:
+        lumen: PackedContours, lumen contour of each included frame
+        vessel: PackedContours, plaque contour of each included frame
+        stent: PackedContours, stent contour of each included frame
+        [xres, yres]: list, x and y pixel spacing
+        [xdim, ydim, zdim]: list, image dimensions and number of frames
+        frame_numbers: np.ndarray, frame number of each included frame in file order
+    """
+
+    selected = set(frames) if frames else None
+    pieces = {contour_type: [] for contour_type in CONTOUR_TYPES}
+    counts = {contour_type: [] for contour_type in CONTOUR_TYPES}
+    frame_numbers = []
+    header = None
+
+    with open(path, 'rb') as f:
+        buffer = b''
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            if header is None:
+                start = buffer.find(b'<Fm>')
+                if start < 0 and chunk:
+                    continue
+                header = buffer if start < 0 else buffer[:start]
+                zdim = int(header_value(header, b'NumberOfFrames'))
+                if selected is None:
+                    selected = range(zdim)
+
+            # process the frame records completed in the buffer
+            end = buffer.rfind(b'</Fm>')
+            if end >= 0:
+                for record in buffer[:end].split(b'</Fm>'):
+                    record = record[record.find(b'<Fm>'):]
+                    num = record.find(b'<Num>')
+                    if num < 0:
+                        continue
+                    frameNo = int(record[num + 5:record.find(b'</Num>', num)])
+                    if frameNo not in selected:
+                        continue
+                    frame_numbers.append(frameNo)
+                    frame_counts = dict.fromkeys(CONTOUR_TYPES, 0)
+                    for ctr in record.split(b'<Ctr>')[1:]:
+                        contour_type = ctr[ctr.find(b'<Type>') + 6:ctr.find(b'</Type>')].strip()
+                        first = ctr.find(b'<p>')
+                        if contour_type not in pieces or first < 0:
+                            continue
+                        points = ctr[first:ctr.rfind(b'</p>') + 4]
+                        pieces[contour_type].append(points)
+                        frame_counts[contour_type] += points.count(b'<p>')
+                    for contour_type in CONTOUR_TYPES:
+                        counts[contour_type].append(frame_counts[contour_type])
+                buffer = buffer[end + 5:]
+            if not chunk:
+                break
+
+    contours = []
+    for contour_type in CONTOUR_TYPES:
+        offsets = np.zeros((len(frame_numbers) + 1), dtype=np.intp)
+        np.cumsum(counts[contour_type], out=offsets[1:])
+        x, y = parse_points(pieces[contour_type])
+        contours.append(PackedContours(x, y, offsets))
+
+    resolution = [header_value(header, b'XCalibration'), header_value(header, b'YCalibration')]
+    dims = [header_value(header, b'Xdim'), header_value(header, b'Ydim'), header_value(header, b'NumberOfFrames')]
+    print('Read {} frames of {} from {}'.format(len(frame_numbers), dims[2], path))
+    return contours[0], contours[1], contours[2], resolution, dims, np.array(frame_numbers, dtype=np.intp)
 
 def read(path, frames=[]):
     """Reads xml file from the specified path.
@@ -22,90 +108,17 @@ def read(path, frames=[]):
         (Vx, Vy): tuple, x and y plaque contours
         (Sx, Sy): tuple, x and y stent contours
         [xres, yres]: list, x and y pixel spacing
-        framelist: list, frames with contours
+        [xdim, ydim, zdim]: list, image dimensions and number of frames
     """
 
-    tree = ET.parse(path)
-    root = tree.getroot()
-    print(root.tag)
-    root.attrib
-    print(root[0].text)
-    lumen_points = []
-    vessel_points = []
-    stent_points = []
-    no_points = []
-    framelist = []
-    lumen={}
-    vessel={}
-    stent={}
-
-    for child in root:
-        # use text to see the values in the tags
-        #print(child.tag, child.text)
-        for imageState in child.iter('ImageState'):
-            xdim = imageState.find('Xdim').text
-            ydim = imageState.find('Ydim').text
-            zdim = imageState.find('NumberOfFrames').text
-            if not frames:
-                frames=range(int(zdim))
-
-        for imageCalibration in child.iter('ImageCalibration'):
-            xres = imageCalibration.find('XCalibration').text
-            yres = imageCalibration.find('YCalibration').text
-            pullbackSpeed = imageCalibration.find('PullbackSpeed').text
-
-        for frameState in child.iter('FrameState'):
-            xOffSet = frameState.find('Xoffset').text
-            yOffSet = frameState.find('Yoffset').text
-            fm = frameState.find('Fm').iter('Num')
-
-            for frame in child.iter('Fm'):
-                frameNo = int(frame.find('Num').text)
-                print('Reading frame no {}'.format(frameNo))
-                # iterate through the frame and identify the contour
-                lumen_subpoints = []
-                vessel_subpoints = []
-                stent_subpoints = []
-                if frameNo in frames:
-                    for pts in frame.iter('Ctr'):
-                        framelist.append(frameNo)
-                        for child in pts:
-                            if child.tag =='Type':
-                                if child.text == 'L':
-                                    contour = 'L'
-                                elif child.text == 'V':
-                                    contour = 'V'
-                                elif child.text == 'S':
-                                    contour= 'S'
-                            if child.tag == 'Npts':
-                                no_points.append(child.text)
-                        # add each point
-                            elif child.tag == 'p':
-                                if contour == 'L':
-                                    lumen_subpoints.append(child.text)
-                                elif contour == 'V':
-                                    vessel_subpoints.append(child.text)
-                                elif contour == 'S':
-                                    stent_subpoints.append(child.text)
-
-                    lumen_points.append(lumen_subpoints)
-                    vessel_points.append(vessel_subpoints)
-                    stent_points.append(stent_subpoints)
-                    lumen[frameNo] = lumen_subpoints
-                    vessel[frameNo] = vessel_subpoints
-                    stent[frameNo] = stent_subpoints
-
-
-    Lx, Ly = splitxy(lumen_points)
-    Vx, Vy = splitxy(vessel_points)
-    Sx, Sy = splitxy(stent_points)
-    pointsY = []
-
-    # return unique frames as we have entry for each inner and outer contour
-    framelist = list(sorted(set(map(int, framelist))))
-
-    print((xdim, ydim, zdim))
-    print((xres, yres))
-
-    #return (Lx, Ly), (Vx, Vy), (Sx, Sy), [xres, yres], framelist
-    return (Lx, Ly), (Vx, Vy), (Sx, Sy), [xres, yres], [xdim, ydim, zdim]
+    lumen, vessel, stent, resolution, dims, _ = read_packed(path, frames)
+    return to_lists(lumen), to_lists(vessel), to_lists(stent), resolution, dims
+
+def to_lists(contours):
+    """Returns packed contours as lists of integer x and y points for each frame"""
+
+    x = contours.x.astype(np.int64)
+    y = contours.y.astype(np.int64)
+    offsets = contours.offsets
+    return ([x[start:stop].tolist() for start, stop in zip(offsets[:-1], offsets[1:])],
+        [y[start:stop].tolist() for start, stop in zip(offsets[:-1], offsets[1:])])
@@ -0,0 +1,215 @@
+import io
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import numpy as np
+
+# the server only binds to the loopback interface
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8725
+
+def inference_config(backend='savedmodel', roi=None, scale=1.0):
+    """Options that change the masks, a client only uses a server with the same options"""
+    return {'backend': backend, 'roi': roi, 'scale': float(scale)}
+
+def describe_config(config):
+    return 'backend {backend}, roi {roi}, scale {scale}'.format(**dict(config, roi=config['roi'] or 'full frame'))
+
+def to_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+def from_bytes(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+class BatchPredictor():
+    """Combines segmentation requests from concurrent clients into shared batches.
+
+    Requests are queued and a single thread runs the model. Once a request
+    arrives the thread waits up to max_wait seconds for requests from other
+    clients with the same frame size, their frames are segmented in one call
+    to predict and the masks are split between the requests.
+
+    Attributes:
+        predict: function, segments images of shape (frames, rows, columns) into masks
+        batch_size: int, number of images on the network at once
+        max_wait: float, seconds a request waits for requests from other clients
+    """
+
+    def __init__(self, predict, batch_size=64, max_wait=0.02):
+        self.predict = predict
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, images):
+        """Queues images and blocks until their masks have been predicted"""
+        request = {'images': images, 'done': threading.Event(), 'masks': None, 'error': None}
+        self.requests.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['masks']
+
+    def collect(self, first):
+        """Returns the first request and queued requests of the same frame size"""
+        batch = [first]
+        deferred = []
+        num_frames = len(first['images'])
+        try:
+            while num_frames < self.batch_size:
+                request = self.requests.get(timeout=self.max_wait)
+                if request['images'].shape[1:] == first['images'].shape[1:]:
+                    batch.append(request)
+                    num_frames += len(request['images'])
+                else:
+                    deferred.append(request)
+        except queue.Empty:
+            pass
+        for request in deferred:
+            self.requests.put(request)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect(self.requests.get())
+            try:
+                images = np.concatenate([request['images'] for request in batch])
+                masks = self.predict(images, self.batch_size)
+                print('Segmented {} frames from {} requests'.format(len(images), len(batch)))
+                start = 0
+                for request in batch:
+                    request['masks'] = masks[start:start + len(request['images'])]
+                    start += len(request['images'])
+            except Exception as error:
+                for request in batch:
+                    request['error'] = error
+            for request in batch:
+                request['done'].set()
+
+class SegmentationHandler(BaseHTTPRequestHandler):
+    """GET /status reports the server is running and its inference options, 
+    POST /segment segments the posted frames.
+
+    Frames and masks are sent as .npy data.
+    """
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_error(404)
+            return
+        body = json.dumps({'status': 'ready', 'batch_size': self.server.predictor.batch_size, 'config': self.server.config}).encode()
+        self.reply(200, body, 'application/json')
+
+    def do_POST(self):
+        if self.path != '/segment':
+            self.send_error(404)
+            return
+        try:
+            images = from_bytes(self.rfile.read(int(self.headers['Content-Length'])))
+            if images.ndim not in (3, 4):
+                raise ValueError('expected frames of shape (frames, rows, columns[, channels]), got {}'.format(images.shape))
+        except Exception as error:
+            self.send_error(400, str(error))
+            return
+        try:
+            masks = self.server.predictor.submit(images)
+        except Exception as error:
+            self.send_error(500, str(error))
+            return
+        self.reply(200, to_bytes(masks), 'application/octet-stream')
+
+    def reply(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class SegmentationServer(ThreadingMixIn, HTTPServer):
+    """HTTP server on the loopback interface handling each client in its own thread"""
+    daemon_threads = True
+
+    def __init__(self, predictor, port=DEFAULT_PORT, config=None):
+        super().__init__((HOST, port), SegmentationHandler)
+        self.predictor = predictor
+        self.config = inference_config() if config is None else config
+
+def serve(port=DEFAULT_PORT, batch_size=64, max_wait=0.02, backend='savedmodel', roi=None, scale=1.0):
+    """Loads the model and segments requests from local clients until interrupted"""
+    from functools import partial
+    from IVUS_prediction import get_backend, predict
+
+    image_size = get_backend(backend).image_size or (512, 512)
+    predict = partial(predict, backend=backend, roi=roi, scale=scale)
+    # trace the network before the first request arrives, at the input size of a fixed size model
+    predict(np.zeros((1, ) + tuple(image_size), dtype=np.uint8), 1)
+
+    config = inference_config(backend, roi, scale)
+    server = SegmentationServer(BatchPredictor(predict, batch_size, max_wait), port, config)
+    print('Serving segmentation on http://{}:{} ({})'.format(HOST, port, describe_config(config)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+class SegmentationClient():
+    """Sends frames to a running segmentation server.
+
+    Proxy settings are ignored so that requests never leave the machine.
+
+    Attributes:
+        port: int, port of the server on the loopback interface
+        chunk_size: int, number of frames sent in each request
+        timeout: float, seconds to wait for each request
+    """
+
+    def __init__(self, port=DEFAULT_PORT, chunk_size=256, timeout=600):
+        self.url = 'http://{}:{}'.format(HOST, port)
+        self.port = port
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    def status(self, timeout=0.5):
+        """Returns the status reported by the server, None if no server is listening on the port"""
+        try:
+            with self.opener.open(self.url + '/status', timeout=timeout) as response:
+                status = json.loads(response.read().decode())
+        except (OSError, ValueError):
+            return None
+        return status if status.get('status') == 'ready' else None
+
+    def available(self, timeout=0.5):
+        """Checks whether a server is listening on the port"""
+        return self.status(timeout) is not None
+
+    def config(self, timeout=0.5):
+        """Returns the inference options of the server, None if no server is listening on the port"""
+        status = self.status(timeout)
+        return None if status is None else status.get('config')
+
+    def predict(self, images, batch_size=64):
+        """Segments images on the server, same interface as IVUS_prediction.predict
+
+        The batch size is set by the server, frames are sent chunk_size at a time.
+        """
+        masks = np.zeros(images.shape[:3], dtype=np.uint8)
+        num_chunks = int(np.ceil(images.shape[0]/self.chunk_size))
+        for i, start in enumerate(range(0, images.shape[0], self.chunk_size)):
+            stop = min(start + self.chunk_size, images.shape[0])
+            request = urllib.request.Request(self.url + '/segment', data=to_bytes(images[start:stop]),
+                headers={'Content-Type': 'application/octet-stream'})
+            with self.opener.open(request, timeout=self.timeout) as response:
+                masks[start:stop] = from_bytes(response.read())
+            print('Chunk {} of {} completed'.format(i+1, num_chunks))
+        return masks
@@ -0,0 +1,20 @@
+import os
+
+class Settings():
+    def __init__(self):
+        self.autoSave = True
+        self.lesion_length = 3
+        self.lesion_merge_length = 1.5
+        self.projects_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "Projects")
+        self.frame_window = 64 # maximum number of decoded frames held in memory
+        self.frame_cache = True
+        self.frame_cache_folder = os.path.join(self.projects_folder, "cache")
+        self.frame_cache_size = 10*1024**3 # bytes
+        self.batch_size = 64 # number of images segmented in each batch
+        self.gating_workers = 0 # number of processes used to compute the gating signals, 0 computes them in the gating thread
+        self.contour_workers = os.cpu_count() or 1 # number of processes used to extract contours from masks
+        self.contour_mode = 'isocontour' # 'isocontour' or 'polar' (ray cast from the image centre)
+        self.contour_angles = 64 # number of rays and contour points in polar mode
+        self.lview_resampling = 'bilinear' # 'bilinear' (background thread) or 'nearest'
+        self.pixmap_cache_size = 32 # number of scaled frames kept for scrubbing and playback
+        self.prefetch_frames = 12 # number of frames scaled ahead in the scrub direction, 0 disables prefetching
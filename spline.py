@@ -0,0 +1,52 @@
+from collections import OrderedDict
+import numpy as np
+from scipy.interpolate import splprep, splev
+
+class SplineEngine():
+    """Evaluates closed interpolating splines through contour knot points.
+
+    Fitted points are cached per key (e.g. frame and contour) together with the
+    knots they were fitted to, so revisiting a frame does not fit the spline
+    again. A knot drag fits the spline exactly on every event, a fit takes
+    0.15-0.3 ms for 10-160 knots (benchmarks/spline_drag.py), which is small
+    next to redrawing the path.
+
+    Attributes:
+        num_points: int, number of points evaluated along the spline
+        cache_size: int, maximum number of cached splines
+    """
+
+    def __init__(self, num_points=500, cache_size=4096):
+        self.num_points = num_points
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def fit(self, knotPoints):
+        """Interpolates the spline at num_points points along the spline"""
+        pts = np.array(knotPoints)
+        tck, u = splprep(pts, u=None, s=0.0, per=1)
+        u_new = np.linspace(u.min(), u.max(), self.num_points)
+        x_new, y_new = splev(u_new, tck, der=0)
+
+        return (x_new, y_new)
+
+    def evaluate(self, knotPoints, key=None):
+        """Returns the spline points, from the cache if the knots of key are unchanged
+
+        The returned arrays are shared with the cache and must not be modified.
+        """
+        if key is None:
+            return self.fit(knotPoints)
+
+        knots = (tuple(knotPoints[0]), tuple(knotPoints[1]))
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == knots:
+            self.cache.move_to_end(key)
+            return cached[1]
+
+        points = self.fit(knotPoints)
+        self.cache[key] = (knots, points)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return points
@@ -0,0 +1,209 @@
+import threading
+from PyQt5.QtCore import QThread, pyqtSignal
+from display import frame_image
+
+class LViewWorker(QThread):
+    """Resamples the lview in a background thread.
+
+    Requests replace any request that has not started and a request that is
+    being computed is abandoned when a newer one arrives, so only the latest
+    crossbar angle is delivered.
+
+    Attributes:
+        resampled: signal emitted with the angle and the lview image of shape (height, length)
+    """
+    resampled = pyqtSignal(float, object)
+
+    def __init__(self, lview_data, images, length, height):
+        super().__init__()
+        self.lview_data = lview_data
+        self.images = images
+        self.length = length
+        self.height = height
+        self.condition = threading.Condition()
+        self.pending = None
+        self.request_id = 0
+        self.stopped = False
+
+    def request(self, angle):
+        with self.condition:
+            self.request_id += 1
+            self.pending = (self.request_id, angle)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.request_id += 1
+            self.condition.notify()
+        self.wait()
+
+    def isStale(self, request_id):
+        return self.stopped or request_id != self.request_id
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                request_id, angle = self.pending
+                self.pending = None
+
+            lview_array = self.lview_data.resample(self.images, angle, self.length, self.height,
+                cancelled=lambda: self.isStale(request_id))
+            if lview_array is not None and not self.isStale(request_id):
+                self.resampled.emit(angle, lview_array)
+
+class FramePrefetcher(QThread):
+    """Scales frames at the display size in a background thread.
+
+    A request replaces the frames of the previous request that have not been
+    scaled yet, so only frames ahead of the latest displayed frame are read.
+
+    Attributes:
+        prefetched: signal emitted with the frame number and its scaled QImage
+    """
+    prefetched = pyqtSignal(int, object)
+
+    def __init__(self, images, display_size):
+        super().__init__()
+        self.images = images
+        self.display_size = display_size
+        self.condition = threading.Condition()
+        self.pending = []
+        self.stopped = False
+
+    def request(self, frames):
+        with self.condition:
+            self.pending = list(frames)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                frame = self.pending.pop(0)
+
+            self.prefetched.emit(frame, frame_image(self.images, frame, self.display_size))
+
+class GatingWorker(QThread):
+    """Extracts end diastolic frames in a background thread.
+
+    Attributes:
+        progress: signal emitted with the number of frame pairs done and the total
+        gated: signal emitted with the end diastolic frames, or None if cancelled
+    """
+    progress = pyqtSignal(int, int)
+    gated = pyqtSignal(object)
+
+    def __init__(self, images, speed, frame_rate, num_workers=0):
+        super().__init__()
+        self.images = images
+        self.speed = speed
+        self.frame_rate = frame_rate
+        self.num_workers = num_workers
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report(self, done, total):
+        self.progress.emit(done, total)
+        return not self.cancelled
+
+    def run(self):
+        from IVUS_gating import gating_signals, end_diastolic_frames
+
+        signals = gating_signals(self.images, num_workers=self.num_workers, callback=self.report)
+        if signals is None or self.cancelled:
+            self.gated.emit(None)
+            return
+        self.gated.emit(end_diastolic_frames(*signals, self.speed, self.frame_rate))
+
+class SegmentationWorker(QThread):
+    """Segments frames and extracts their contours in a background thread.
+
+    Contours are extracted in this thread after each batch and emitted so they 
+    can be shown while later batches are segmented, no processes are forked 
+    while the network runs. Contour levels depend on the largest 
+    label of all masks, so once every batch is done the batches whose largest 
+    label differs are extracted again and emitted a second time.
+
+    Attributes:
+        progress: signal emitted with the number of frames segmented and the total
+        batchSegmented: signal emitted with the frame numbers, masks, and lumen and plaque contours of a batch
+        segmented: signal emitted with True when every frame was segmented, False if cancelled or failed
+        failed: signal emitted with the error message if segmentation failed
+    """
+    progress = pyqtSignal(int, int)
+    batchSegmented = pyqtSignal(object, object, object, object)
+    segmented = pyqtSignal(bool)
+    failed = pyqtSignal(str)
+
+    def __init__(self, images, frames=None, batch_size=64, contour_mode='isocontour', contour_angles=64):
+        super().__init__()
+        self.images = images
+        self.frames = list(range(images.shape[0])) if frames is None else list(frames)
+        self.segmentAll = frames is None
+        self.batch_size = batch_size
+        self.contour_mode = contour_mode
+        self.contour_angles = contour_angles
+        self.batchMaxima = []
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def emitContours(self, start, masks, outside_value=None):
+        """Extracts and emits the contours of the frames start to start + len(masks)"""
+        from pipeline import mask_contours
+
+        frames = self.frames[start:start + len(masks)]
+        # contour extraction modifies the masks
+        lumen, plaque = mask_contours(dict(zip(frames, masks.copy())), self.images.shape, 
+            0, self.contour_mode, self.contour_angles, outside_value)
+        lumen = ([lumen[0][frame] for frame in frames], [lumen[1][frame] for frame in frames])
+        plaque = ([plaque[0][frame] for frame in frames], [plaque[1][frame] for frame in frames])
+        self.batchSegmented.emit(frames, masks.copy(), lumen, plaque)
+
+    def report(self, done, total, masks):
+        self.batchMaxima.append((done - len(masks), len(masks), masks.max()))
+        self.emitContours(done - len(masks), masks)
+        self.progress.emit(done, total)
+        return not self.cancelled
+
+    def run(self):
+        if not self.frames:
+            self.segmented.emit(True)
+            return
+
+        from IVUS_prediction import predict
+
+        try:
+            images = self.images if self.segmentAll else self.images[self.frames]
+            masks = predict(images, self.batch_size, callback=self.report)
+            if masks is None or self.cancelled:
+                self.segmented.emit(False)
+                return
+
+            if self.contour_mode == 'isocontour' and len(masks):
+                value = masks.max()
+                for start, count, batchMax in self.batchMaxima:
+                    if batchMax != value:
+                        self.emitContours(start, masks[start:start + count], value)
+        except Exception as error:
+            self.failed.emit(str(error))
+            self.segmented.emit(False)
+            return
+        self.segmented.emit(True)
@@ -1,12 +1,12 @@
 import xml.etree.ElementTree as et
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import re
 import argparse
 import datetime
 import numpy as np
 import PIL.Image as im
-import matplotlib.path as mplPath
-from skimage import measure
 
 
 def write_project(project_info, project_path):
@@ -48,6 +48,8 @@ def mask_image(mask, catheter):
 
 def label_contours(image, levels):
     """generate contours for labels"""
+    from skimage import measure
+
     # Find contours at a constant value
     contours1 = measure.find_contours(image, levels[0])
     contours2 = measure.find_contours(image, levels[1])
@@ -68,20 +70,25 @@ def label_contours(image, levels):
 
 def keep_largest_contour(contours, image_shape):
     # this function returns the largest contour (num of points) as a numpy array
-    max_length = 0
-    keep_contour = [[], []]
-    for contour in contours:
-        if keep_valid_contour(contour, image_shape):
-            if len(contour[0]) > max_length:
-                keep_contour = [list(contour[1, :]),  list(contour[0, :])]
-                max_length = len(contour[0])            
+    # candidates are tested from longest to shortest (stable for equal lengths) so only
+    # contours up to the first valid one are tested
+    for contour in sorted(contours, key=lambda contour: -len(contour[0])):
+        if len(contour[0]) > 0 and keep_valid_contour(contour, image_shape):
+            return [list(contour[1, :]),  list(contour[0, :])]
 
-    return keep_contour
+    return [[], []]
 
 def keep_valid_contour(contour, image_shape):
     # this function check that the contour is valid if the image centroid is contained within the mask region
-    bbPath = mplPath.Path(np.transpose(contour))
+    import matplotlib.path as mplPath
+
+    # the centroid cannot be inside a contour whose bounding box excludes it
     centroid = [image_shape[0]//2, image_shape[1]//2]
+    if (centroid[0] < contour[0].min() or centroid[0] > contour[0].max() or 
+        centroid[1] < contour[1].min() or centroid[1] > contour[1].max()):
+        return False
+
+    bbPath = mplPath.Path(np.transpose(contour))
     return bbPath.contains_point(centroid)
 	
 def keep_central_contour(contours, image_shape):
@@ -94,11 +101,54 @@ def keep_central_contour(contours, image_shape):
     keep_contour = contours[np.argmin(dist)]
     return keep_contour
 	
-def get_contours(preds, levels, image_shape):
-    """Extracts contours from masked images. Returns x and y coodinates"""
-    # get contours for each image
-    lumen_pred = [[], []]
-    plaque_pred = [[], []]
+def get_contours(preds, levels, image_shape, num_workers=0, chunk_size=16):
+    """Extracts contours from masked images. Returns x and y coodinates
+
+    Args:
+        preds: array, masked images of shape (frames, rows, columns)
+        levels: list, contour levels of the lumen and plaque
+        image_shape: tuple, image height and width
+        num_workers: int, number of worker processes, 0 or 1 extracts the contours in this process
+        chunk_size: int, number of frames sent to a worker at a time
+    Returns:
+        x: list, where alternating entries are lists of lumen/plaque x points
+        y: list, where alternating entries are lists of lumen/plaque y points
+        lumen_pred: list, x and y points of the lumen contour in each frame
+        plaque_pred: list, x and y points of the plaque contour in each frame
+    """
+    chunks = (np.asarray(preds[start:start + chunk_size]) for start in range(0, preds.shape[0], chunk_size))
+    x = []
+    y = []
+    for chunk_x, chunk_y in map_contour_chunks(chunks, levels, image_shape, num_workers):
+        x.extend(chunk_x)
+        y.extend(chunk_y)
+
+    lumen_pred = [x[0::2], y[0::2]]
+    plaque_pred = [x[1::2], y[1::2]]
+
+    return x, y, lumen_pred, plaque_pred
+
+def map_contour_chunks(chunks, levels, image_shape, num_workers=0):
+    """Yields the x and y points of each chunk of masked images in order, chunks are 
+    processed by a pool of num_workers processes if num_workers > 1"""
+
+    if num_workers > 1:
+        # keep a limited number of chunks in flight so memory stays bounded
+        with ProcessPoolExecutor(num_workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(chunk_contours, chunk, levels, image_shape))
+                if len(pending) >= 2*num_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for chunk in chunks:
+            yield chunk_contours(chunk, levels, image_shape)
+
+def chunk_contours(preds, levels, image_shape):
+    """Extracts contours from a chunk of masked images, returns x and y points where 
+    every second entry is the outer contour"""
     x = []
     y = []
     # convert contours to x and y points where every second entry in x and y are outer contours
@@ -118,16 +168,127 @@ def get_contours(preds, levels, image_shape):
             y.append([])
             x.append([])
             y.append([])
-        lumen_pred[0].append(x[-2])
-        lumen_pred[1].append(y[-2])
-        plaque_pred[0].append(x[-1])
-        plaque_pred[1].append(y[-1])        
 
-    return x, y, lumen_pred, plaque_pred
+    return x, y
+
+def mask_frames(masks, catheter, value=None):
+    """Applies mask_image to a map of frame to mask. The outside value is the
+    maximum over all frames so that frames are masked as in a mask volume, 
+    unless value is given"""
+    if not masks:
+        return masks
+
+    outside = 2 if catheter == 1 else 1
+    for mask in masks.values():
+        mask.setflags(write=1)
+        if catheter == 1:
+            mask[mask == 1] = 2
+    if value is None:
+        value = max(mask.max() for mask in masks.values())
+    for mask in masks.values():
+        mask[mask < outside] = value
+
+    return masks
+
+def get_sparse_contours(masks, levels, image_shape, num_frames, num_workers=0, chunk_size=16):
+    """Extracts contours from a map of frame to masked image. Frames without a mask have empty contours
+
+    Args:
+        masks: dict, frame number to masked image
+        levels: list, contour levels of the lumen and plaque
+        image_shape: tuple, image height and width
+        num_frames: int, number of frames in the pullback
+        num_workers: int, number of worker processes, 0 or 1 extracts the contours in this process
+        chunk_size: int, number of frames sent to a worker at a time
+    Returns:
+        lumen_pred: list, x and y points of the lumen contour in each frame
+        plaque_pred: list, x and y points of the plaque contour in each frame
+    """
+    lumen_pred = [[[] for i in range(num_frames)], [[] for i in range(num_frames)]]
+    plaque_pred = [[[] for i in range(num_frames)], [[] for i in range(num_frames)]]
+    frames = list(masks)
+    chunks = (np.stack([masks[frame] for frame in frames[start:start + chunk_size]]) for start in range(0, len(frames), chunk_size))
+    start = 0
+    for x, y in map_contour_chunks(chunks, levels, image_shape, num_workers):
+        for i, frame in enumerate(frames[start:start + len(x)//2]):
+            lumen_pred[0][frame], lumen_pred[1][frame] = x[2*i], y[2*i]
+            plaque_pred[0][frame], plaque_pred[1][frame] = x[2*i + 1], y[2*i + 1]
+        start += len(x)//2
+
+    return lumen_pred, plaque_pred
+
+def get_polar_contours(masks, image_shape, num_frames, num_angles=64, chunk_size=64):
+    """Extracts lumen and vessel contours by casting rays from the image centre through unmasked label images.
+
+    Lumen and vessel are star shaped around the catheter, along each ray the lumen 
+    boundary is the first non lumen pixel after the first lumen pixel and the vessel 
+    boundary is the first pixel that is neither lumen nor plaque after the lumen boundary. 
+    Rays that do not cross the lumen are interpolated from neighbouring rays. Every 
+    contour has num_angles points followed by the first point, as for the closed 
+    contours from get_contours.
+
+    Args:
+        masks: dict, frame number to predicted labels (not masked by mask_image)
+        image_shape: tuple, image height and width
+        num_frames: int, number of frames in the pullback
+        num_angles: int, number of rays and contour points
+        chunk_size: int, number of frames sampled at a time
+    Returns:
+        lumen_pred: list, x and y points of the lumen contour in each frame
+        plaque_pred: list, x and y points of the plaque contour in each frame
+    """
+    lumen_pred = [[[] for i in range(num_frames)], [[] for i in range(num_frames)]]
+    plaque_pred = [[[] for i in range(num_frames)], [[] for i in range(num_frames)]]
+
+    centroid = [image_shape[0]//2, image_shape[1]//2]
+    theta = np.linspace(0, 2*np.pi, num_angles, endpoint=False)
+    radius = np.arange(int(np.hypot(image_shape[0], image_shape[1])//2) + 2)
+    rows = np.rint(centroid[0] + np.outer(np.sin(theta), radius)).astype(np.intp)
+    columns = np.rint(centroid[1] + np.outer(np.cos(theta), radius)).astype(np.intp)
+    outside = (rows < 0) | (rows >= image_shape[0]) | (columns < 0) | (columns >= image_shape[1])
+    rows, columns = np.clip(rows, 0, image_shape[0] - 1), np.clip(columns, 0, image_shape[1] - 1)
+
+    frames = list(masks)
+    for start in range(0, len(frames), chunk_size):
+        chunk = frames[start:start + chunk_size]
+        # labels along every ray, shape (frames, angles, radii)
+        labels = np.stack([masks[frame][rows, columns] for frame in chunk])
+        lumen = (labels == 1) & ~outside
+        vessel = ((labels == 1) | (labels == 2)) & ~outside
+
+        crosses = lumen.any(axis=2)
+        first = np.argmax(lumen, axis=2)
+        lumen_end = first_index(~lumen & (radius >= first[..., np.newaxis]), len(radius))
+        lumen_radius = lumen_end - 0.5
+        for i in np.flatnonzero(crosses.any(axis=1) & ~crosses.all(axis=1)):
+            lumen_radius[i] = np.interp(theta, theta[crosses[i]], lumen_radius[i, crosses[i]], period=2*np.pi)
+            lumen_end[i] = np.ceil(lumen_radius[i])
+        vessel_radius = first_index(~vessel & (radius >= lumen_end[..., np.newaxis]), len(radius)) - 0.5
 
-def write_xml(x, y, dims, resolution, speed, frames, pname):
+        for i, frame in enumerate(chunk):
+            if not crosses[i].any():
+                continue
+            lumen_pred[0][frame], lumen_pred[1][frame] = polar_to_contour(lumen_radius[i], theta, centroid)
+            plaque_pred[0][frame], plaque_pred[1][frame] = polar_to_contour(vessel_radius[i], theta, centroid)
+
+    return lumen_pred, plaque_pred
+
+def first_index(condition, default):
+    """Returns the index of the first true value along the last axis or default if there is none"""
+    return np.where(condition.any(axis=-1), np.argmax(condition, axis=-1), default)
+
+def polar_to_contour(radius, theta, centroid):
+    """Converts ray radii to closed contour x (column) and y (row) points"""
+    x = centroid[1] + radius*np.cos(theta)
+    y = centroid[0] + radius*np.sin(theta)
+    return x.tolist() + x[:1].tolist(), y.tolist() + y[:1].tolist()
+
+def write_xml(x, y, dims, resolution, speed, frames, pname, chunk_frames=256):
     """Write an xml file of contour data
 
+    The header is serialized by ElementTree and the frame records are streamed
+    to the file, the output is identical to serializing the whole tree.
+
     Args:
         x: list, where alternating entries are lists of lume/plaque x points
         y: list, where alternating entries are lists of lume/plaque y points
@@ -136,6 +297,7 @@ def write_xml(x, y, dims, resolution, speed, frames, pname):
         speed: float, speed of pullback mm/s
         frames: list, each entry is an integer indicating that contour is to be included in the output file
         pname: string: name of the output file
+        chunk_frames: int, number of frame records written at a time
     Returns:
         None
     """
@@ -207,33 +369,40 @@ def write_xml(x, y, dims, resolution, speed, frames, pname):
     xoffset.text = str(109)
     yoffset = et.SubElement(framestate, 'Yoffset')
     yoffset.text = str(3)
-    for i in range(num_frames):
-        fm = et.SubElement(framestate, 'Fm')
-        num = et.SubElement(fm, 'Num')
-        num.text = str(i)
-        #num.text = file.split('pred_image')[1].split('.png')[0]
- 
-        if i in frames:
-            frame_idx=[k for k in range(len(frames)) if i==frames[k]][0]
-            for j in range(2):
-                ctr = et.SubElement(fm, 'Ctr')
-                npts = et.SubElement(ctr, 'Npts')
-                npts.text = str(len(x[frame_idx*2+j]))
-                type = et.SubElement(ctr, 'Type')
-                if j == 0:
-                    type.text = 'L'
-                elif j == 1:
-                    type.text = 'V'
-                handdrawn = et.SubElement(ctr, 'HandDrawn')
-                handdrawn.text = 'T'
-                # iterative over the points in each contour
-                for k in range(len(x[frame_idx*2+j])):
-                    p = et.SubElement(ctr, 'p')
-                    p.text = str(int(x[frame_idx*2+j][k])) + ',' + str(int(y[frame_idx*2+j][k]))
-                #print(frame_idx, len(x[frame_idx*2+j]))
- 
-    tree = et.ElementTree(root)
-    tree.write(pname+'_contours.xml')
+
+    # the frame records are written between the frame state offsets and the closing tags
+    header = et.tostring(root, encoding='us-ascii')
+    footer = b'</FrameState></AnalysisState>'
+    header = header[:-len(footer)]
+
+    # position of the first contour pair of each frame
+    frame_idx = {}
+    for k, frame in enumerate(frames):
+        frame_idx.setdefault(frame, k)
+
+    with open(pname+'_contours.xml', 'wb') as f:
+        f.write(header)
+        records = []
+        for i in range(num_frames):
+            records.append('<Fm><Num>{}</Num>'.format(i))
+            if i in frame_idx:
+                for j, contour_type in enumerate(('L', 'V')):
+                    records.append(contour_record(x[frame_idx[i]*2+j], y[frame_idx[i]*2+j], contour_type))
+            records.append('</Fm>')
+            if (i + 1) % chunk_frames == 0:
+                f.write(''.join(records).encode('us-ascii'))
+                records = []
+        f.write(''.join(records).encode('us-ascii'))
+        f.write(footer)
+
+def contour_record(x, y, contour_type):
+    """Returns the Ctr element of a contour, coordinates are truncated to integers"""
+
+    points = np.empty((len(x), 2), dtype=np.int64)
+    points[:, 0] = np.trunc(np.asarray(x, dtype=np.float64))
+    points[:, 1] = np.trunc(np.asarray(y, dtype=np.float64))
+    return ('<Ctr><Npts>{}</Npts><Type>{}</Type><HandDrawn>T</HandDrawn>'.format(len(x), contour_type) 
+        + ('<p>{},{}</p>'*len(x)).format(*points.ravel().tolist()) + '</Ctr>')
 
 
 if __name__ == '__main__':